@@ -1,14 +1,88 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, make_response
+import assets
+import chat_context
+import chat_log
+import chatbot_intents
+import cobooking
+import content_index
 import database as db
-import json
+import images
+import idempotency
+import inventory
+import notifications
+import payments
+import preferences
+import purge
+import sweeper
+import user_recommendations
+import versions
+import waitlist
+from cache import FragmentCache
+from markupsafe import Markup
 from datetime import datetime
+import os
 import re
 import random
+import time
+import uuid
 
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
 
+# Fingerprint and precompress static assets on startup (also: python assets.py)
+assets.build()
+
+# Pending bookings hold their slots for BOOKING_HOLD_TTL seconds; a background
+# sweeper cancels expired holds in batches and gives the slots back
+app.config['BOOKING_HOLD_TTL'] = inventory.HOLD_TTL_SECONDS
+app.config['HOLD_SWEEP_INTERVAL'] = sweeper.SWEEP_INTERVAL_SECONDS
+app.config['HOLD_SWEEP_BATCH_SIZE'] = sweeper.SWEEP_BATCH_SIZE
+
+# Payments are charged by a worker pool against a pluggable gateway
+# (payments.SimulatedGateway unless payments.set_gateway() is called)
+app.config['PAYMENT_WORKERS'] = payments.WORKER_COUNT
+
+# Preferences saved as free text before the link table existed
+preferences.migrate_legacy_rows()
+
+# Conversation state for chatbot follow-ups lives in memory, with a compact
+# copy in the session cookie unless this is turned off
+app.config['CHAT_CONTEXT_IN_SESSION'] = chat_context.KEEP_IN_SESSION
+
+def start_background_workers():
+    """Start the background threads; only the process serving requests
+    runs them (see the bottom of this file)"""
+    sweeper.start(app.config['HOLD_SWEEP_INTERVAL'], app.config['HOLD_SWEEP_BATCH_SIZE'])
+    payments.start_workers(app.config['PAYMENT_WORKERS'])
+    
+    # Deleting a user runs as a chunked background job
+    purge.start_worker()
+    
+    # Slots given back by cancellations are offered to the package waitlist
+    waitlist.start_worker()
+    
+    # Notifications are queued by request handlers and written in batches
+    notifications.start_writer()
+    
+    # Chat exchanges are logged the same way, off the request path
+    chat_log.start_writer()
+    
+    # "Users who booked this also booked" neighbours, kept in memory
+    cobooking.start_worker()
+    
+    # Precomputed "similar packages" for package_detail, rebuilt when listings change
+    content_index.start_worker()
+    
+    # Per-user recommendation results, kept warm for recently active users
+    user_recommendations.start_worker()
+
+# Shared render cache for the package_detail body fragment
+package_body_cache = FragmentCache(max_bytes=16 * 1024 * 1024)
+
+# How long a cached /admin/api/alerts response stays valid for time-based alerts
+ALERTS_WINDOW_SECONDS = 60
+
 # Helper function for password validation
 def is_valid_password(password):
     if len(password) < 6:
@@ -20,6 +94,34 @@ def is_valid_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
+# Helper for conditional GET: the ETag is computed from data versions, so a
+# matching If-None-Match is answered with 304 before build() runs any queries
+def conditional_response(etag_parts, build):
+    # Flashed messages are consumed by the render, so never short-circuit them
+    if session.get('_flashes'):
+        return build()
+    
+    # The header badge is part of every page, so its count is part of the ETag
+    unread = notifications.unread_count(session['user_id']) if 'user_id' in session else None
+    etag = versions.make_etag(
+        session.get('user_id'), session.get('username'), session.get('full_name'),
+        session.get('user_type'), datetime.now().strftime('%Y-%m-%d'), unread, *etag_parts
+    )
+    if etag is None:
+        # This process wrote something the shared versions do not show yet
+        return build()
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = make_response(build())
+        if response.status_code != 200:
+            return response
+    
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
 # Authentication routes
 @app.route('/')
 def index():
@@ -102,6 +204,7 @@ def register():
         result = db.execute_query(insert_query, (username, password, email, full_name, phone, user_type))
         
         if result:
+            versions.users_changed()
             print(f"User registered successfully: {username}")
             flash('Registration successful! Please login.', 'success')
             return redirect(url_for('login'))
@@ -156,43 +259,8 @@ def dashboard():
         """
         recent_bookings = db.execute_query(recent_bookings_query, (user_id,), fetch=True) or []
         
-        # Recommended packages (based on user's preferences and booking history)
-        recommended_query = """
-        SELECT p.*, 
-               COUNT(b.id) as popularity,
-               (SELECT AVG(rating) FROM feedback WHERE package_id = p.id) as avg_rating
-        FROM packages p
-        LEFT JOIN bookings b ON p.id = b.package_id
-        WHERE p.is_active = TRUE
-        AND p.id NOT IN (SELECT package_id FROM bookings WHERE user_id = %s)
-        GROUP BY p.id
-        ORDER BY 
-            CASE WHEN p.category IN (
-                SELECT DISTINCT p2.category 
-                FROM bookings b2 
-                JOIN packages p2 ON b2.package_id = p2.id 
-                WHERE b2.user_id = %s
-            ) THEN 1 ELSE 0 END DESC,
-            popularity DESC,
-            avg_rating DESC
-        LIMIT 6
-        """
-        recommended_packages = db.execute_query(recommended_query, (user_id, user_id), fetch=True) or []
-        
-        # If no recommendations based on history, show popular packages
-        if not recommended_packages:
-            popular_query = """
-            SELECT p.*, 
-                   COUNT(b.id) as booking_count,
-                   (SELECT AVG(rating) FROM feedback WHERE package_id = p.id) as avg_rating
-            FROM packages p
-            LEFT JOIN bookings b ON p.id = b.package_id
-            WHERE p.is_active = TRUE
-            GROUP BY p.id
-            ORDER BY booking_count DESC, avg_rating DESC
-            LIMIT 6
-            """
-            recommended_packages = db.execute_query(popular_query, fetch=True) or []
+        # Same cached results as the recommendations page and the JSON API
+        recommended_packages, _ = user_recommendations.get_packages(user_id, limit=6)
         
         # Get user's favorite categories
         favorite_categories_query = """
@@ -316,64 +384,135 @@ def packages():
     search = request.args.get('search', '')
     sort = request.args.get('sort', 'name')
     
-    query = "SELECT * FROM packages WHERE is_active = TRUE"
-    params = []
-    
-    if category:
-        query += " AND category = %s"
-        params.append(category)
-    
-    if search:
-        query += " AND (name LIKE %s OR destination LIKE %s OR description LIKE %s)"
-        params.extend([f"%{search}%", f"%{search}%", f"%{search}%"])
-    
-    # Improved sorting
-    if sort == 'price_low':
-        query += " ORDER BY price ASC"
-    elif sort == 'price_high':
-        query += " ORDER BY price DESC"
-    elif sort == 'duration':
-        query += " ORDER BY duration_days DESC"
-    elif sort == 'slots':
-        query += " ORDER BY available_slots DESC"
-    else:  # name
-        query += " ORDER BY name ASC"
-    
-    packages_data = db.execute_query(query, params, fetch=True) or []
+    def build():
+        query = "SELECT * FROM packages WHERE is_active = TRUE"
+        params = []
+        
+        if category:
+            query += " AND category = %s"
+            params.append(category)
+        
+        if search:
+            query += " AND (name LIKE %s OR destination LIKE %s OR description LIKE %s)"
+            params.extend([f"%{search}%", f"%{search}%", f"%{search}%"])
+        
+        # Improved sorting
+        if sort == 'price_low':
+            query += " ORDER BY price ASC"
+        elif sort == 'price_high':
+            query += " ORDER BY price DESC"
+        elif sort == 'duration':
+            query += " ORDER BY duration_days DESC"
+        elif sort == 'slots':
+            query += " ORDER BY available_slots DESC"
+        else:  # name
+            query += " ORDER BY name ASC"
+        
+        packages_data = db.execute_query(query, params, fetch=True) or []
+        
+        return render_template('packages.html', packages=packages_data)
     
-    return render_template('packages.html', packages=packages_data)
+    return conditional_response(('packages', request.full_path, versions.catalog_version()), build)
+
+def render_package_detail_body(package_id):
+    """Rendered package body shared by every viewer, cached per data version.
+    Only the per-user shell (package_detail.html) is rendered per request."""
+    key = (package_id, versions.package_version(package_id), versions.feedback_version(package_id),
+           content_index.version(), cobooking.version(), datetime.now().strftime('%Y-%m-%d'))
+    
+    def create():
+        query = "SELECT * FROM packages WHERE id = %s AND is_active = TRUE"
+        package = db.execute_query(query, (package_id,), fetch=True)
+        
+        if not package:
+            return None
+        
+        # Get feedback for this package
+        feedback_query = """
+        SELECT f.*, u.username, u.full_name
+        FROM feedback f 
+        JOIN users u ON f.user_id = u.id 
+        WHERE f.package_id = %s 
+        ORDER BY f.created_at DESC
+        """
+        feedback = db.execute_query(feedback_query, (package_id,), fetch=True) or []
+        
+        # Calculate average rating
+        avg_rating_query = "SELECT AVG(rating) as avg_rating FROM feedback WHERE package_id = %s"
+        avg_rating_result = db.execute_query(avg_rating_query, (package_id,), fetch=True)
+        avg_rating = avg_rating_result[0]['avg_rating'] if avg_rating_result and avg_rating_result[0]['avg_rating'] else 0
+        
+        html = render_template('_package_detail_body.html', 
+                               package=package[0], 
+                               feedback=feedback, 
+                               avg_rating=round(avg_rating, 1),
+                               similar_packages=content_index.similar(package_id),
+                               also_booked=user_recommendations.load_packages(
+                                   [other_id for other_id, _ in cobooking.also_booked(package_id, 4)]))
+        return {'package': package[0], 'html': Markup(html)}
+    
+    return package_body_cache.get_or_create(key, create, sizeof=lambda fragment: len(fragment['html']))
 
 @app.route('/package/<int:package_id>')
 def package_detail(package_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    query = "SELECT * FROM packages WHERE id = %s AND is_active = TRUE"
-    package = db.execute_query(query, (package_id,), fetch=True)
+    def build():
+        fragment = render_package_detail_body(package_id)
+        
+        if not fragment:
+            flash('Package not found or unavailable.', 'error')
+            return redirect(url_for('packages'))
+        
+        waitlist_entry = waitlist.get_entry(session['user_id'], package_id)
+        
+        return render_template('package_detail.html', 
+                             package=fragment['package'], 
+                             package_body=fragment['html'],
+                             waitlist_entry=waitlist_entry)
     
-    if not package:
-        flash('Package not found or unavailable.', 'error')
-        return redirect(url_for('packages'))
+    return conditional_response(
+        ('package_detail', package_id, versions.package_version(package_id), versions.feedback_version(package_id),
+         versions.waitlist_version(package_id),
+         # The neighbour lists themselves, not the per-process index versions
+         [similar['id'] for similar in content_index.similar(package_id)],
+         [other_id for other_id, _ in cobooking.also_booked(package_id, 4)]),
+        build
+    )
+
+@app.route('/waitlist/<int:package_id>/join', methods=['POST'])
+def join_waitlist(package_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
     
-    # Get feedback for this package
-    feedback_query = """
-    SELECT f.*, u.username, u.full_name
-    FROM feedback f 
-    JOIN users u ON f.user_id = u.id 
-    WHERE f.package_id = %s 
-    ORDER BY f.created_at DESC
-    """
-    feedback = db.execute_query(feedback_query, (package_id,), fetch=True) or []
+    try:
+        travelers_count = int(request.form.get('travelers_count', 1))
+    except ValueError:
+        travelers_count = 0
+    if travelers_count < 1:
+        flash('Please select at least one traveler.', 'error')
+        return redirect(url_for('package_detail', package_id=package_id))
     
-    # Calculate average rating
-    avg_rating_query = "SELECT AVG(rating) as avg_rating FROM feedback WHERE package_id = %s"
-    avg_rating_result = db.execute_query(avg_rating_query, (package_id,), fetch=True)
-    avg_rating = avg_rating_result[0]['avg_rating'] if avg_rating_result and avg_rating_result[0]['avg_rating'] else 0
+    joined, message = waitlist.join(session['user_id'], package_id, travelers_count)
+    if joined:
+        flash("You're on the waitlist. We'll hold slots for you as soon as they free up.", 'success')
+    else:
+        flash(message, 'info')
     
-    return render_template('package_detail.html', 
-                         package=package[0], 
-                         feedback=feedback, 
-                         avg_rating=round(avg_rating, 1))
+    return redirect(url_for('package_detail', package_id=package_id))
+
+@app.route('/waitlist/<int:package_id>/leave', methods=['POST'])
+def leave_waitlist(package_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    if waitlist.leave(session['user_id'], package_id):
+        flash('You have left the waitlist.', 'success')
+    else:
+        flash('You are not on the waitlist for this package.', 'info')
+    
+    return redirect(url_for('package_detail', package_id=package_id))
 
 # Remove the old book_package route and replace it with this:
 
@@ -397,30 +536,32 @@ def book_package(package_id):
     
     package = package[0]
     
-    # Check availability
+    if travelers_count < 1:
+        flash('Please select at least one traveler.', 'error')
+        return redirect(url_for('package_detail', package_id=package_id))
+    
+    # Check availability (cheap early exit, the reservation below is authoritative)
     if package['available_slots'] < travelers_count:
-        flash(f'Only {package["available_slots"]} slots available for this package.', 'error')
+        flash(f'Only {package["available_slots"]} slots available for this package. '
+              'You can join the waitlist instead.', 'error')
         return redirect(url_for('package_detail', package_id=package_id))
     
     total_amount = package['price'] * travelers_count
     
-    # Create booking with pending payment status
-    booking_query = """
-    INSERT INTO bookings (user_id, package_id, travelers_count, total_amount, status, payment_status)
-    VALUES (%s, %s, %s, %s, 'pending', 'pending')
-    """
-    result = db.execute_query(booking_query, (user_id, package_id, travelers_count, total_amount))
+    # Reserve the slots and create the pending booking holding them
+    booking_id, message = inventory.hold_booking(user_id, package_id, travelers_count, total_amount,
+                                                 hold_ttl=app.config['BOOKING_HOLD_TTL'])
     
-    if result:
-        # Get the booking ID
-        booking_id_query = "SELECT LAST_INSERT_ID() as booking_id"
-        booking_id_result = db.execute_query(booking_id_query, fetch=True)
-        booking_id = booking_id_result[0]['booking_id'] if booking_id_result else None
-        
+    if booking_id:
+        notifications.notify_booking(
+            user_id, booking_id, 'Booking reserved',
+            f"Booking TB{booking_id:04d} for {package['name']} is reserved for you. "
+            f"Complete the payment within {app.config['BOOKING_HOLD_TTL'] // 60} minutes to confirm it."
+        )
         # Redirect to payment page
         return redirect(url_for('payment_page', booking_id=booking_id))
     else:
-        flash('Booking failed. Please try again.', 'error')
+        flash(message, 'error')
         return redirect(url_for('package_detail', package_id=package_id))
 
 # Payment System Routes
@@ -445,13 +586,17 @@ def payment_page(booking_id):
     
     booking = booking[0]
     
-    return render_template('payment.html', booking=booking)
+    # One key per rendered payment page, reused by every retry from it
+    return render_template('payment.html', booking=booking, idempotency_key=uuid.uuid4().hex)
 
 @app.route('/process_payment/<int:booking_id>', methods=['POST'])
 def process_payment(booking_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Please login first'})
     
+    user_id = session['user_id']
+    key = None
+    
     try:
         card_number = request.form['card_number']
         card_holder = request.form['card_holder']
@@ -465,47 +610,62 @@ def process_payment(booking_id):
         if len(cvv) != 3 or not cvv.isdigit():
             return jsonify({'success': False, 'message': 'Invalid CVV'})
         
-        # Simulate payment processing
-        import random
-        transaction_id = f"TXN{random.randint(100000, 999999)}"
-        
-        # Update booking with payment details
-        update_query = """
-        UPDATE bookings 
-        SET status = 'confirmed', 
-            payment_status = 'completed',
-            payment_method = 'Credit Card',
-            transaction_id = %s,
-            card_last_four = %s,
-            payment_date = NOW()
-        WHERE id = %s AND user_id = %s
-        """
-        result = db.execute_query(update_query, (
-            transaction_id, 
-            card_number[-4:], 
-            booking_id, 
-            session['user_id']
-        ))
-        
-        if result:
-            # Update package available slots
-            booking_query = "SELECT * FROM bookings WHERE id = %s"
-            booking = db.execute_query(booking_query, (booking_id,), fetch=True)
-            if booking:
-                update_slots_query = "UPDATE packages SET available_slots = available_slots - %s WHERE id = %s"
-                db.execute_query(update_slots_query, (booking[0]['travelers_count'], booking[0]['package_id']))
-            
-            return jsonify({
-                'success': True, 
-                'message': 'Payment successful!',
-                'transaction_id': transaction_id
-            })
-        else:
-            return jsonify({'success': False, 'message': 'Payment processing failed'})
+        # Retries with the same Idempotency-Key get the stored response back
+        # without touching bookings or packages again
+        client_key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key', '')
+        key = f"payment:{booking_id}:{client_key}"[:idempotency.MAX_KEY_LENGTH]
+        state, stored = idempotency.begin(user_id, key)
+        if state == idempotency.COMPLETED:
+            stored_response, status_code = stored
+            return jsonify(stored_response), status_code
+        if state == idempotency.IN_PROGRESS:
+            return jsonify({'success': False, 'in_progress': True,
+                            'message': 'This payment is already being processed.'}), 409
+        
+        # Queue the charge; a payment worker talks to the gateway and the
+        # page polls payment_status for the outcome. The check and the insert
+        # run in one transaction under the booking row lock.
+        job_id, message = payments.enqueue_payment(booking_id, user_id, card_number[-4:])
+        if not job_id:
+            idempotency.release(user_id, key)
+            return jsonify({'success': False, 'message': message})
+        
+        response = {
+            'success': True,
+            'queued': True,
+            'message': message,
+            'job_id': job_id,
+            'status_url': url_for('payment_status', job_id=job_id)
+        }
+        idempotency.complete(user_id, key, response, 202)
+        return jsonify(response), 202
             
     except Exception as e:
+        if key:
+            idempotency.release(user_id, key)
         return jsonify({'success': False, 'message': f'Payment error: {str(e)}'})
 
+@app.route('/payment_status/<int:job_id>')
+def payment_status(job_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Please login first'}), 401
+    
+    job = payments.get_job(job_id, session['user_id'])
+    if not job:
+        return jsonify({'success': False, 'message': 'Payment not found'}), 404
+    
+    response = jsonify({
+        'job_id': job['id'],
+        'booking_id': job['booking_id'],
+        'status': job['status'],
+        'done': job['status'] in (payments.SUCCEEDED, payments.FAILED),
+        'success': job['status'] == payments.SUCCEEDED,
+        'message': job['message'] or 'Processing payment...',
+        'transaction_id': job['transaction_id']
+    })
+    response.cache_control.no_store = True
+    return response
+
 @app.route('/booking_confirmation/<int:booking_id>')
 def booking_confirmation(booking_id):
     if 'user_id' not in session:
@@ -543,74 +703,41 @@ def chat():
     
     user_message = request.json.get('message', '').lower().strip()
     
+    # Cookie sessions have no id of their own, so a chat gets one on first use
+    if 'chat_session_id' not in session:
+        session['chat_session_id'] = uuid.uuid4().hex
+    
+    # What the chat asked for so far, so follow-ups like "which region?" resolve
+    context = chat_context.get(session['chat_session_id'], session.get('chat_context'))
+    
     # Generate bot response based on user message
-    bot_response = generate_chatbot_response(user_message, session['user_id'])
+    bot_response = generate_chatbot_response(user_message, session['user_id'], context)
     
-    # Save conversation to database (optional)
-    try:
-        query = """
-        INSERT INTO chatbot_conversations (user_id, session_id, user_message, bot_response)
-        VALUES (%s, %s, %s, %s)
-        """
-        db.execute_query(query, (session['user_id'], session.sid, user_message, bot_response))
-    except:
-        pass  # Skip if saving fails
+    compact = chat_context.save(session['chat_session_id'], context)
+    if app.config['CHAT_CONTEXT_IN_SESSION']:
+        session['chat_context'] = compact
+    
+    # Logged by a background writer in batches; a full queue drops the row
+    chat_log.log(session['user_id'], session['chat_session_id'], user_message, bot_response)
     
     return jsonify({'response': bot_response})
 
-def generate_chatbot_response(user_message, user_id):
+def generate_chatbot_response(user_message, user_id, context=None):
     """Simple AI chatbot that suggests Indian travel destinations"""
     
-    # Greeting patterns
-    greetings = ['hi', 'hello', 'hey', 'hola', 'namaste']
-    if any(greet in user_message for greet in greetings):
-        return "Namaste! 👋 I'm your travel assistant. I can help you discover amazing places in India! Where would you like to go? You can ask about beaches, mountains, cultural sites, adventure, or budget travel."
-    
-    # Help patterns
-    if 'help' in user_message or 'what can you do' in user_message:
-        return "I can help you: 🌴 Suggest travel destinations in India 💰 Recommend packages based on your budget 🏔️ Tell you about different types of tourism 🎯 Help you choose based on your interests Just tell me what you're looking for!"
-    
-    # Destination suggestions based on keywords
-    responses = {
-        'beach': "🏖️ Perfect! For beaches, I recommend:\n• Goa - Famous beaches & nightlife\n• Andaman - Crystal clear waters\n• Kerala - Serene backwaters & beaches\n• Karnataka - Unexplored coastal beauty\nWould you like details about any specific beach destination?",
-        
-        'mountain': "🏔️ Great choice! Mountain destinations:\n• Himachal - Manali, Shimla, Dharamshala\n• Uttarakhand - Rishikesh, Mussoorie, Nainital\n• Sikkim - Gangtok, beautiful monasteries\n• Kashmir - Paradise on earth\nWhich region interests you most?",
-        
-        'cultural': "🏛️ India's rich culture awaits!\n• Rajasthan - Palaces & forts\n• Varanasi - Spiritual capital\n• Tamil Nadu - Ancient temples\n• Delhi/Agra - Historical monuments\n• Kerala - Traditional art forms\nTell me which aspect of culture interests you!",
-        
-        'adventure': "🚀 Adventure time!\n• Rishikesh - River rafting & bungee\n• Manali - Trekking & skiing\n• Ladakh - Motorcycle trips\n• Andaman - Scuba diving\n• Goa - Water sports\nWhat kind of adventure excites you?",
-        
-        'budget': "💰 Budget-friendly options:\n• Rishikesh - Spiritual & affordable\n• McLeod Ganj - Tibetan culture\n• Hampi - Ancient ruins\n• Pushkar - Cultural experience\n• Varkala - Cliff beach\nWhat's your budget range?",
-        
-        'luxury': "✨ Luxury experiences:\n• Udaipur - Palace hotels\n• Kerala - Luxury houseboats\n• Goa - 5-star beach resorts\n• Jaipur - Heritage palaces\n• Shimla - Luxury mountain resorts\nInterested in any specific luxury experience?",
-        
-        'wildlife': "🦁 Wildlife adventures:\n• Ranthambore - Tiger safari\n• Jim Corbett - Oldest national park\n• Kaziranga - One-horned rhinos\n• Gir - Asiatic lions\n• Periyar - Elephant reserve\nWhich wildlife experience interests you?",
-        
-        'spiritual': "🕉️ Spiritual journeys:\n• Varanasi - Ganga Aarti\n• Amritsar - Golden Temple\n• Bodh Gaya - Buddhist pilgrimage\n• Tirupati - Temple visit\n• Haridwar - Religious ceremonies\nLooking for any specific spiritual experience?"
-    }
-    
-    # Check for keywords in user message
-    for keyword, response in responses.items():
-        if keyword in user_message:
-            return response
-    
-    # Budget queries
-    if 'cheap' in user_message or 'low budget' in user_message or 'economy' in user_message:
-        return "For budget travel (under ₹10,000):\n• Rishikesh - Yoga & adventure\n• McLeod Ganj - Tibetan culture\n• Hampi - Ancient ruins\n• Pushkar - Desert culture\n• Varkala - Cliff beach\nWould you like package details?"
-    
-    if 'medium' in user_message or 'moderate' in user_message or '15k' in user_message or '20k' in user_message:
-        return "For moderate budget (₹15,000-25,000):\n• Goa - Beach vacation\n• Manali - Mountain escape\n• Rajasthan - Cultural tour\n• Kerala - Backwaters\n• Andaman - Island adventure\nShall I show you available packages?"
-    
-    if 'expensive' in user_message or 'luxury' in user_message or 'high' in user_message or '30k' in user_message:
-        return "For luxury experiences (₹30,000+):\n• Udaipur - Palace stay\n• Kerala - Luxury houseboat\n• Goa - 5-star resorts\n• Shimla - Luxury mountain retreat\n• Andaman - Private island experience\nInterested in luxury packages?"
+    # One pass over the compiled intent table (see chatbot_intents.INTENTS)
+    intent = chatbot_intents.classify(user_message)
     
-    # Package booking related
-    if 'book' in user_message or 'package' in user_message or 'tour' in user_message:
-        return "Great! You can browse all available packages in the 'Packages' section. Once you find one you like, click 'Book Now' and I'll guide you through the payment process. Would you like me to show you some popular packages?"
+    # Questions about what to book are answered from the in-memory catalog,
+    # filling in what the conversation said before (see chat_context)
+    if context is None:
+        context = chat_context.new_context()
+    catalog_answer = chat_context.resolve(user_message, intent, context)
+    if catalog_answer:
+        return catalog_answer
     
-    # Payment related
-    if 'payment' in user_message or 'pay' in user_message or 'card' in user_message or 'bank' in user_message:
-        return "Our payment process is secure and easy:\n1. Select your package\n2. Choose number of travelers\n3. Review booking summary\n4. Enter payment details\n5. Get instant confirmation\nAll major credit/debit cards and UPI are accepted! 💳"
+    if intent:
+        return intent['response']
     
     # Default response
     default_responses = [
@@ -645,28 +772,55 @@ def cancel_booking(booking_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    # Get booking details first
-    booking_query = "SELECT * FROM bookings WHERE id = %s AND user_id = %s"
-    booking = db.execute_query(booking_query, (booking_id, session['user_id']), fetch=True)
-    
-    if not booking:
-        flash('Booking not found.', 'error')
-        return redirect(url_for('bookings'))
+    # Cancel the booking and release the slots it holds
+    booking, message = inventory.transition_booking(booking_id, 'cancelled', user_id=session['user_id'])
     
-    # Update booking status and restore slots
-    update_query = "UPDATE bookings SET status = 'cancelled' WHERE id = %s"
-    result = db.execute_query(update_query, (booking_id,))
-    
-    if result:
-        # Restore available slots
-        restore_slots_query = "UPDATE packages SET available_slots = available_slots + %s WHERE id = %s"
-        db.execute_query(restore_slots_query, (booking[0]['travelers_count'], booking[0]['package_id']))
+    if booking:
+        notifications.notify_booking(session['user_id'], booking_id, 'Booking cancelled',
+                                     f"Booking TB{booking_id:04d} has been cancelled.")
         flash('Booking cancelled successfully.', 'success')
     else:
-        flash('Failed to cancel booking.', 'error')
+        flash(message or 'Failed to cancel booking.', 'error')
     
     return redirect(url_for('bookings'))
 
+@app.route('/notifications')
+def notifications_page():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    page = max(1, request.args.get('page', 1, type=int))
+    user_notifications, total_pages = notifications.get_page(session['user_id'], page)
+    
+    return render_template('notifications.html',
+                         notifications=user_notifications,
+                         unread_count=notifications.unread_count(session['user_id']),
+                         page=page,
+                         total_pages=total_pages)
+
+@app.route('/notifications/mark-read', methods=['POST'])
+def mark_notifications_read():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Please login first'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        notification_ids = [int(i) for i in data.get('notification_ids') or [data.get('notification_id')]]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid notification id'}), 400
+    
+    updated = notifications.mark_read(session['user_id'], notification_ids)
+    return jsonify({'success': True, 'updated': updated,
+                    'unread_count': notifications.unread_count(session['user_id'])})
+
+@app.route('/notifications/mark-all-read', methods=['POST'])
+def mark_all_notifications_read():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Please login first'}), 401
+    
+    updated = notifications.mark_all_read(session['user_id'])
+    return jsonify({'success': True, 'updated': updated, 'unread_count': 0})
+
 @app.route('/feedback')
 def feedback():
     if 'user_id' not in session:
@@ -778,6 +932,8 @@ def submit_feedback():
             result = db.execute_query(update_query, (rating_int, comment, existing_feedback[0]['id']))
             
             if result:
+                versions.feedback_changed(package_id)
+                cobooking.record_booking(user_id, int(package_id), rating=rating_int)
                 # Update booking to mark feedback as submitted
                 update_booking_query = "UPDATE bookings SET feedback_submitted = TRUE, feedback_id = %s WHERE id = %s"
                 db.execute_query(update_booking_query, (existing_feedback[0]['id'], booking_id))
@@ -794,6 +950,8 @@ def submit_feedback():
             result = db.execute_query(insert_query, (user_id, package_id, booking_id, rating_int, comment))
             
             if result:
+                versions.feedback_changed(package_id)
+                cobooking.record_booking(user_id, int(package_id), rating=rating_int)
                 # Get the new feedback ID
                 feedback_id_query = "SELECT LAST_INSERT_ID() as feedback_id"
                 feedback_id_result = db.execute_query(feedback_id_query, fetch=True)
@@ -822,10 +980,6 @@ def recommendations():
     
     user_id = session['user_id']
     
-    # Get user preferences
-    pref_query = "SELECT * FROM user_preferences WHERE user_id = %s"
-    preferences = db.execute_query(pref_query, (user_id,), fetch=True)
-    
     # Get booking history for personalized recommendations
     booking_history_query = """
     SELECT p.category, p.destination, COUNT(*) as visit_count
@@ -837,58 +991,12 @@ def recommendations():
     """
     booking_history = db.execute_query(booking_history_query, (user_id,), fetch=True) or []
     
-    # Generate recommendations based on preferences and history
-    recommended_packages = []
-    
-    if preferences:
-        pref = preferences[0]
-        query = "SELECT * FROM packages WHERE is_active = TRUE"
-        params = []
-        
-        conditions = []
-        
-        if pref.get('preferred_destinations'):
-            destinations = [d.strip() for d in pref['preferred_destinations'].split(',')]
-            placeholders = ','.join(['%s'] * len(destinations))
-            conditions.append(f"destination IN ({placeholders})")
-            params.extend(destinations)
-        
-        if pref.get('budget_range'):
-            if pref['budget_range'] == 'low':
-                conditions.append("price < 10000")
-            elif pref['budget_range'] == 'medium':
-                conditions.append("price BETWEEN 10000 AND 25000")
-            elif pref['budget_range'] == 'high':
-                conditions.append("price > 25000")
-        
-        if pref.get('travel_style'):
-            conditions.append("category = %s")
-            params.append(pref['travel_style'])
-        
-        if conditions:
-            query += " AND " + " AND ".join(conditions)
-        
-        query += " ORDER BY RAND() LIMIT 6"
-        recommended_packages = db.execute_query(query, params, fetch=True) or []
-    
-    # If no preferences or not enough recommendations, add popular packages
-    if len(recommended_packages) < 3:
-        popular_query = """
-        SELECT p.*, COUNT(b.id) as booking_count
-        FROM packages p 
-        LEFT JOIN bookings b ON p.id = b.package_id 
-        WHERE p.is_active = TRUE
-        GROUP BY p.id 
-        ORDER BY booking_count DESC 
-        LIMIT %s
-        """
-        additional_count = 6 - len(recommended_packages)
-        popular_packages = db.execute_query(popular_query, (additional_count,), fetch=True) or []
-        recommended_packages.extend(popular_packages)
+    # Preferences and picks come from the per-user result cache
+    recommended_packages, result = user_recommendations.get_packages(user_id, limit=6)
     
     return render_template('recommendations.html', 
-                         packages=recommended_packages[:6], 
-                         preferences=preferences[0] if preferences else None,
+                         packages=recommended_packages, 
+                         preferences=result['preferences'],
                          booking_history=booking_history)
 
 @app.route('/update_preferences', methods=['POST'])
@@ -902,27 +1010,15 @@ def update_preferences():
     travel_style = request.form.get('travel_style', '')
     interests = request.form.get('interests', '')
     
-    # Check if preferences exist
-    check_query = "SELECT id FROM user_preferences WHERE user_id = %s"
-    existing = db.execute_query(check_query, (user_id,), fetch=True)
-    
-    if existing:
-        # Update existing preferences
-        query = """
-        UPDATE user_preferences 
-        SET preferred_destinations = %s, budget_range = %s, travel_style = %s, interests = %s 
-        WHERE user_id = %s
-        """
-        result = db.execute_query(query, (destinations, budget_range, travel_style, interests, user_id))
-        flash('Preferences updated successfully!', 'success')
-    else:
-        # Insert new preferences
-        query = """
-        INSERT INTO user_preferences (user_id, preferred_destinations, budget_range, travel_style, interests)
-        VALUES (%s, %s, %s, %s, %s)
-        """
-        result = db.execute_query(query, (user_id, destinations, budget_range, travel_style, interests))
+    # Stored as typed plus normalized destinations and numeric budget bounds
+    try:
+        preferences.save(user_id, destinations, budget_range, travel_style, interests)
         flash('Preferences saved successfully!', 'success')
+    except db.Error as e:
+        print(f"Error saving preferences: {e}")
+        flash('Failed to save preferences. Please try again.', 'error')
+    
+    user_recommendations.invalidate(user_id)
     
     return redirect(url_for('recommendations'))
 
@@ -1221,6 +1317,10 @@ def add_package():
             result = db.execute_query(query, (name, description, destination, duration_days, price, category, image_url, available_slots, session['user_id'], available_slots))
             
             if result:
+                versions.package_changed()
+                versions.listing_changed()
+                content_index.refresh()
+                images.schedule_derivatives(result, image_url)
                 print(f"Package added successfully: {name}")
                 flash('Package added successfully!', 'success')
                 return redirect(url_for('admin_packages'))
@@ -1258,6 +1358,9 @@ def create_test_package():
         ))
         
         if result:
+            versions.package_changed()
+            versions.listing_changed()
+            content_index.refresh()
             flash('Test package created successfully!', 'success')
         else:
             flash('Failed to create test package.', 'error')
@@ -1294,6 +1397,12 @@ def edit_package(package_id):
             result = db.execute_query(query, (name, description, destination, duration_days, price, category, image_url, available_slots, is_active, package_id))
             
             if result:
+                # Striped packages keep their slots in the stripes, spread the new count over them
+                inventory.configure_stripes(package_id, total=available_slots)
+                versions.package_changed(package_id)
+                versions.listing_changed()
+                content_index.refresh()
+                images.schedule_derivatives(package_id, image_url)
                 flash('Package updated successfully!', 'success')
                 return redirect(url_for('admin_packages'))
             else:
@@ -1345,6 +1454,9 @@ def toggle_package(package_id):
         
         query = "UPDATE packages SET is_active = %s WHERE id = %s"
         result = db.execute_query(query, (new_status, package_id))
+        versions.package_changed(package_id)
+        versions.listing_changed()
+        content_index.refresh()
         
         if result:
             status_text = "activated" if new_status else "deactivated"
@@ -1386,13 +1498,14 @@ def admin_confirm_booking(booking_id):
     if 'user_id' not in session or session['user_type'] != 'admin':
         return redirect(url_for('login'))
     
-    query = "UPDATE bookings SET status = 'confirmed' WHERE id = %s"
-    result = db.execute_query(query, (booking_id,))
+    booking, message = inventory.transition_booking(booking_id, 'confirmed')
     
-    if result:
+    if booking:
+        notifications.notify_booking(booking['user_id'], booking_id, 'Booking confirmed',
+                                     f"Booking TB{booking_id:04d} has been confirmed by our team.")
         flash('Booking confirmed successfully!', 'success')
     else:
-        flash('Failed to confirm booking.', 'error')
+        flash(message or 'Failed to confirm booking.', 'error')
     
     return redirect(url_for('admin_bookings'))
 
@@ -1401,22 +1514,15 @@ def admin_cancel_booking(booking_id):
     if 'user_id' not in session or session['user_type'] != 'admin':
         return redirect(url_for('login'))
     
-    # Get booking details to restore slots
-    booking_query = "SELECT * FROM bookings WHERE id = %s"
-    booking = db.execute_query(booking_query, (booking_id,), fetch=True)
+    # Cancel the booking and release the slots it holds
+    booking, message = inventory.transition_booking(booking_id, 'cancelled')
     
     if booking:
-        # Restore available slots
-        restore_slots_query = "UPDATE packages SET available_slots = available_slots + %s WHERE id = %s"
-        db.execute_query(restore_slots_query, (booking[0]['travelers_count'], booking[0]['package_id']))
-    
-    query = "UPDATE bookings SET status = 'cancelled' WHERE id = %s"
-    result = db.execute_query(query, (booking_id,))
-    
-    if result:
+        notifications.notify_booking(booking['user_id'], booking_id, 'Booking cancelled',
+                                     f"Booking TB{booking_id:04d} has been cancelled by our team.")
         flash('Booking cancelled successfully!', 'success')
     else:
-        flash('Failed to cancel booking.', 'error')
+        flash(message or 'Failed to cancel booking.', 'error')
     
     return redirect(url_for('admin_bookings'))
 
@@ -1429,24 +1535,61 @@ def admin_update_booking_status(booking_id, status):
         flash('Invalid status.', 'error')
         return redirect(url_for('admin_bookings'))
     
-    # If cancelling, restore slots
-    if status == 'cancelled':
-        booking_query = "SELECT * FROM bookings WHERE id = %s"
-        booking = db.execute_query(booking_query, (booking_id,), fetch=True)
-        if booking:
-            restore_slots_query = "UPDATE packages SET available_slots = available_slots + %s WHERE id = %s"
-            db.execute_query(restore_slots_query, (booking[0]['travelers_count'], booking[0]['package_id']))
-    
-    query = "UPDATE bookings SET status = %s WHERE id = %s"
-    result = db.execute_query(query, (status, booking_id))
+    # Cancelling releases held slots, any other status reserves them if needed
+    booking, message = inventory.transition_booking(booking_id, status)
     
-    if result:
+    if booking:
+        notifications.notify_booking(booking['user_id'], booking_id, f'Booking {status}',
+                                     f"Booking TB{booking_id:04d} is now {status}.")
         flash(f'Booking status updated to {status}.', 'success')
     else:
-        flash('Failed to update booking status.', 'error')
+        flash(message or 'Failed to update booking status.', 'error')
     
     return redirect(url_for('admin_bookings'))
 
+@app.route('/admin/api/bookings/bulk_status', methods=['POST'])
+def admin_api_bulk_booking_status():
+    if 'user_id' not in session or session['user_type'] != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    status = data.get('status')
+    if status not in ['pending', 'confirmed', 'cancelled']:
+        return jsonify({'success': False, 'message': 'Invalid status.'}), 400
+    
+    booking_ids = data.get('booking_ids')
+    filters = data.get('filter')
+    if booking_ids is None and not filters:
+        return jsonify({'success': False, 'message': 'Provide booking_ids or a filter.'}), 400
+    try:
+        if booking_ids is not None:
+            booking_ids = [int(booking_id) for booking_id in booking_ids]
+            if len(booking_ids) > inventory.MAX_BULK_BOOKINGS:
+                return jsonify({'success': False,
+                                'message': f'At most {inventory.MAX_BULK_BOOKINGS} bookings per request.'}), 400
+            results = inventory.bulk_transition(status, booking_ids=booking_ids)
+        else:
+            if not isinstance(filters, dict):
+                raise ValueError('filter must be an object')
+            filters = {key: filters.get(key) for key in ('status', 'package_id', 'user_id', 'booked_before')}
+            results = inventory.bulk_transition(status, filters=filters)
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Invalid request: {e}'}), 400
+    
+    counts = {}
+    for result in results:
+        counts[result['result']] = counts.get(result['result'], 0) + 1
+        if result['result'] == 'updated':
+            notifications.notify_booking(result['user_id'], result['booking_id'], f'Booking {status}',
+                                         f"Booking TB{result['booking_id']:04d} is now {status}.")
+    
+    return jsonify({
+        'success': True,
+        'status': status,
+        'summary': counts,
+        'results': results
+    })
+
 # Admin user management routes
 @app.route('/admin/make_admin/<int:user_id>')
 def make_admin(user_id):
@@ -1461,6 +1604,7 @@ def make_admin(user_id):
     result = db.execute_query(query, (user_id,))
     
     if result:
+        versions.users_changed()
         flash('User promoted to administrator successfully!', 'success')
     else:
         flash('Failed to promote user.', 'error')
@@ -1480,6 +1624,7 @@ def revoke_admin(user_id):
     result = db.execute_query(query, (user_id,))
     
     if result:
+        versions.users_changed()
         flash('Administrator privileges revoked successfully!', 'success')
     else:
         flash('Failed to revoke admin privileges.', 'error')
@@ -1495,116 +1640,263 @@ def delete_user(user_id):
         flash('You cannot delete your own account.', 'error')
         return redirect(url_for('admin_users'))
     
-    # First delete related records to maintain database integrity
-    try:
-        # Delete user's feedback
-        db.execute_query("DELETE FROM feedback WHERE user_id = %s", (user_id,))
-        # Delete user's preferences
-        db.execute_query("DELETE FROM user_preferences WHERE user_id = %s", (user_id,))
-        # Delete user's bookings
-        db.execute_query("DELETE FROM bookings WHERE user_id = %s", (user_id,))
-        # Finally delete the user
-        result = db.execute_query("DELETE FROM users WHERE id = %s", (user_id,))
-        
-        if result:
-            flash('User deleted successfully!', 'success')
-        else:
-            flash('Failed to delete user.', 'error')
-            
-    except Exception as e:
-        flash(f'Error deleting user: {str(e)}', 'error')
+    # The user's rows are deleted in small chunks by the purge worker;
+    # admin_users polls the job for progress
+    job_id = purge.enqueue_purge(user_id, session['user_id'])
+    
+    if job_id:
+        flash('User deletion started.', 'success')
+        return redirect(url_for('admin_users', purge_job=job_id))
     
+    flash('Failed to delete user.', 'error')
     return redirect(url_for('admin_users'))
 
-# API routes
-@app.route('/admin/api/alerts')
-def admin_api_alerts():
+@app.route('/admin/api/purge_jobs/<int:job_id>')
+def admin_api_purge_job(job_id):
     if 'user_id' not in session or session['user_type'] != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
     
-    alerts = []
+    job = purge.get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Purge job not found'}), 404
+    
+    response = jsonify({
+        'job_id': job['id'],
+        'user_id': job['user_id'],
+        'status': job['status'],
+        'step': job['step'],
+        'total_rows': job['total_rows'],
+        'deleted_rows': job['deleted_rows'],
+        'released_slots': job['released_slots'],
+        'percent': job['percent'],
+        'message': job['message']
+    })
+    response.cache_control.no_store = True
+    return response
+
+# API routes
+def _availability_response(payload):
+    response = jsonify(payload)
+    response.cache_control.private = True
+    response.cache_control.max_age = inventory.AVAILABILITY_TTL
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/api/package/<int:package_id>/availability')
+def api_package_availability(package_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
     
-    # Low stock alerts
-    low_stock = db.execute_query("""
-        SELECT name, available_slots 
-        FROM packages 
-        WHERE is_active = TRUE AND available_slots < 3
-    """, fetch=True) or []
-    
-    for package in low_stock:
-        alerts.append({
-            'type': 'warning',
-            'message': f'Low stock: {package["name"]} - only {package["available_slots"]} slots left',
-            'icon': 'exclamation-triangle'
-        })
+    availability = inventory.get_package_availability(package_id)
+    if not availability:
+        return jsonify({'error': 'Package not found'}), 404
     
-    # Pending bookings
-    pending = db.execute_query("SELECT COUNT(*) as count FROM bookings WHERE status = 'pending'", fetch=True)
-    if pending and pending[0]['count'] > 0:
-        alerts.append({
-            'type': 'info',
-            'message': f'{pending[0]["count"]} pending bookings need review',
-            'icon': 'clock'
-        })
+    return _availability_response(availability)
+
+@app.route('/api/packages/availability')
+def api_packages_availability():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
     
-    # No recent bookings (last 6 hours)
-    recent_bookings = db.execute_query("""
-        SELECT COUNT(*) as count FROM bookings 
-        WHERE booking_date >= DATE_SUB(NOW(), INTERVAL 6 HOUR)
-    """, fetch=True)
-    if recent_bookings and recent_bookings[0]['count'] == 0:
-        alerts.append({
-            'type': 'danger',
-            'message': 'No bookings in the last 6 hours',
-            'icon': 'chart-line'
-        })
+    try:
+        package_ids = sorted({int(i) for i in request.args.get('ids', '').split(',') if i.strip()})
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma separated list of package ids'}), 400
+    
+    if len(package_ids) > inventory.MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {inventory.MAX_BATCH_SIZE} package ids per request'}), 400
+    
+    availability = inventory.get_availability(package_ids)
     
-    return jsonify({'alerts': alerts})
+    return _availability_response({
+        'packages': [availability[i] for i in package_ids if i in availability],
+        'missing': [i for i in package_ids if i not in availability]
+    })
+
+@app.route('/api/user/<int:user_id>/recommendations')
+def api_user_recommendations(user_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Please login first'}), 401
+    if session['user_id'] != user_id and session.get('user_type') != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    try:
+        limit = min(max(int(request.args.get('limit', 6)), 1), user_recommendations.MAX_RESULTS)
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    
+    packages, result = user_recommendations.get_packages(user_id, limit=limit)
+    response = jsonify({
+        'user_id': user_id,
+        'generated_at': result['generated_at'].isoformat(),
+        'packages': [{
+            'id': package['id'],
+            'name': package['name'],
+            'destination': package['destination'],
+            'category': package['category'],
+            'price': float(package['price']),
+            'duration_days': package['duration_days'],
+            'image_url': images.image_src(package, 640),
+            'available_slots': package['available_slots'],
+            'reason': package['recommendation_reason']
+        } for package in packages]
+    })
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/admin/api/alerts')
+def admin_api_alerts():
+    if 'user_id' not in session or session['user_type'] != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    def build():
+        alerts = []
+        
+        # Low stock alerts
+        low_stock = db.execute_query("""
+            SELECT name, available_slots 
+            FROM packages 
+            WHERE is_active = TRUE AND available_slots < 3
+        """, fetch=True) or []
+        
+        for package in low_stock:
+            alerts.append({
+                'type': 'warning',
+                'message': f'Low stock: {package["name"]} - only {package["available_slots"]} slots left',
+                'icon': 'exclamation-triangle'
+            })
+        
+        # Pending bookings
+        pending = db.execute_query("SELECT COUNT(*) as count FROM bookings WHERE status = 'pending'", fetch=True)
+        if pending and pending[0]['count'] > 0:
+            alerts.append({
+                'type': 'info',
+                'message': f'{pending[0]["count"]} pending bookings need review',
+                'icon': 'clock'
+            })
+        
+        # No recent bookings (last 6 hours)
+        recent_bookings = db.execute_query("""
+            SELECT COUNT(*) as count FROM bookings 
+            WHERE booking_date >= DATE_SUB(NOW(), INTERVAL 6 HOUR)
+        """, fetch=True)
+        if recent_bookings and recent_bookings[0]['count'] == 0:
+            alerts.append({
+                'type': 'danger',
+                'message': 'No bookings in the last 6 hours',
+                'icon': 'chart-line'
+            })
+        
+        return jsonify({'alerts': alerts})
+    
+    # Alerts also depend on the clock (no bookings in the last 6 hours)
+    return conditional_response(('admin_alerts', versions.stats_version(), int(time.time() // ALERTS_WINDOW_SECONDS)), build)
 
 @app.route('/admin/api/stats')
 def admin_api_stats():
     if 'user_id' not in session or session['user_type'] != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
     
-    total_revenue_query = "SELECT SUM(total_amount) as revenue FROM bookings WHERE status = 'confirmed'"
-    total_revenue_result = db.execute_query(total_revenue_query, fetch=True)
-    total_revenue = total_revenue_result[0]['revenue'] if total_revenue_result and total_revenue_result[0]['revenue'] else 0
+    def build():
+        total_revenue_query = "SELECT SUM(total_amount) as revenue FROM bookings WHERE status = 'confirmed'"
+        total_revenue_result = db.execute_query(total_revenue_query, fetch=True)
+        total_revenue = total_revenue_result[0]['revenue'] if total_revenue_result and total_revenue_result[0]['revenue'] else 0
+        
+        total_bookings_query = "SELECT COUNT(*) as count FROM bookings"
+        total_bookings_result = db.execute_query(total_bookings_query, fetch=True)
+        total_bookings = total_bookings_result[0]['count'] if total_bookings_result else 0
+        
+        total_users_query = "SELECT COUNT(*) as count FROM users WHERE user_type = 'user'"
+        total_users_result = db.execute_query(total_users_query, fetch=True)
+        total_users = total_users_result[0]['count'] if total_users_result else 0
+        
+        total_packages_query = "SELECT COUNT(*) as count FROM packages WHERE is_active = TRUE"
+        total_packages_result = db.execute_query(total_packages_query, fetch=True)
+        total_packages = total_packages_result[0]['count'] if total_packages_result else 0
+        
+        return jsonify({
+            'total_revenue': total_revenue,
+            'total_bookings': total_bookings,
+            'total_users': total_users,
+            'total_packages': total_packages
+        })
     
-    total_bookings_query = "SELECT COUNT(*) as count FROM bookings"
-    total_bookings_result = db.execute_query(total_bookings_query, fetch=True)
-    total_bookings = total_bookings_result[0]['count'] if total_bookings_result else 0
+    return conditional_response(('admin_stats', versions.stats_version()), build)
+
+
+@app.route('/admin/api/hold_sweeper')
+def admin_api_hold_sweeper():
+    if 'user_id' not in session or session['user_type'] != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    total_users_query = "SELECT COUNT(*) as count FROM users WHERE user_type = 'user'"
-    total_users_result = db.execute_query(total_users_query, fetch=True)
-    total_users = total_users_result[0]['count'] if total_users_result else 0
+    return jsonify(dict(sweeper.get_metrics(),
+                        hold_ttl_seconds=app.config['BOOKING_HOLD_TTL'],
+                        interval_seconds=app.config['HOLD_SWEEP_INTERVAL'],
+                        batch_size=app.config['HOLD_SWEEP_BATCH_SIZE']))
+
+@app.route('/admin/api/chat_log')
+def admin_api_chat_log():
+    if 'user_id' not in session or session['user_type'] != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    total_packages_query = "SELECT COUNT(*) as count FROM packages WHERE is_active = TRUE"
-    total_packages_result = db.execute_query(total_packages_query, fetch=True)
-    total_packages = total_packages_result[0]['count'] if total_packages_result else 0
+    return jsonify(dict(chat_log.get_metrics(),
+                        batch_size=chat_log.BATCH_SIZE,
+                        flush_interval_seconds=chat_log.FLUSH_INTERVAL_SECONDS))
+
+@app.route('/admin/api/chat_context')
+def admin_api_chat_context():
+    if 'user_id' not in session or session['user_type'] != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    return jsonify({
-        'total_revenue': total_revenue,
-        'total_bookings': total_bookings,
-        'total_users': total_users,
-        'total_packages': total_packages
-    })
+    return jsonify(dict(chat_context.get_metrics(),
+                        kept_in_session=app.config['CHAT_CONTEXT_IN_SESSION']))
 
+@app.route('/admin/api/package/<int:package_id>/inventory_stripes', methods=['POST'])
+def admin_api_inventory_stripes(package_id):
+    if 'user_id' not in session or session['user_type'] != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        stripe_count = int(data.get('stripes', 0))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'stripes must be a number'}), 400
+    if stripe_count < 0 or stripe_count > inventory.MAX_STRIPES:
+        return jsonify({'success': False,
+                        'message': f'stripes must be between 0 and {inventory.MAX_STRIPES}'}), 400
+    
+    stripes = inventory.configure_stripes(package_id, stripe_count)
+    if stripes is None:
+        return jsonify({'success': False, 'message': 'Package not found or update failed'}), 404
+    
+    return jsonify({'success': True, 'package_id': package_id, 'stripes': stripes,
+                    'availability': inventory.get_package_availability(package_id)})
 
 @app.route('/debug/packages')
 def debug_packages():
     if 'user_id' not in session or session['user_type'] != 'admin':
         return redirect(url_for('login'))
     
-    # Get all packages for debugging
-    packages_query = "SELECT * FROM packages"
-    packages = db.execute_query(packages_query, fetch=True) or []
-    
-    debug_info = {
-        'total_packages': len(packages),
-        'packages': packages
-    }
+    def build():
+        # Get all packages for debugging
+        packages_query = "SELECT * FROM packages"
+        packages = db.execute_query(packages_query, fetch=True) or []
+        
+        debug_info = {
+            'total_packages': len(packages),
+            'packages': packages
+        }
+        
+        return jsonify(debug_info)
     
-    return jsonify(debug_info)
+    return conditional_response(('debug_packages', versions.catalog_version()), build)
+
+# Fingerprinted static assets (see assets.py)
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    return assets.send_asset(filename)
 
 @app.route('/debug/routes')
 def debug_routes():
@@ -1622,5 +1914,28 @@ def debug_routes():
 def inject_today():
     return {'today': datetime.now().strftime('%Y-%m-%d')}
 
+@app.context_processor
+def inject_asset_url():
+    return {'asset_url': assets.asset_url}
+
+@app.context_processor
+def inject_image_helpers():
+    return {'image_src': images.image_src, 'image_srcset': images.image_srcset}
+
+@app.context_processor
+def inject_unread_notifications():
+    # Served from the per-user counter cache, not a COUNT per page view
+    if 'user_id' not in session:
+        return {}
+    return {'unread_notifications': notifications.unread_count(session['user_id'])}
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # The debug reloader runs this file twice: a watcher process that only
+    # restarts the server, and the child that serves requests, which has
+    # WERKZEUG_RUN_MAIN set. Only the child runs the workers.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
+    app.run(debug=True)
+else:
+    # Imported by a WSGI server
+    start_background_workers()
\ No newline at end of file
@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+from flask import request, send_from_directory, url_for, abort
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip is always generated
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Static files that get fingerprinted copies, relative to static/
+SOURCE_FILES = ('style.css', 'landing.css', 'script.js')
+MIMETYPES = {'.css': 'text/css', '.js': 'application/javascript'}
+# Fingerprinted names change with their content, so they can be cached forever
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+_manifest = None
+
+
+def _write_if_missing(path, data):
+    if not os.path.exists(path):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+
+def build():
+    """Write content-hashed, precompressed copies of SOURCE_FILES and the manifest"""
+    global _manifest
+    os.makedirs(DIST_DIR, exist_ok=True)
+    manifest = {}
+
+    for filename in SOURCE_FILES:
+        source_path = os.path.join(STATIC_DIR, filename)
+        if not os.path.isfile(source_path):
+            logger.warning(f"Static asset not found: {filename}")
+            continue
+
+        with open(source_path, 'rb') as f:
+            content = f.read()
+
+        stem, ext = os.path.splitext(filename)
+        hashed_name = f"{stem}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+        hashed_path = os.path.join(DIST_DIR, hashed_name)
+
+        _write_if_missing(hashed_path, content)
+        _write_if_missing(f"{hashed_path}.gz", gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write_if_missing(f"{hashed_path}.br", brotli.compress(content, quality=11))
+
+        manifest[filename] = hashed_name
+
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    _manifest = manifest
+    logger.info(f"Built {len(manifest)} static assets")
+    return manifest
+
+
+def _load_manifest():
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(MANIFEST_PATH) as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+def asset_url(filename):
+    """url_for('static', ...) replacement that points at the fingerprinted copy"""
+    hashed_name = _load_manifest().get(filename)
+    if hashed_name is None:
+        return url_for('static', filename=filename)
+    return url_for('serve_asset', filename=hashed_name)
+
+
+def send_asset(filename):
+    """Serve a fingerprinted file, picking the best precompressed variant"""
+    if filename not in _load_manifest().values():
+        abort(404)
+
+    mimetype = MIMETYPES.get(os.path.splitext(filename)[1], 'application/octet-stream')
+    encoding = None
+    served_name = filename
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[candidate] and os.path.exists(os.path.join(DIST_DIR, filename + suffix)):
+            encoding = candidate
+            served_name = filename + suffix
+            break
+
+    response = send_from_directory(DIST_DIR, served_name, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+if __name__ == '__main__':
+    for source, hashed in build().items():
+        print(f"{source} -> dist/{hashed}")
@@ -0,0 +1,104 @@
+"""Per-message latency of the chatbot intent engine as the intent table grows.
+
+Pads the real intent table with synthetic intents until it holds the
+requested number of phrases, compiles it, and times classify() over a fixed
+mix of chat messages. For comparison it times the old approach, a linear
+scan of `phrase in message` checks over the same table (which also shows
+how often the substring scan picks a different, wrong intent).
+
+Needs no database.
+
+    python benchmarks/intent_benchmark.py --phrases 100 1000 10000 --repeat 2000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chatbot_intents
+
+MESSAGES = [
+    'hi there',
+    'is this tour good for kids',
+    'i want a beach holiday under 15k',
+    'looking for a trek in the himalayas',
+    'something in the scottish highlands maybe',
+    'how do i pay with upi',
+    'what can you do',
+    'suggest a cheap heritage trip with forts and palaces',
+    'we love wildlife and a tiger safari',
+    'anything nice for our anniversary',
+]
+
+
+def synthetic_table(phrase_count, rng):
+    """The real intents plus made-up ones until there are phrase_count phrases"""
+    intents = list(chatbot_intents.INTENTS)
+    phrases = sum(len(intent['phrases']) for intent in intents)
+    number = 0
+    while phrases < phrase_count:
+        size = min(10, phrase_count - phrases)
+        intents.append({
+            'name': f'synthetic_{number}',
+            'priority': rng.randint(1, 60),
+            'phrases': [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+                        for _ in range(size)],
+            'response': ''
+        })
+        phrases += size
+        number += 1
+    return intents
+
+
+def linear_classify(intents, message):
+    """The substring checks generate_chatbot_response used to run"""
+    for intent in sorted(intents, key=lambda intent: -intent['priority']):
+        if any(phrase in message for phrase in intent['phrases']):
+            return intent
+    return None
+
+
+def time_per_message(classify, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for message in MESSAGES:
+            classify(message)
+    return (time.perf_counter() - started) / (repeat * len(MESSAGES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--phrases', type=int, nargs='+', default=[100, 1000, 5000, 20000])
+    parser.add_argument('--repeat', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    print(f"{'phrases':>8} {'compile ms':>11} {'engine us/msg':>14} {'linear us/msg':>14} {'disagree':>9}")
+    for phrase_count in args.phrases:
+        intents = synthetic_table(phrase_count, rng)
+        started = time.perf_counter()
+        engine = chatbot_intents.IntentEngine(intents)
+        compile_ms = (time.perf_counter() - started) * 1000
+
+        engine_us = time_per_message(engine.classify, args.repeat) * 1e6
+        linear_us = time_per_message(lambda message: linear_classify(intents, message), args.repeat) * 1e6
+        disagree = sum(
+            (engine.classify(message) or {}).get('name') != (linear_classify(intents, message) or {}).get('name')
+            for message in MESSAGES
+        )
+        print(f"{phrase_count:>8} {compile_ms:>11.1f} {engine_us:>14.1f} {linear_us:>14.1f} "
+              f"{disagree:>4}/{len(MESSAGES)}")
+
+    print()
+    for message in MESSAGES:
+        intent = chatbot_intents.classify(message)
+        print(f"{message!r:60} -> {intent['name'] if intent else '(default)'}")
+
+
+if __name__ == '__main__':
+    main()
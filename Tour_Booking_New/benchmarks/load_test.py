@@ -0,0 +1,382 @@
+"""End-to-end load test of the booking funnel against a running app.
+
+Provisions throwaway users and packages in the app's MySQL database, then
+starts virtual user sessions at a Poisson arrival rate. Each session logs in
+and follows one of these scenarios, picked by --mix:
+
+    browse  /login, /packages, /package/<id>
+    book    browse, then /book_package/<id> and /process_payment/<id>
+    cancel  browse, then /book_package/<id> and /cancel_booking/<id>
+    abandon browse, then /book_package/<id> and leave the hold to expire
+
+Reports throughput, p50/p95/p99 latency and error rate per route, checks that
+no package was oversold once the payment queue has drained:
+
+    live available_slots >= 0
+    live available_slots + SUM(bookings.slots_held) == initial slots
+
+and writes everything to a JSON file so runs can be compared over time.
+Only needs the standard library and the app's database module.
+
+    python app.py &
+    python benchmarks/load_test.py --rate 20 --duration 60 --mix browse=0.5,book=0.3,cancel=0.1,abandon=0.1
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+USER_PREFIX = 'loadtest_user_'
+PACKAGE_NAME = 'Load Test Package'
+TEST_CARD = {
+    'card_number': '4111 1111 1111 1111',
+    'card_holder': 'Load Test',
+    'expiry_date': '12/30',
+    'cvv': '123'
+}
+SCENARIOS = ('browse', 'book', 'cancel', 'abandon')
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Hand redirects back to the caller, the Location tells us what happened"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.rejections = defaultdict(int)
+        self.scenarios = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, error=False, rejected=False):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            if error:
+                self.errors[route] += 1
+            if rejected:
+                self.rejections[route] += 1
+
+    def scenario(self, name):
+        with self._lock:
+            self.scenarios[name] += 1
+
+
+class Client:
+    """One virtual user: its own cookie jar, so its own Flask session"""
+
+    def __init__(self, base_url, recorder, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            NoRedirect
+        )
+
+    def request(self, route, path, data=None, headers=None, expect=None):
+        """Send one request and record its latency under `route`.
+        Returns (status, location, body); status is None on connection errors.
+        `expect(status, location, body)` decides whether the app turned the
+        request down (sold out, already cancelled) rather than failing."""
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers or {})
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                status, location, content = response.status, response.headers.get('Location', ''), response.read()
+        except urllib.error.HTTPError as e:
+            status, location, content = e.code, e.headers.get('Location', ''), e.read()
+        except (urllib.error.URLError, OSError):
+            self.recorder.record(route, time.perf_counter() - started, error=True)
+            return None, '', b''
+        elapsed = time.perf_counter() - started
+
+        error = status >= 500 or (status >= 400 and status != 409)
+        rejected = not error and expect is not None and not expect(status, location, content)
+        self.recorder.record(route, elapsed, error=error, rejected=rejected)
+        return status, location, content
+
+
+def provision(users, packages, slots):
+    """Create the load-test users and packages. Returns (usernames, {package_id: slots})."""
+    usernames = []
+    for i in range(users):
+        username = f"{USER_PREFIX}{i}"
+        exists = db.execute_query("SELECT id FROM users WHERE username = %s", (username,), fetch=True)
+        if not exists:
+            db.execute_query("""
+            INSERT INTO users (username, password, email, full_name, phone, user_type)
+            VALUES (%s, 'loadtest', %s, 'Load Test', '', 'user')
+            """, (username, f"{username}@example.com"))
+        usernames.append(username)
+
+    package_slots = {}
+    for i in range(packages):
+        package_id = db.execute_query("""
+        INSERT INTO packages (name, description, destination, duration_days, price, category, image_url, available_slots, is_active, max_slots)
+        VALUES (%s, 'Temporary package for load tests', 'Nowhere', 1, 1000, 'Test', '', %s, TRUE, %s)
+        """, (f"{PACKAGE_NAME} {i + 1}", slots, slots))
+        package_slots[package_id] = slots
+    return usernames, package_slots
+
+
+def cleanup(package_slots, usernames):
+    """Delete the test packages and what the run left behind for the test users"""
+    user_placeholders = ','.join(['%s'] * len(usernames))
+    for table in ('notifications', 'idempotency_keys'):
+        db.execute_query(f"DELETE FROM {table} WHERE user_id IN (SELECT id FROM users WHERE username IN ({user_placeholders}))",
+                         usernames)
+    placeholders = ','.join(['%s'] * len(package_slots))
+    package_ids = list(package_slots)
+    db.execute_query(f"DELETE FROM payment_jobs WHERE booking_id IN (SELECT id FROM bookings WHERE package_id IN ({placeholders}))", package_ids)
+    db.execute_query(f"DELETE FROM bookings WHERE package_id IN ({placeholders})", package_ids)
+    db.execute_query(f"DELETE FROM package_inventory_stripes WHERE package_id IN ({placeholders})", package_ids)
+    db.execute_query(f"DELETE FROM packages WHERE id IN ({placeholders})", package_ids)
+
+
+def browse(client, username, package_ids):
+    client.request('/login', '/login', {'username': username, 'password': 'loadtest'},
+                   expect=lambda status, location, body: 'login' not in location)
+    client.request('/packages', '/packages')
+    package_id = random.choice(package_ids)
+    client.request('/package/<id>', f"/package/{package_id}")
+    return package_id
+
+
+def book(client, package_id, travel_date):
+    status, location, _ = client.request(
+        '/book_package', f"/book_package/{package_id}",
+        {'travelers_count': random.randint(1, 3), 'travel_date': travel_date},
+        expect=lambda status, location, body: '/payment/' in location
+    )
+    match = re.search(r'/payment/(\d+)', location or '')
+    return int(match.group(1)) if match else None
+
+
+def pay(client, booking_id, poll_timeout):
+    def accepted(status, location, body):
+        try:
+            return json.loads(body).get('success', False)
+        except ValueError:
+            return False
+
+    status, _, body = client.request(
+        '/process_payment', f"/process_payment/{booking_id}", TEST_CARD,
+        headers={'Idempotency-Key': uuid.uuid4().hex}, expect=accepted
+    )
+    if status != 202 or not poll_timeout:
+        return
+    status_url = json.loads(body).get('status_url')
+    deadline = time.monotonic() + poll_timeout
+    while status_url and time.monotonic() < deadline:
+        _, _, body = client.request('/payment_status/<id>', status_url)
+        try:
+            if json.loads(body).get('done'):
+                return
+        except ValueError:
+            return
+        time.sleep(0.5)
+
+
+def cancel(client, booking_id):
+    client.request('/cancel_booking', f"/cancel_booking/{booking_id}",
+                   expect=lambda status, location, body: '/bookings' in location)
+
+
+def run_session(args, recorder, scenario, usernames, package_ids):
+    recorder.scenario(scenario)
+    client = Client(args.base_url, recorder, args.timeout)
+    package_id = browse(client, random.choice(usernames), package_ids)
+    if scenario == 'browse':
+        return
+
+    travel_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
+    booking_id = book(client, package_id, travel_date)
+    if booking_id is None:
+        return
+    if scenario == 'book':
+        pay(client, booking_id, args.poll_payments)
+    elif scenario == 'cancel':
+        cancel(client, booking_id)
+
+
+def wait_for_payments(package_slots, timeout):
+    """Let the payment workers finish, queued jobs still change bookings"""
+    placeholders = ','.join(['%s'] * len(package_slots))
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        pending = db.execute_query(f"""
+        SELECT COUNT(*) AS pending FROM payment_jobs j
+        JOIN bookings b ON b.id = j.booking_id
+        WHERE b.package_id IN ({placeholders}) AND j.status IN ('queued', 'processing')
+        """, list(package_slots), fetch=True)[0]['pending']
+        if not pending:
+            return 0
+        time.sleep(1)
+    return pending
+
+
+def check_invariants(package_slots):
+    violations = []
+    for package_id, initial in package_slots.items():
+        available = db.execute_query(
+            "SELECT available_slots FROM package_inventory WHERE package_id = %s",
+            (package_id,), fetch=True
+        )[0]['available_slots']
+        held = int(db.execute_query(
+            "SELECT COALESCE(SUM(slots_held), 0) AS held FROM bookings WHERE package_id = %s",
+            (package_id,), fetch=True
+        )[0]['held'])
+        if available < 0:
+            violations.append({'package_id': package_id, 'violation': 'negative_available_slots', 'available': available})
+        if held > initial:
+            violations.append({'package_id': package_id, 'violation': 'oversold', 'held': held, 'initial': initial})
+        if available + held != initial:
+            violations.append({'package_id': package_id, 'violation': 'slot_leak',
+                               'available': available, 'held': held, 'initial': initial})
+    return violations
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return round(sorted_values[index] * 1000, 2)
+
+
+def summarize(recorder, elapsed):
+    routes = {}
+    for route, latencies in sorted(recorder.latencies.items()):
+        latencies = sorted(latencies)
+        routes[route] = {
+            'requests': len(latencies),
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': round(latencies[-1] * 1000, 2),
+            'errors': recorder.errors[route],
+            'error_rate': round(recorder.errors[route] / len(latencies), 4),
+            'rejections': recorder.rejections[route]
+        }
+    return routes
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--rate', type=float, default=10.0, help='new sessions per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds to keep starting sessions')
+    parser.add_argument('--concurrency', type=int, default=64, help='sessions in flight at most')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('browse=0.5,book=0.3,cancel=0.1,abandon=0.1'))
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--packages', type=int, default=3)
+    parser.add_argument('--slots', type=int, default=100, help='initial slots per package')
+    parser.add_argument('--poll-payments', type=float, default=0.0,
+                        help='seconds to poll each payment status, 0 to not poll')
+    parser.add_argument('--drain-timeout', type=float, default=60.0)
+    parser.add_argument('--timeout', type=float, default=30.0, help='per request timeout')
+    parser.add_argument('--label', default='', help='free-form name stored with the results')
+    parser.add_argument('--output', help='results file, defaults to benchmarks/results/load_test_<time>.json')
+    parser.add_argument('--keep', action='store_true', help='keep the test packages, bookings and notifications')
+    args = parser.parse_args()
+
+    usernames, package_slots = provision(args.users, args.packages, args.slots)
+    package_ids = list(package_slots)
+    scenarios, weights = zip(*args.mix.items())
+    print(f"{args.rate} sessions/s for {args.duration}s against {args.base_url}, "
+          f"packages {package_ids} with {args.slots} slots each, mix {dict(args.mix)}")
+
+    recorder = Recorder()
+    started_at = datetime.now()
+    started = time.perf_counter()
+    late_starts = 0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        next_start = started
+        while next_start - started < args.duration:
+            delay = next_start - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.1:
+                late_starts += 1
+            scenario = random.choices(scenarios, weights)[0]
+            executor.submit(run_session, args, recorder, scenario, usernames, package_ids)
+            next_start += random.expovariate(args.rate)
+    elapsed = time.perf_counter() - started
+
+    undrained = wait_for_payments(package_slots, args.drain_timeout)
+    violations = check_invariants(package_slots)
+    routes = summarize(recorder, elapsed)
+
+    results = {
+        'label': args.label,
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'elapsed_seconds': round(elapsed, 2),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'keep')},
+        'sessions': dict(recorder.scenarios),
+        'late_session_starts': late_starts,
+        'total_requests': sum(route['requests'] for route in routes.values()),
+        'total_errors': sum(route['errors'] for route in routes.values()),
+        'routes': routes,
+        'undrained_payment_jobs': undrained,
+        'invariant_violations': violations
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load_test_{started_at.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+
+    print(f"{'route':<22}{'reqs':>7}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'err%':>7}{'rej':>6}")
+    for route, stats in routes.items():
+        print(f"{route:<22}{stats['requests']:>7}{stats['throughput_rps']:>8.1f}"
+              f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+              f"{stats['error_rate'] * 100:>7.2f}{stats['rejections']:>6}")
+    print(f"Sessions: {dict(recorder.scenarios)}, late starts: {late_starts}")
+    print(f"Results written to {output}")
+
+    if not args.keep:
+        cleanup(package_slots, usernames)
+
+    if undrained:
+        print(f"WARNING: {undrained} payment jobs still queued, invariants may be off")
+    if violations:
+        for violation in violations:
+            print(f"VIOLATION: {violation}")
+        sys.exit(1)
+    print("OK: no oversell")
+
+
+if __name__ == '__main__':
+    main()
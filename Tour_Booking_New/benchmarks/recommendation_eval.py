@@ -0,0 +1,541 @@
+"""Offline evaluation of the recommendation strategies on historical bookings.
+
+Splits the booking history by time: everything before the cutoff trains
+each strategy, and the packages a user booked after it (and had not booked
+before) are what a good strategy should have recommended. Strategies:
+
+    popular                 most booked packages
+    dashboard_category_sql  the old dashboard query: packages in categories
+                            the user booked before, then popularity, rating
+    preferences_random_sql  the old recommendations() query: preference
+                            match ORDER BY RAND(), popular fill-up
+    candidate_pools         weighted reservoir sample over the compiled
+                            preference filter (candidate_pools/preferences)
+    cobooking               item-to-item co-booking neighbours (cobooking)
+    content_similarity      TF-IDF + price/duration neighbours (content_index,
+                            needs NumPy)
+    blended                 what user_recommendations serves: co-booked,
+                            then preferences, then popular
+
+For every strategy it reports hit-rate@k and recall@k over the test users,
+catalog coverage, intra-list diversity (share of recommended pairs that
+differ in category / destination), model build time, per-request latency
+(p50/p95/p99) and memory (tracemalloc peak while building and serving).
+Random strategies use --seed, so runs on the same data are repeatable.
+
+History comes from the app's MySQL database, a JSON snapshot written by
+--save-snapshot, or a seeded synthetic catalog. Results go to a JSON file;
+--compare prints the change against an earlier one. --sql-latency N also
+times the old SQL queries against the live database for N users.
+
+    python benchmarks/recommendation_eval.py --k 6 --test-fraction 0.2
+    python benchmarks/recommendation_eval.py --synthetic 2000 --compare benchmarks/results/<earlier>.json
+
+Preferences are today's rows, not as they were at the cutoff, which favours
+the preference strategies slightly.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from itertools import combinations
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import candidate_pools
+import cobooking
+import content_index
+import preferences
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# The queries the pages ran before the in-memory recommenders, timed by --sql-latency
+OLD_DASHBOARD_SQL = """
+SELECT p.*,
+       COUNT(b.id) as popularity,
+       (SELECT AVG(rating) FROM feedback WHERE package_id = p.id) as avg_rating
+FROM packages p
+LEFT JOIN bookings b ON p.id = b.package_id
+WHERE p.is_active = TRUE
+AND p.id NOT IN (SELECT package_id FROM bookings WHERE user_id = %s)
+GROUP BY p.id
+ORDER BY
+    CASE WHEN p.category IN (
+        SELECT DISTINCT p2.category
+        FROM bookings b2
+        JOIN packages p2 ON b2.package_id = p2.id
+        WHERE b2.user_id = %s
+    ) THEN 1 ELSE 0 END DESC,
+    popularity DESC,
+    avg_rating DESC
+LIMIT 6
+"""
+OLD_PREFERENCES_SQL = "SELECT * FROM packages WHERE is_active = TRUE ORDER BY RAND() LIMIT 6"
+OLD_BUDGET_SQL = {'low': "price < 10000", 'medium': "price BETWEEN 10000 AND 25000", 'high': "price > 25000"}
+
+
+# History sources
+
+def load_from_db():
+    import database as db
+    packages = db.execute_query("""
+    SELECT id, name, description, destination, category, price, duration_days, is_active FROM packages
+    """, fetch=True) or []
+    bookings = db.execute_query("""
+    SELECT user_id, package_id, booking_date FROM bookings WHERE status != 'cancelled' ORDER BY booking_date, id
+    """, fetch=True) or []
+    feedback = db.execute_query("SELECT user_id, package_id, rating, created_at FROM feedback", fetch=True) or []
+    prefs = db.execute_query("""
+    SELECT user_id, preferred_destinations, budget_range, travel_style FROM user_preferences
+    """, fetch=True) or []
+    return {
+        'packages': [dict(package, price=float(package['price'])) for package in packages],
+        'bookings': bookings,
+        'feedback': feedback,
+        'preferences': prefs
+    }
+
+
+def synthetic_history(users, seed, package_count=120, days=365):
+    """Users with a taste for one category and a couple of destinations,
+    booking mostly (not only) what they like"""
+    rng = random.Random(seed)
+    categories = ['Beach', 'Adventure', 'Cultural', 'Wildlife', 'Spiritual', 'Luxury']
+    destinations = ['Goa', 'Manali', 'Kerala', 'Jaipur', 'Andaman', 'Rishikesh', 'Ladakh', 'Udaipur', 'Varanasi']
+    words = {
+        'Beach': 'beach sunset snorkel island coast', 'Adventure': 'trek rafting camping climb snow',
+        'Cultural': 'fort palace heritage museum bazaar', 'Wildlife': 'safari tiger jungle park birds',
+        'Spiritual': 'temple ganga aarti yoga ashram', 'Luxury': 'resort spa villa private butler'
+    }
+    packages = []
+    for package_id in range(1, package_count + 1):
+        category = rng.choice(categories)
+        packages.append({
+            'id': package_id, 'name': f'Package {package_id}', 'category': category,
+            'destination': rng.choice(destinations),
+            'description': ' '.join(rng.sample(words[category].split(), 3) + rng.sample(words[rng.choice(categories)].split(), 2)),
+            'price': float(rng.choice([6000, 9000, 14000, 19000, 24000, 32000, 48000]) + rng.randint(0, 900)),
+            'duration_days': rng.randint(2, 10), 'is_active': 1
+        })
+    by_category = defaultdict(list)
+    for package in packages:
+        by_category[package['category']].append(package)
+
+    start = datetime(2024, 1, 1)
+    bookings, feedback, prefs = [], [], []
+    for user_id in range(1, users + 1):
+        taste = rng.choice(categories)
+        places = rng.sample(destinations, 2)
+        liked = [p for p in by_category[taste] if p['destination'] in places] or by_category[taste]
+        for _ in range(rng.randint(1, 6)):
+            package = rng.choice(liked if rng.random() < 0.7 else packages)
+            when = start + timedelta(days=rng.uniform(0, days))
+            bookings.append({'user_id': user_id, 'package_id': package['id'], 'booking_date': when})
+            if rng.random() < 0.4:
+                feedback.append({'user_id': user_id, 'package_id': package['id'],
+                                 'rating': 5 if package['category'] == taste else rng.randint(1, 4),
+                                 'created_at': when + timedelta(days=5)})
+        if rng.random() < 0.6:
+            prefs.append({'user_id': user_id, 'preferred_destinations': ', '.join(places),
+                          'budget_range': rng.choice(['', 'low', 'medium', 'high']), 'travel_style': taste})
+    bookings.sort(key=lambda booking: booking['booking_date'])
+    return {'packages': packages, 'bookings': bookings, 'feedback': feedback, 'preferences': prefs}
+
+
+def load_snapshot(path):
+    with open(path) as f:
+        history = json.load(f)
+    for rows, column in ((history['bookings'], 'booking_date'), (history['feedback'], 'created_at')):
+        for row in rows:
+            row[column] = datetime.fromisoformat(row[column]) if row[column] else None
+    return history
+
+
+def save_snapshot(history, path):
+    with open(path, 'w') as f:
+        json.dump(history, f, default=lambda value: value.isoformat() if hasattr(value, 'isoformat') else float(value))
+
+
+# Time split
+
+def time_split(history, test_fraction=0.2, split_date=None):
+    """(train, test, cutoff). test maps user -> packages first booked after
+    the cutoff by users who also booked before it or have preferences."""
+    bookings = [booking for booking in history['bookings'] if booking['booking_date']]
+    if split_date is None:
+        dates = sorted(booking['booking_date'] for booking in bookings)
+        split_date = dates[int(len(dates) * (1 - test_fraction))] if dates else datetime.now()
+
+    train = dict(history, bookings=[b for b in bookings if b['booking_date'] < split_date],
+                 feedback=[f for f in history['feedback'] if f['created_at'] and f['created_at'] < split_date])
+    known = defaultdict(set)
+    for booking in train['bookings']:
+        known[booking['user_id']].add(booking['package_id'])
+    with_preferences = {row['user_id'] for row in history['preferences']}
+
+    test = defaultdict(set)
+    for booking in bookings:
+        user_id = booking['user_id']
+        # known.get: indexing the defaultdict would make every user known
+        seen = known.get(user_id, ())
+        if booking['booking_date'] >= split_date and booking['package_id'] not in seen and \
+                (seen or user_id in with_preferences):
+            test[user_id].add(booking['package_id'])
+    return train, dict(test), split_date
+
+
+class TrainData:
+    """What every strategy may look at: the catalog and the training period"""
+
+    def __init__(self, train):
+        self.packages = {package['id']: package for package in train['packages'] if package.get('is_active', 1)}
+        self.user_items = defaultdict(list)
+        self.popularity = Counter()
+        for booking in train['bookings']:
+            if booking['package_id'] in self.packages:
+                self.user_items[booking['user_id']].append(booking['package_id'])
+                self.popularity[booking['package_id']] += 1
+        ratings = defaultdict(list)
+        self.user_ratings = {}
+        for row in train['feedback']:
+            ratings[row['package_id']].append(row['rating'])
+            self.user_ratings[(row['user_id'], row['package_id'])] = row['rating']
+        self.avg_rating = {package_id: sum(values) / len(values) for package_id, values in ratings.items()}
+        self.preferences = {row['user_id']: row for row in train['preferences']}
+        self.ranked = sorted(self.packages, key=lambda package_id: (-self.popularity[package_id], package_id))
+
+
+# Strategies: build(train_data, rng) returns recommend(user_id, k) -> [package_id]
+
+def build_popular(data, rng):
+    return lambda user_id, k: data.ranked[:k]
+
+
+def build_dashboard_category_sql(data, rng):
+    def recommend(user_id, k):
+        booked = set(data.user_items.get(user_id, ()))
+        categories = {data.packages[package_id]['category'] for package_id in booked}
+        candidates = [package_id for package_id in data.packages if package_id not in booked]
+        candidates.sort(key=lambda package_id: (
+            data.packages[package_id]['category'] not in categories,
+            -data.popularity[package_id],
+            -(data.avg_rating.get(package_id) or 0)
+        ))
+        return candidates[:k] or data.ranked[:k]
+    return recommend
+
+
+def build_preferences_random_sql(data, rng):
+    bands = {'low': lambda price: price < 10000, 'medium': lambda price: 10000 <= price <= 25000,
+             'high': lambda price: price > 25000}
+
+    def recommend(user_id, k):
+        picks = []
+        pref = data.preferences.get(user_id)
+        if pref:
+            destinations = {d.strip().lower() for d in (pref['preferred_destinations'] or '').split(',')}
+            band = bands.get(pref['budget_range'] or '')
+            style = (pref['travel_style'] or '').lower()
+            matching = [
+                package_id for package_id, package in data.packages.items()
+                if (not pref['preferred_destinations'] or package['destination'].lower() in destinations) and
+                   (band is None or band(package['price'])) and
+                   (not style or package['category'].lower() == style)
+            ]
+            picks = rng.sample(matching, min(k, len(matching)))
+        if len(picks) < 3:
+            picks += data.ranked[:k - len(picks)]
+        return picks[:k]
+    return recommend
+
+
+def _preference_filters(data):
+    return {
+        user_id: preferences.compile_filter(preferences.parse_destinations(row['preferred_destinations']),
+                                            *preferences.parse_budget(row['budget_range']), row['travel_style'])
+        for user_id, row in data.preferences.items()
+    }
+
+
+def build_candidate_pools(data, rng):
+    filters = _preference_filters(data)
+    weighted = [(package_id, 1.0 + data.popularity[package_id]) for package_id in data.packages]
+    matching = {}
+
+    def recommend(user_id, k):
+        preference_filter = filters.get(user_id)
+        if preference_filter is None:
+            return data.ranked[:k]
+        if preference_filter not in matching:
+            matching[preference_filter] = [(package_id, weight) for package_id, weight in weighted
+                                           if preference_filter.matches(data.packages[package_id])]
+        picks = candidate_pools.weighted_sample(matching[preference_filter], k, rng=rng)
+        return picks + [package_id for package_id in data.ranked if package_id not in picks][:k - len(picks)]
+    return recommend
+
+
+def _cobooking_model(data):
+    baskets = defaultdict(dict)
+    for user_id, items in data.user_items.items():
+        for package_id in items:
+            baskets[user_id][package_id] = cobooking.interaction_weight(data.user_ratings.get((user_id, package_id)))
+    dot, norms = cobooking._cooccurrence_python(baskets)
+    neighbours = {package_id: cobooking._top_neighbours(package_id, dot, norms) for package_id in norms}
+    return baskets, neighbours
+
+
+def _score_neighbours(basket, neighbours, k):
+    scores = Counter()
+    for package_id, weight in basket.items():
+        for other_id, similarity in neighbours.get(package_id, []):
+            if other_id not in basket:
+                scores[other_id] += weight * similarity
+    return [package_id for package_id, _ in scores.most_common(k)]
+
+
+def build_cobooking(data, rng):
+    baskets, neighbours = _cobooking_model(data)
+
+    def recommend(user_id, k):
+        picks = _score_neighbours(baskets.get(user_id, {}), neighbours, k)
+        return picks + [package_id for package_id in data.ranked if package_id not in picks][:k - len(picks)]
+    return recommend
+
+
+def build_content_similarity(data, rng):
+    package_list = list(data.packages.values())
+    indices, scores = content_index.top_neighbours(content_index.build_matrix(package_list))
+    neighbours = {
+        package['id']: [(package_list[column]['id'], float(score))
+                        for column, score in zip(indices[row].tolist(), scores[row].tolist()) if score > 0]
+        for row, package in enumerate(package_list)
+    }
+
+    def recommend(user_id, k):
+        basket = {package_id: 1.0 for package_id in data.user_items.get(user_id, ())}
+        picks = _score_neighbours(basket, neighbours, k)
+        return picks + [package_id for package_id in data.ranked if package_id not in picks][:k - len(picks)]
+    return recommend
+
+
+def build_blended(data, rng):
+    baskets, neighbours = _cobooking_model(data)
+    preference_picks = build_candidate_pools(data, rng)
+    filters = _preference_filters(data)
+
+    def recommend(user_id, k):
+        picks = _score_neighbours(baskets.get(user_id, {}), neighbours, k)
+        if user_id in filters:
+            picks += [package_id for package_id in preference_picks(user_id, k) if package_id not in picks]
+        picks += [package_id for package_id in data.ranked if package_id not in picks]
+        return picks[:k]
+    return recommend
+
+
+STRATEGIES = {
+    'popular': build_popular,
+    'dashboard_category_sql': build_dashboard_category_sql,
+    'preferences_random_sql': build_preferences_random_sql,
+    'candidate_pools': build_candidate_pools,
+    'cobooking': build_cobooking,
+    'content_similarity': build_content_similarity,
+    'blended': build_blended
+}
+
+
+# Scoring
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))]
+
+
+def diversity(package_ids, packages):
+    """Share of recommended pairs that differ, averaged over category and destination"""
+    pairs = list(combinations(package_ids, 2))
+    if not pairs:
+        return 0.0
+    return sum(
+        0.5 * (packages[a]['category'] != packages[b]['category']) +
+        0.5 * (packages[a]['destination'] != packages[b]['destination'])
+        for a, b in pairs
+    ) / len(pairs)
+
+
+def evaluate(name, build, data, test, k, seed):
+    rng = random.Random(seed)
+    tracemalloc.start()
+    started = time.perf_counter()
+    recommend = build(data, rng)
+    build_ms = (time.perf_counter() - started) * 1000
+    model_bytes = tracemalloc.get_traced_memory()[0]
+
+    hits = recall = diverse = 0.0
+    latencies = []
+    recommended = set()
+    for user_id in sorted(test):
+        started = time.perf_counter()
+        picks = recommend(user_id, k)[:k]
+        latencies.append((time.perf_counter() - started) * 1e6)
+        found = len(test[user_id] & set(picks))
+        hits += found > 0
+        recall += found / len(test[user_id])
+        diverse += diversity(picks, data.packages)
+        recommended.update(picks)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    users = len(test) or 1
+    latencies.sort()
+    return {
+        'strategy': name,
+        f'hit_rate@{k}': round(hits / users, 4),
+        f'recall@{k}': round(recall / users, 4),
+        'coverage': round(len(recommended) / (len(data.packages) or 1), 4),
+        'diversity': round(diverse / users, 4),
+        'build_ms': round(build_ms, 2),
+        'latency_us_p50': round(percentile(latencies, 50), 1),
+        'latency_us_p95': round(percentile(latencies, 95), 1),
+        'latency_us_p99': round(percentile(latencies, 99), 1),
+        'model_kib': round(model_bytes / 1024, 1),
+        'peak_kib': round(peak_bytes / 1024, 1)
+    }
+
+
+def time_old_sql(users, seed):
+    """Per-request latency of the old SQL recommenders against the live database"""
+    import database as db
+    rng = random.Random(seed)
+    prefs = {row['user_id']: row for row in db.execute_query(
+        "SELECT user_id, preferred_destinations, budget_range, travel_style FROM user_preferences", fetch=True) or []}
+    user_ids = [row['id'] for row in db.execute_query("SELECT id FROM users WHERE user_type = 'user'", fetch=True) or []]
+    sample = rng.sample(user_ids, min(users, len(user_ids)))
+
+    timings = {'dashboard_category_sql': [], 'preferences_random_sql': []}
+    for user_id in sample:
+        started = time.perf_counter()
+        db.execute_query(OLD_DASHBOARD_SQL, (user_id, user_id), fetch=True)
+        timings['dashboard_category_sql'].append((time.perf_counter() - started) * 1000)
+
+        query, params = OLD_PREFERENCES_SQL, []
+        pref = prefs.get(user_id)
+        if pref:
+            conditions = []
+            if pref['preferred_destinations']:
+                destinations = [d.strip() for d in pref['preferred_destinations'].split(',')]
+                conditions.append(f"destination IN ({','.join(['%s'] * len(destinations))})")
+                params.extend(destinations)
+            if pref['budget_range'] in OLD_BUDGET_SQL:
+                conditions.append(OLD_BUDGET_SQL[pref['budget_range']])
+            if pref['travel_style']:
+                conditions.append("category = %s")
+                params.append(pref['travel_style'])
+            if conditions:
+                query = query.replace(" ORDER BY", " AND " + " AND ".join(conditions) + " ORDER BY")
+        started = time.perf_counter()
+        db.execute_query(query, params, fetch=True)
+        timings['preferences_random_sql'].append((time.perf_counter() - started) * 1000)
+
+    return {
+        name: {'requests': len(values), 'latency_ms_p50': round(percentile(sorted(values), 50), 2),
+               'latency_ms_p95': round(percentile(sorted(values), 95), 2)}
+        for name, values in timings.items()
+    }
+
+
+def print_table(results, k, previous=None):
+    columns = [f'hit_rate@{k}', f'recall@{k}', 'coverage', 'diversity', 'build_ms',
+               'latency_us_p50', 'latency_us_p95', 'peak_kib']
+    before = {row['strategy']: row for row in (previous or {}).get('strategies', [])}
+    print(f"{'strategy':<24}" + ''.join(f"{column:>16}" for column in columns))
+    for row in results:
+        cells = []
+        for column in columns:
+            cell = f"{row[column]:g}"
+            if row['strategy'] in before and column in before[row['strategy']]:
+                cell += f" ({row[column] - before[row['strategy']][column]:+g})"
+            cells.append(f"{cell:>16}")
+        print(f"{row['strategy']:<24}" + ''.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--k', type=int, default=6, help='recommendations per user, 6 like the pages')
+    parser.add_argument('--test-fraction', type=float, default=0.2, help='newest share of bookings held out')
+    parser.add_argument('--split-date', type=datetime.fromisoformat, help='hold out bookings from this date on')
+    parser.add_argument('--strategies', nargs='+', choices=list(STRATEGIES), default=list(STRATEGIES))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--snapshot', help='read the history from a JSON snapshot instead of MySQL')
+    parser.add_argument('--save-snapshot', help='write the history used to a JSON snapshot')
+    parser.add_argument('--synthetic', type=int, metavar='USERS', help='use a seeded synthetic history')
+    parser.add_argument('--sql-latency', type=int, default=0, metavar='USERS',
+                        help='also time the old SQL queries against MySQL for this many users')
+    parser.add_argument('--compare', help='earlier results file to print deltas against')
+    parser.add_argument('--label', default='', help='free-form name stored with the results')
+    parser.add_argument('--output', help='results file, defaults to benchmarks/results/recommendation_eval_<time>.json')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        history, source = synthetic_history(args.synthetic, args.seed), f'synthetic:{args.synthetic}:{args.seed}'
+    elif args.snapshot:
+        history, source = load_snapshot(args.snapshot), args.snapshot
+    else:
+        history, source = load_from_db(), 'mysql'
+    if args.save_snapshot:
+        save_snapshot(history, args.save_snapshot)
+
+    train, test, cutoff = time_split(history, args.test_fraction, args.split_date)
+    data = TrainData(train)
+    print(f"{len(history['bookings'])} bookings from {source}, cutoff {cutoff}: "
+          f"{len(train['bookings'])} train, {len(test)} test users, {len(data.packages)} active packages")
+    if not test:
+        print('No user booked anything new after the cutoff, nothing to evaluate')
+        return
+
+    strategies = list(args.strategies)
+    if content_index.np is None and 'content_similarity' in strategies:
+        print('NumPy is not installed, skipping content_similarity')
+        strategies.remove('content_similarity')
+    results = [evaluate(name, STRATEGIES[name], data, test, args.k, args.seed) for name in strategies]
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print()
+    print_table(results, args.k, previous)
+
+    report = {
+        'label': args.label,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'source': source,
+        'k': args.k,
+        'seed': args.seed,
+        'cutoff': cutoff.isoformat(),
+        'bookings': len(history['bookings']),
+        'train_bookings': len(train['bookings']),
+        'test_users': len(test),
+        'packages': len(data.packages),
+        'strategies': results
+    }
+    if args.sql_latency:
+        report['sql_latency'] = time_old_sql(args.sql_latency, args.seed)
+        print()
+        for name, timing in report['sql_latency'].items():
+            print(f"{name:<24} live SQL p50 {timing['latency_ms_p50']} ms, p95 {timing['latency_ms_p95']} ms")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f"recommendation_eval_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Concurrency stress check for the slot reservation engine.
+
+Creates a throwaway package with a small number of slots, then hammers
+inventory.hold_booking / transition_booking from many threads at once
+(bookings, payments and cancellations mixed) and verifies that the package
+was never oversold:
+
+    available_slots >= 0
+    available_slots + SUM(bookings.slots_held) == initial slots
+
+Needs the same MySQL database as the app. Exits with status 1 on any
+invariant violation.
+
+    python benchmarks/reservation_stress.py --slots 50 --threads 64 --attempts 2000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+import inventory
+
+
+def get_stress_user():
+    user = db.execute_query("SELECT id FROM users WHERE username = 'stress_test_user'", fetch=True)
+    if user:
+        return user[0]['id']
+    return db.execute_query("""
+    INSERT INTO users (username, password, email, full_name, phone, user_type)
+    VALUES ('stress_test_user', 'stress_test', 'stress@example.com', 'Stress Test', '', 'user')
+    """)
+
+
+def create_package(slots):
+    return db.execute_query("""
+    INSERT INTO packages (name, description, destination, duration_days, price, category, image_url, available_slots, is_active, max_slots)
+    VALUES ('Stress Test Package', 'Temporary package for reservation stress tests', 'Nowhere', 1, 1000, 'Test', '', %s, TRUE, %s)
+    """, (slots, slots))
+
+
+def run_attempt(user_id, package_id, cancel_rate):
+    travelers = random.randint(1, 3)
+    started = time.perf_counter()
+    booking_id, _ = inventory.hold_booking(user_id, package_id, travelers, travelers * 1000)
+    outcome = 'rejected'
+    if booking_id:
+        outcome = 'held'
+        roll = random.random()
+        if roll < cancel_rate:
+            booking, _ = inventory.transition_booking(booking_id, 'cancelled', user_id=user_id)
+            outcome = 'cancelled' if booking else 'cancel_failed'
+        elif roll < cancel_rate * 2:
+            booking, _ = inventory.transition_booking(booking_id, 'confirmed', user_id=user_id, from_statuses=('pending',))
+            outcome = 'confirmed' if booking else 'confirm_failed'
+    return outcome, time.perf_counter() - started
+
+
+def check_invariants(package_id, initial_slots):
+    package = db.execute_query("SELECT available_slots FROM packages WHERE id = %s", (package_id,), fetch=True)[0]
+    held = db.execute_query(
+        "SELECT COALESCE(SUM(slots_held), 0) as held FROM bookings WHERE package_id = %s",
+        (package_id,), fetch=True
+    )[0]['held']
+    available = package['available_slots']
+    violations = []
+    if available < 0:
+        violations.append(f"negative available_slots: {available}")
+    if available + held != initial_slots:
+        violations.append(f"slot leak: available {available} + held {held} != initial {initial_slots}")
+    return available, int(held), violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--slots', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--attempts', type=int, default=2000)
+    parser.add_argument('--cancel-rate', type=float, default=0.2)
+    parser.add_argument('--keep', action='store_true', help='keep the test package and bookings')
+    args = parser.parse_args()
+
+    user_id = get_stress_user()
+    package_id = create_package(args.slots)
+    print(f"Package {package_id}: {args.slots} slots, {args.attempts} attempts on {args.threads} threads")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(
+            lambda _: run_attempt(user_id, package_id, args.cancel_rate),
+            range(args.attempts)
+        ))
+    elapsed = time.perf_counter() - started
+
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    latencies = sorted(latency for _, latency in results)
+
+    available, held, violations = check_invariants(package_id, args.slots)
+    print(f"Throughput: {len(results) / elapsed:.1f} attempts/s over {elapsed:.2f}s")
+    print(f"Latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"Outcomes: {outcomes}")
+    print(f"Final: available {available}, held by bookings {held}")
+
+    if not args.keep:
+        db.execute_query("DELETE FROM bookings WHERE package_id = %s", (package_id,))
+        db.execute_query("DELETE FROM packages WHERE id = %s", (package_id,))
+
+    if violations:
+        for violation in violations:
+            print(f"VIOLATION: {violation}")
+        sys.exit(1)
+    print("OK: no oversell")
+
+
+if __name__ == '__main__':
+    main()
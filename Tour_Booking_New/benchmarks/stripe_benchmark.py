@@ -0,0 +1,142 @@
+"""Write throughput of one hot package with and without inventory striping.
+
+Creates a throwaway user and a package with plenty of slots and, for each
+stripe count, runs many concurrent inventory.hold_booking calls against it:
+the same path a real booking takes, reserving the slots, inserting the
+pending booking and bumping the data versions. With 0 stripes every booking
+queues on the single packages row; with N stripes up to N of them proceed
+at once.
+
+After each run it checks that no slot was lost or double counted:
+
+    live slots + reserved == initial slots
+
+Needs the same MySQL database as the app.
+
+    python benchmarks/stripe_benchmark.py --stripes 0 1 4 16 --threads 32 --attempts 2000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database as db
+import inventory
+
+USERNAME = 'stripe_benchmark_user'
+
+
+def create_user():
+    existing = db.execute_query("SELECT id FROM users WHERE username = %s", (USERNAME,), fetch=True)
+    if existing:
+        return existing[0]['id']
+    return db.execute_query("""
+    INSERT INTO users (username, password, email, full_name, phone, user_type)
+    VALUES (%s, 'benchmark', %s, 'Stripe Benchmark', '', 'user')
+    """, (USERNAME, f"{USERNAME}@example.com"))
+
+
+def create_package(slots):
+    return db.execute_query("""
+    INSERT INTO packages (name, description, destination, duration_days, price, category, image_url, available_slots, is_active, max_slots)
+    VALUES ('Stripe Benchmark Package', 'Temporary package for inventory striping benchmarks', 'Nowhere', 1, 1000, 'Test', '', %s, TRUE, %s)
+    """, (slots, slots))
+
+
+def book_once(user_id, package_id):
+    count = random.randint(1, 3)
+    started = time.perf_counter()
+    booking_id, message = inventory.hold_booking(user_id, package_id, count, 1000 * count)
+    elapsed = time.perf_counter() - started
+    if booking_id:
+        return 'reserved', count, elapsed
+    if message == 'Not enough slots left for this package.':
+        return 'rejected', 0, elapsed
+    return 'error', 0, elapsed
+
+
+def live_slots(package_id):
+    return db.execute_query(
+        "SELECT available_slots FROM package_inventory WHERE package_id = %s",
+        (package_id,), fetch=True
+    )[0]['available_slots']
+
+
+def run(user_id, package_id, stripes, slots, threads, attempts):
+    db.execute_query("DELETE FROM bookings WHERE package_id = %s", (package_id,))
+    inventory.configure_stripes(package_id, stripes, total=slots)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda _: book_once(user_id, package_id), range(attempts)))
+    elapsed = time.perf_counter() - started
+
+    outcomes = {}
+    for outcome, _, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    reserved = sum(count for _, count, _ in results)
+    latencies = sorted(latency for _, _, latency in results)
+
+    remaining = int(live_slots(package_id))
+    violations = []
+    if remaining < 0:
+        violations.append(f"negative live slots: {remaining}")
+    if remaining + reserved != slots:
+        violations.append(f"slot leak: live {remaining} + reserved {reserved} != initial {slots}")
+
+    return {
+        'stripes': stripes,
+        'throughput': len(results) / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        'outcomes': outcomes,
+        'violations': violations
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stripes', type=int, nargs='+', default=[0, 1, 4, 16])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--attempts', type=int, default=2000)
+    parser.add_argument('--keep', action='store_true', help='keep the benchmark package and bookings')
+    args = parser.parse_args()
+
+    # Enough slots that nothing sells out, so every run measures contention only
+    slots = args.attempts * 3
+    user_id = create_user()
+    package_id = create_package(slots)
+    print(f"Package {package_id}: {args.attempts} bookings on {args.threads} threads")
+
+    results = []
+    try:
+        for stripes in args.stripes:
+            result = run(user_id, package_id, stripes, slots, args.threads, args.attempts)
+            results.append(result)
+            print(f"stripes={stripes:>3}  {result['throughput']:8.1f} bookings/s  "
+                  f"p50 {result['p50_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  {result['outcomes']}")
+    finally:
+        if not args.keep:
+            db.execute_query("DELETE FROM bookings WHERE package_id = %s", (package_id,))
+            db.execute_query("DELETE FROM package_inventory_stripes WHERE package_id = %s", (package_id,))
+            db.execute_query("DELETE FROM packages WHERE id = %s", (package_id,))
+
+    baseline = results[0]['throughput'] if results else 0
+    if baseline:
+        for result in results[1:]:
+            print(f"stripes={result['stripes']:>3}  {result['throughput'] / baseline:.2f}x vs stripes={results[0]['stripes']}")
+
+    violations = [(result['stripes'], violation) for result in results for violation in result['violations']]
+    if violations:
+        for stripes, violation in violations:
+            print(f"VIOLATION (stripes={stripes}): {violation}")
+        sys.exit(1)
+    print("OK: no slots lost")
+
+
+if __name__ == '__main__':
+    main()
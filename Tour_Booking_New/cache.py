@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Small thread-safe in-process cache with per-entry expiry"""
+
+    def __init__(self, ttl=5, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            # Evict least recently used entries once we go over the limit
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FragmentCache:
+    """LRU cache of rendered fragments bounded by total size in bytes.
+
+    Keys are expected to embed data versions, so entries never need explicit
+    invalidation; stale versions simply age out. get_or_create() lets only one
+    thread render a missing key while the others wait for its result.
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _get(self, key):
+        entry = self._data.get(key)
+        if entry is not None:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        return None
+
+    def _set(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.size -= old[0]
+        self._data[key] = (size, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (evicted_size, _) = self._data.popitem(last=False)
+            self.size -= evicted_size
+
+    def get_or_create(self, key, creator, sizeof=len):
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                return value
+            key_lock = self._inflight.get(key)
+            if key_lock is None:
+                key_lock = self._inflight[key] = threading.Lock()
+
+        with key_lock:
+            # Another thread may have rendered it while we waited
+            with self._lock:
+                value = self._get(key)
+                if value is not None:
+                    return value
+                self.misses += 1
+            try:
+                value = creator()
+                if value is not None:
+                    with self._lock:
+                        self._set(key, value, sizeof(value))
+                return value
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
@@ -0,0 +1,189 @@
+import heapq
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+import database as db
+import versions
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Popularity drifts slowly, so pools are rebuilt when the catalog changes or
+# at the latest after this long
+REFRESH_SECONDS = 5 * 60
+
+ANY = '*'
+
+_build_lock = threading.Lock()
+# Candidates matching one compiled preference filter, per pool build
+_matches = TTLCache(ttl=REFRESH_SECONDS, max_entries=10000)
+_state = {'version': None, 'built_at': 0.0, 'pools': {}, 'popular': [], 'packages': {},
+          'terms': {'destinations': [], 'categories': []}}
+
+
+def budget_band(price):
+    """Same bands as the budget_range preference"""
+    price = float(price or 0)
+    if price < 10000:
+        return 'low'
+    if price <= 25000:
+        return 'medium'
+    return 'high'
+
+
+def _segment_keys(package):
+    """Every pool a package belongs to: its exact segment and all the
+    wildcard segments above it, so a preference with blanks is one lookup"""
+    destination = (package['destination'] or '').strip().lower()
+    band = budget_band(package['price'])
+    style = (package['category'] or '').strip().lower()
+    for d in (destination, ANY):
+        for b in (band, ANY):
+            for s in (style, ANY):
+                yield (d, b, s)
+
+
+def rebuild():
+    """Load the active catalog and booking counts with two queries and swap in
+    new pools of (package_id, weight) per segment"""
+    version = versions.listing_version()
+    # Errors raise here, so _current() keeps serving the previous pools
+    with db.transaction() as cursor:
+        cursor.execute("SELECT * FROM packages WHERE is_active = TRUE")
+        packages = cursor.fetchall()
+        cursor.execute("""
+        SELECT package_id, COUNT(*) AS booking_count
+        FROM bookings
+        GROUP BY package_id
+        """)
+        counts = cursor.fetchall()
+    booking_counts = {row['package_id']: row['booking_count'] for row in counts}
+
+    by_id = {}
+    pools = defaultdict(list)
+    for package in packages:
+        package = dict(package, booking_count=booking_counts.get(package['id'], 0))
+        by_id[package['id']] = package
+        # Every package keeps a chance, popular ones are drawn more often
+        weight = 1.0 + package['booking_count']
+        for key in _segment_keys(package):
+            pools[key].append((package['id'], weight))
+
+    popular = sorted(by_id, key=lambda package_id: by_id[package_id]['booking_count'], reverse=True)
+    terms = {
+        'destinations': sorted({package['destination'] for package in by_id.values() if package['destination']}),
+        'categories': sorted({package['category'] for package in by_id.values() if package['category']})
+    }
+    # Readers take the dict once, so they see either the old or the new pools
+    global _state
+    _state = {'version': version, 'built_at': time.monotonic(), 'pools': dict(pools),
+              'popular': popular, 'packages': by_id, 'terms': terms}
+    logger.info(f"Built {len(pools)} candidate pools over {len(by_id)} packages")
+
+
+def _is_stale(state):
+    return (state['version'] != versions.listing_version() or
+            time.monotonic() - state['built_at'] > REFRESH_SECONDS)
+
+
+def _current():
+    state = _state
+    if not _is_stale(state):
+        return state
+    # One thread rebuilds; the others keep serving the previous pools, and
+    # only wait when there are none yet
+    if _build_lock.acquire(blocking=not state['packages']):
+        try:
+            if _is_stale(_state):
+                rebuild()
+        except Exception as e:
+            logger.error(f"Error rebuilding candidate pools: {e}")
+        finally:
+            _build_lock.release()
+    return _state
+
+
+def weighted_sample(candidates, k, rng=random):
+    """Weighted reservoir sampling (Efraimidis-Spirakis A-Res): one pass over
+    (item, weight) pairs keeping the k largest u ** (1 / weight) keys"""
+    reservoir = []
+    for item, weight in candidates:
+        if weight <= 0:
+            continue
+        key = rng.random() ** (1.0 / weight)
+        if len(reservoir) < k:
+            heapq.heappush(reservoir, (key, item))
+        elif key > reservoir[0][0]:
+            heapq.heapreplace(reservoir, (key, item))
+    return [item for _, item in sorted(reservoir, reverse=True)]
+
+
+def _band_for(budget_min, budget_max):
+    """The one budget band holding the whole range, else ANY"""
+    low = budget_band(budget_min or 0)
+    high = 'high' if budget_max is None else budget_band(budget_max)
+    return low if low == high else ANY
+
+
+def _matching(state, preference_filter):
+    """(package_id, weight) of every package the filter accepts, narrowed by
+    the destination and style pools first and cached for this build"""
+    key = (preference_filter, state['built_at'])
+    candidates = _matches.get(key)
+    if candidates is None:
+        band = _band_for(preference_filter.budget_min, preference_filter.budget_max)
+        style = preference_filter.travel_style or ANY
+        candidates = [
+            (package_id, weight)
+            for destination in sorted(preference_filter.destinations) or [ANY]
+            for package_id, weight in state['pools'].get((destination, band, style), ())
+            if preference_filter.matches(state['packages'][package_id])
+        ]
+        _matches.set(key, candidates)
+    return candidates
+
+
+def sample(preference_filter, k=6, exclude=()):
+    """Random packages accepted by a compiled preferences.PreferenceFilter,
+    favouring popular ones"""
+    state = _current()
+    exclude = set(exclude)
+    candidates = [(package_id, weight) for package_id, weight in _matching(state, preference_filter)
+                  if package_id not in exclude]
+    return [state['packages'][package_id] for package_id in weighted_sample(candidates, k)]
+
+
+def search(destination=None, category=None, min_price=None, max_price=None, k=5):
+    """Active packages of one destination and/or category within a price
+    range, most booked first, then cheapest; k=None returns them all"""
+    state = _current()
+    key = ((destination or '').strip().lower() or ANY, ANY, (category or '').strip().lower() or ANY)
+    matches = [
+        state['packages'][package_id] for package_id, _ in state['pools'].get(key, ())
+        if (min_price is None or float(state['packages'][package_id]['price']) >= min_price) and
+           (max_price is None or float(state['packages'][package_id]['price']) <= max_price)
+    ]
+    matches.sort(key=lambda package: (-package['booking_count'], float(package['price'])))
+    return matches[:k]
+
+
+def catalog_terms():
+    """Destinations and categories of the active catalog, as written in packages.
+    The same dict is returned until the pools are rebuilt."""
+    return _current()['terms']
+
+
+def popular(k=6, exclude=()):
+    """Most booked active packages, the fallback when preferences match little"""
+    state = _current()
+    exclude = set(exclude)
+    result = []
+    for package_id in state['popular']:
+        if package_id not in exclude:
+            result.append(state['packages'][package_id])
+            if len(result) == k:
+                break
+    return result
@@ -0,0 +1,241 @@
+import json
+import re
+import threading
+
+import chatbot_catalog
+import chatbot_intents
+from cache import TTLCache
+
+# A chat idle this long starts over; past MAX_SESSIONS the least recently
+# used conversations are dropped first
+CONTEXT_TTL = 30 * 60
+MAX_SESSIONS = 10000
+# Also keep a compact copy in the signed session cookie, so a restarted or
+# different worker process picks the conversation up without a lookup
+KEEP_IN_SESSION = True
+MAX_COMPACT_LENGTH = 512
+MAX_SLOT_LENGTH = 100
+
+SLOTS = ('destination', 'category', 'min_price', 'max_price')
+
+# What the bot's last reply asked for, so a short answer can be read against it
+ASKED_DESTINATION = 'destination'
+ASKED_BUDGET = 'budget'
+ASKED_SIMILAR = 'similar'
+ASKED_PACKAGES = 'packages'
+
+# Follow-ups only make sense against an earlier message, e.g. "which region?"
+# after "beach packages under 20k"
+REGION = 'region'
+PRICE = 'price'
+CHEAPER = 'cheaper'
+PRICIER = 'pricier'
+CONFIRM = 'confirm'
+RESET = 'reset'
+FOLLOW_UPS = [
+    {'name': RESET, 'priority': 50,
+     'phrases': ['start over', 'start again', 'reset', 'new search', 'forget it', 'something else']},
+    {'name': REGION, 'priority': 40,
+     'phrases': ['which region', 'what region', 'which regions', 'where', 'which place', 'which places',
+                 'what places', 'which destination', 'which destinations', 'what destinations', 'which state',
+                 'which states', 'which city', 'which cities', 'which location', 'which locations']},
+    {'name': CHEAPER, 'priority': 35,
+     'phrases': ['cheaper', 'less expensive', 'lower budget', 'too expensive', 'too costly', 'lower price']},
+    {'name': PRICIER, 'priority': 35,
+     'phrases': ['pricier', 'more expensive', 'more premium', 'higher budget', 'fancier', 'upgrade']},
+    {'name': PRICE, 'priority': 30,
+     'phrases': ['how much', 'price', 'prices', 'cost', 'costs', 'what budget', 'price range', 'how expensive']},
+    {'name': CONFIRM, 'priority': 10,
+     'phrases': ['yes', 'yeah', 'yep', 'sure', 'ok', 'okay', 'please', 'go ahead', 'show me', 'why not']},
+]
+follow_ups = chatbot_intents.IntentEngine(FOLLOW_UPS)
+
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+_COMPACT_KEYS = {'intent': 'i', 'destination': 'd', 'category': 'c', 'min_price': 'lo', 'max_price': 'hi',
+                 'asked': 'a', 'cheapest': 'ch', 'priciest': 'pr'}
+_NUMBERS = ('min_price', 'max_price', 'cheapest', 'priciest')
+_ASKED = (ASKED_DESTINATION, ASKED_BUDGET, ASKED_SIMILAR, ASKED_PACKAGES)
+
+_contexts = TTLCache(ttl=CONTEXT_TTL, max_entries=MAX_SESSIONS)
+_metrics_lock = threading.Lock()
+metrics = {
+    'hits': 0,
+    'restored': 0,
+    'started': 0,
+    'follow_ups': 0
+}
+
+
+def new_context():
+    """Slots filled so far, the last intent, what the bot asked for and the
+    price span of the packages it last listed"""
+    return {key: None for key in _COMPACT_KEYS}
+
+
+def dumps(context):
+    """Compact JSON of the filled fields, a few dozen bytes"""
+    compact = {}
+    for key, short in _COMPACT_KEYS.items():
+        value = context.get(key)
+        if value is not None:
+            compact[short] = int(value) if isinstance(value, float) and value.is_integer() else value
+    return json.dumps(compact, separators=(',', ':'), ensure_ascii=False)
+
+
+def loads(text):
+    """A context from dumps() output, or None for anything malformed"""
+    if not text or len(text) > MAX_COMPACT_LENGTH:
+        return None
+    try:
+        compact = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(compact, dict):
+        return None
+
+    context = new_context()
+    for key, short in _COMPACT_KEYS.items():
+        value = compact.get(short)
+        if key in _NUMBERS:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                context[key] = float(value)
+        elif key == 'asked':
+            context[key] = value if value in _ASKED else None
+        elif isinstance(value, str):
+            context[key] = value[:MAX_SLOT_LENGTH]
+    return context
+
+
+def get(session_id, compact=None):
+    """The session's context: from memory, else restored from the compact
+    form, else a new one. The caller owns the returned dict."""
+    context = _contexts.get(session_id)
+    if context is not None:
+        key = 'hits'
+    else:
+        context = loads(compact)
+        key = 'started' if context is None else 'restored'
+        if context is None:
+            context = new_context()
+    with _metrics_lock:
+        metrics[key] += 1
+    return dict(context)
+
+
+def save(session_id, context):
+    """Remember the context for the session; returns its compact form"""
+    _contexts.set(session_id, dict(context))
+    return dumps(context)
+
+
+def clear(session_id):
+    _contexts.invalidate(session_id)
+
+
+def _price_mentioned(message, filters, context):
+    """Price bounds for the message; a bare number counts as a budget when
+    the last reply asked for one"""
+    if filters['min_price'] is not None or filters['max_price'] is not None:
+        return filters['min_price'], filters['max_price']
+    if context['asked'] in (ASKED_BUDGET, ASKED_PACKAGES):
+        match = _NUMBER_RE.search(message.replace(',', ''))
+        if match and float(match.group(0)) >= chatbot_catalog.MIN_PRICE_MENTION:
+            return None, float(match.group(0))
+    return None
+
+
+def _merge(context, filters, price):
+    """Slots from the message over the ones before. A new category drops the
+    old destination, which was picked for the old category."""
+    slots = {slot: context[slot] for slot in SLOTS}
+    if filters['category'] is not None:
+        if filters['category'] != slots['category'] and filters['destination'] is None:
+            slots['destination'] = None
+        slots['category'] = filters['category']
+    if filters['destination'] is not None:
+        slots['destination'] = filters['destination']
+    if price is not None:
+        slots['min_price'], slots['max_price'] = price
+    return slots
+
+
+def _adjust_price(slots, follow_up, context):
+    """"cheaper" / "pricier" than what was listed last, or than the slots"""
+    if follow_up == CHEAPER:
+        ceiling = context['cheapest'] or slots['max_price']
+        slots['min_price'] = None
+        slots['max_price'] = ceiling - 1 if ceiling else chatbot_intents.engine.intents['budget_low']['price_range'][1]
+    else:
+        floor = context['priciest'] or slots['min_price']
+        slots['max_price'] = None
+        slots['min_price'] = floor + 1 if floor else chatbot_intents.engine.intents['budget_high']['price_range'][0]
+
+
+def resolve(message, intent, context):
+    """Reply to the message read together with the conversation so far, or
+    None to let the intent's own response (or the default one) answer.
+    Updates context in place."""
+    follow_up = follow_ups.classify(message)
+    follow_up = follow_up['name'] if follow_up else None
+    asked, context['asked'] = context['asked'], None
+    if intent is not None:
+        context['intent'] = intent['name']
+
+    if follow_up == RESET or (intent is not None and intent['name'] == 'greeting'):
+        context.update(new_context(), intent=intent['name'] if intent else None)
+        return None
+    if intent is not None and not intent.get('catalog', True):
+        return None
+
+    filters = chatbot_catalog.parse_filters(message, intent)
+    price = _price_mentioned(message, filters, dict(context, asked=asked))
+    mentioned = filters['destination'] is not None or filters['category'] is not None or price is not None
+    slots = _merge(context, filters, price)
+    has_slots = any(value is not None for value in slots.values())
+
+    if follow_up == CONFIRM and asked == ASKED_SIMILAR:
+        # Loosen what found nothing: the destination first, else the budget
+        if slots['destination'] and slots['category']:
+            slots['destination'] = None
+        else:
+            slots['min_price'] = slots['max_price'] = None
+    elif follow_up in (CHEAPER, PRICIER):
+        _adjust_price(slots, follow_up, context)
+    elif follow_up == CONFIRM and asked == ASKED_PACKAGES and not has_slots:
+        text, packages = chatbot_catalog.popular_reply()
+        return _answered(context, slots, text, packages)
+    elif not mentioned and not (follow_up == REGION or (follow_up == PRICE and has_slots) or
+                                (follow_up == CONFIRM and asked)):
+        # Not about packages; keep the slots for a later follow-up
+        if intent is not None:
+            context['asked'] = ASKED_PACKAGES
+        return None
+
+    if slots != _merge(new_context(), filters, price):
+        # Answered with something said before this message
+        with _metrics_lock:
+            metrics['follow_ups'] += 1
+    context.update(slots)
+    if follow_up == REGION and filters['destination'] is None:
+        context['asked'] = ASKED_DESTINATION
+        return chatbot_catalog.regions_reply(slots)
+    if follow_up == PRICE and price is None:
+        context['asked'] = ASKED_BUDGET
+        return chatbot_catalog.prices_reply(slots)
+    text, packages = chatbot_catalog.reply(slots)
+    return _answered(context, slots, text, packages)
+
+
+def _answered(context, slots, text, packages):
+    context.update(slots)
+    if packages:
+        prices = [float(package['price']) for package in packages]
+        context['cheapest'], context['priciest'] = min(prices), max(prices)
+    elif text:
+        context['asked'] = ASKED_SIMILAR
+    return text
+
+
+def get_metrics():
+    with _metrics_lock:
+        return dict(metrics, sessions=len(_contexts), max_sessions=MAX_SESSIONS, ttl_seconds=CONTEXT_TTL)
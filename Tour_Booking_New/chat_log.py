@@ -0,0 +1,143 @@
+import logging
+import queue
+import threading
+import time
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+# A batch is written once it holds BATCH_SIZE rows or its first row has
+# waited FLUSH_INTERVAL_SECONDS, whichever comes first
+BATCH_SIZE = 100
+FLUSH_INTERVAL_SECONDS = 1.0
+# Past this many unwritten rows new ones are dropped and counted; the chat
+# reply never waits for the database
+MAX_QUEUE_SIZE = 5000
+# Queue depth above which the log reports backpressure
+HIGH_WATER_MARK = MAX_QUEUE_SIZE // 2
+
+_queue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
+_writer = None
+_stop_event = threading.Event()
+_metrics_lock = threading.Lock()
+metrics = {
+    'enqueued': 0,
+    'written': 0,
+    'dropped': 0,
+    'failed': 0,
+    'batches': 0,
+    'max_queue_depth': 0,
+    'backpressure': False,
+    'backpressure_events': 0,
+    'last_batch_size': 0,
+    'last_flush_ms': 0.0,
+    'last_error': None
+}
+
+
+def log(user_id, session_id, user_message, bot_response):
+    """Queue one exchange for the background writer. Returns False when the
+    queue is full and the row was dropped."""
+    try:
+        _queue.put_nowait((user_id, session_id, user_message, bot_response))
+    except queue.Full:
+        with _metrics_lock:
+            metrics['dropped'] += 1
+        return False
+
+    depth = _queue.qsize()
+    with _metrics_lock:
+        metrics['enqueued'] += 1
+        if depth > metrics['max_queue_depth']:
+            metrics['max_queue_depth'] = depth
+        if depth >= HIGH_WATER_MARK and not metrics['backpressure']:
+            metrics['backpressure'] = True
+            metrics['backpressure_events'] += 1
+            logger.warning(f"Chat log queue at {depth} rows, the writer is falling behind")
+    return True
+
+
+def _write_batch(rows):
+    started = time.perf_counter()
+    try:
+        with db.transaction() as cursor:
+            cursor.executemany("""
+            INSERT INTO chatbot_conversations (user_id, session_id, user_message, bot_response)
+            VALUES (%s, %s, %s, %s)
+            """, rows)
+    except db.Error as e:
+        logger.error(f"Error writing {len(rows)} chat log rows: {e}")
+        with _metrics_lock:
+            metrics['failed'] += len(rows)
+            metrics['last_error'] = str(e)
+        return 0
+
+    with _metrics_lock:
+        metrics['written'] += len(rows)
+        metrics['batches'] += 1
+        metrics['last_batch_size'] = len(rows)
+        metrics['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        if metrics['backpressure'] and _queue.qsize() < HIGH_WATER_MARK // 2:
+            metrics['backpressure'] = False
+    return len(rows)
+
+
+def _next_batch(first):
+    """The first row plus whatever arrives before the batch is full or due"""
+    rows = [first]
+    deadline = time.monotonic() + FLUSH_INTERVAL_SECONDS
+    while len(rows) < BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            rows.append(_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return rows
+
+
+def flush():
+    """Write everything queued so far. Returns the number of rows written."""
+    written = 0
+    while True:
+        rows = []
+        try:
+            while len(rows) < BATCH_SIZE:
+                rows.append(_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if not rows:
+            return written
+        written += _write_batch(rows)
+
+
+def _run_writer():
+    while not _stop_event.is_set():
+        try:
+            first = _queue.get(timeout=FLUSH_INTERVAL_SECONDS)
+        except queue.Empty:
+            continue
+        _write_batch(_next_batch(first))
+    flush()
+
+
+def start_writer():
+    """Start the background writer once per process"""
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return _writer
+    _stop_event.clear()
+    _writer = threading.Thread(target=_run_writer, name='chat-log-writer', daemon=True)
+    _writer.start()
+    return _writer
+
+
+def stop_writer():
+    _stop_event.set()
+
+
+def get_metrics():
+    with _metrics_lock:
+        return dict(metrics, queue_depth=_queue.qsize(), queue_capacity=MAX_QUEUE_SIZE)
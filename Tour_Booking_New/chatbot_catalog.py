@@ -0,0 +1,177 @@
+import re
+from collections import Counter
+
+import candidate_pools
+import chatbot_intents
+
+# Packages listed per answer
+MAX_RESULTS = 5
+# Destinations named when asked where packages go
+MAX_DESTINATIONS = 8
+# Smaller numbers are days or travelers ("2-3 days"), not prices
+MIN_PRICE_MENTION = 500
+
+_AMOUNT = r"(?:₹|rs\.?|inr)?\s*(\d+(?:\.\d+)?)\s*(k|thousand|lakhs?|l)?\b"
+_BETWEEN_RE = re.compile(rf"\bbetween\s+{_AMOUNT}\s+(?:and|to|-)\s+{_AMOUNT}")
+_RANGE_RE = re.compile(rf"{_AMOUNT}\s*(?:-|to)\s*{_AMOUNT}")
+_MAX_RE = re.compile(rf"\b(?:under|below|less than|upto|up to|within|max|maximum|cheaper than|not more than)\s+{_AMOUNT}")
+_MIN_RE = re.compile(rf"\b(?:above|over|more than|at least|min|minimum|starting at|from)\s+{_AMOUNT}")
+_BARE_RE = re.compile(r"(?:₹|rs\.?|inr)\s*(\d+(?:\.\d+)?)\s*(k|thousand|lakhs?|l)?\b|\b(\d+(?:\.\d+)?)\s*(k|thousand|lakhs?)\b")
+_THOUSANDS_RE = re.compile(r"(?<=\d),(?=\d{3})")
+_MULTIPLIERS = {None: 1, '': 1, 'k': 1000, 'thousand': 1000, 'l': 100000, 'lakh': 100000, 'lakhs': 100000}
+
+_vocabulary = (None, None)
+
+
+def _amount(number, unit):
+    return float(number) * _MULTIPLIERS[unit]
+
+
+def parse_price(message):
+    """(min_price, max_price) asked for in the message; either may be None"""
+    message = _THOUSANDS_RE.sub('', message)
+    match = _BETWEEN_RE.search(message) or _RANGE_RE.search(message)
+    if match:
+        low, high = _amount(*match.group(1, 2)), _amount(*match.group(3, 4))
+        # "10-20k" means 10k to 20k
+        if match.group(2) is None and match.group(4):
+            low = _amount(match.group(1), match.group(4))
+        if min(low, high) >= MIN_PRICE_MENTION:
+            return min(low, high), max(low, high)
+
+    min_price = max_price = None
+    match = _MAX_RE.search(message)
+    if match:
+        max_price = _amount(*match.group(1, 2))
+    match = _MIN_RE.search(message)
+    if match:
+        min_price = _amount(*match.group(1, 2))
+    if min_price is None and max_price is None:
+        # "goa trip 15k" is a budget
+        match = _BARE_RE.search(message)
+        if match:
+            max_price = _amount(*match.group(1, 2)) if match.group(1) else _amount(*match.group(3, 4))
+
+    if min_price is not None and min_price < MIN_PRICE_MENTION:
+        min_price = None
+    if max_price is not None and max_price < MIN_PRICE_MENTION:
+        max_price = None
+    return min_price, max_price
+
+
+def _engine():
+    """Phrase matcher for the destinations and categories currently in the
+    catalog, rebuilt whenever the candidate pools are"""
+    global _vocabulary
+    terms = candidate_pools.catalog_terms()
+    cached_terms, engine = _vocabulary
+    if cached_terms is terms:
+        return engine
+
+    intents = [{'name': ('destination', destination), 'priority': 2, 'phrases': [destination]}
+               for destination in terms['destinations']]
+    for category in terms['categories']:
+        phrases = [category, category + 's', category + 'es']
+        # Synonyms of the chat topic with the same name ("coast" for Beach)
+        topic = chatbot_intents.engine.intents.get(category.strip().lower())
+        if topic:
+            phrases.extend(topic['phrases'])
+        intents.append({'name': ('category', category), 'priority': 1, 'phrases': phrases})
+    engine = chatbot_intents.IntentEngine(intents)
+    _vocabulary = (terms, engine)
+    return engine
+
+
+def parse_filters(message, intent=None):
+    """Destination, category and price range asked for in the message"""
+    filters = {'destination': None, 'category': None, 'min_price': None, 'max_price': None}
+    for match, _, _ in _engine().matches(message):
+        kind, value = match['name']
+        if filters[kind] is None:
+            filters[kind] = value
+    filters['min_price'], filters['max_price'] = parse_price(message)
+    if filters['min_price'] is None and filters['max_price'] is None:
+        # "cheap beach packages" is classified as the beach topic, whose
+        # priority beats the budget intents; the budget word still counts
+        budget = next((match for match, _, _ in chatbot_intents.engine.matches(message)
+                       if match.get('price_range')), intent)
+        if budget:
+            filters['min_price'], filters['max_price'] = budget.get('price_range', (None, None))
+    return filters
+
+
+def _describe(filters):
+    text = f"{filters['category']} packages" if filters.get('category') else 'packages'
+    if filters.get('destination'):
+        text += f" in {filters['destination']}"
+    if filters.get('min_price') is not None and filters.get('max_price') is not None:
+        text += f" between ₹{filters['min_price']:,.0f} and ₹{filters['max_price']:,.0f}"
+    elif filters.get('max_price') is not None:
+        text += f" under ₹{filters['max_price']:,.0f}"
+    elif filters.get('min_price') is not None:
+        text += f" above ₹{filters['min_price']:,.0f}"
+    return text
+
+
+def _format(packages):
+    return '\n'.join(
+        f"• {package['name']} ({package['destination']}) - ₹{float(package['price']):,.0f}, "
+        f"{package['duration_days']} days"
+        for package in packages
+    )
+
+
+def reply(filters):
+    """(text, packages listed) for a parsed filter dict; text is None when
+    the filters ask for nothing"""
+    if not any(value is not None for value in filters.values()):
+        return None, []
+
+    packages = candidate_pools.search(k=MAX_RESULTS, **filters)
+    if packages:
+        return (f"Here are {_describe(filters)} you can book right now:\n{_format(packages)}\n"
+                f"Open any of them from the Packages page to see details and book."), packages
+
+    if filters['min_price'] is not None or filters['max_price'] is not None:
+        relaxed = dict(filters, min_price=None, max_price=None)
+        packages = candidate_pools.search(k=MAX_RESULTS, **relaxed)
+        if packages:
+            return (f"I couldn't find {_describe(filters)} right now. These {_describe(relaxed)} "
+                    f"are the closest:\n{_format(packages)}"), packages
+    if filters['destination'] or filters['category']:
+        return (f"There are no {_describe(filters)} open for booking right now. "
+                f"Want me to suggest something similar?"), []
+    return None, []
+
+
+def _capitalized(text):
+    return text[:1].upper() + text[1:]
+
+
+def regions_reply(filters):
+    """Where the packages matching the filters go, most booked first"""
+    anywhere = dict(filters, destination=None)
+    packages = candidate_pools.search(k=None, **anywhere)
+    if not packages:
+        return f"There are no {_describe(anywhere)} open for booking right now."
+    destinations = [destination for destination, _ in
+                    Counter(package['destination'] for package in packages).most_common(MAX_DESTINATIONS)]
+    return (f"{_capitalized(_describe(anywhere))} are available in {', '.join(destinations)}. "
+            f"Which one should I show you?")
+
+
+def prices_reply(filters):
+    """The price span of the packages matching the filters"""
+    any_price = dict(filters, min_price=None, max_price=None)
+    prices = [float(package['price']) for package in candidate_pools.search(k=None, **any_price)]
+    if not prices:
+        return f"There are no {_describe(any_price)} open for booking right now."
+    return (f"{_capitalized(_describe(any_price))} range from ₹{min(prices):,.0f} to ₹{max(prices):,.0f}. "
+            f"What budget should I look within?")
+
+
+def popular_reply():
+    packages = candidate_pools.popular(MAX_RESULTS)
+    if not packages:
+        return None, []
+    return f"These are our most booked packages right now:\n{_format(packages)}", packages
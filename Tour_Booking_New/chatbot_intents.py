@@ -0,0 +1,179 @@
+import re
+
+# Intent table for the chatbot. Every phrase of every intent is compiled into
+# one regex with word boundaries, so a message is classified in a single scan
+# and "hi" no longer fires inside "this" or "high" inside "highlands". When
+# several intents match, the highest priority wins and ties go to the one
+# mentioned first. Budget intents carry the price range they stand for, and
+# intents with 'catalog': False are never answered with a package list
+# (see chatbot_catalog).
+INTENTS = [
+    {
+        'name': 'beach',
+        'priority': 50,
+        'phrases': ['beach', 'beaches', 'coast', 'coastal', 'seaside', 'island', 'islands', 'sea'],
+        'response': "🏖️ Perfect! For beaches, I recommend:\n• Goa - Famous beaches & nightlife\n• Andaman - Crystal clear waters\n• Kerala - Serene backwaters & beaches\n• Karnataka - Unexplored coastal beauty\nWould you like details about any specific beach destination?"
+    },
+    {
+        'name': 'mountain',
+        'priority': 50,
+        'phrases': ['mountain', 'mountains', 'hill', 'hills', 'hill station', 'himalaya', 'himalayas',
+                    'himalayan', 'snow', 'highlands'],
+        'response': "🏔️ Great choice! Mountain destinations:\n• Himachal - Manali, Shimla, Dharamshala\n• Uttarakhand - Rishikesh, Mussoorie, Nainital\n• Sikkim - Gangtok, beautiful monasteries\n• Kashmir - Paradise on earth\nWhich region interests you most?"
+    },
+    {
+        'name': 'cultural',
+        'priority': 50,
+        'phrases': ['cultural', 'culture', 'heritage', 'history', 'historical', 'historic', 'monument',
+                    'monuments', 'fort', 'forts', 'palace', 'palaces'],
+        'response': "🏛️ India's rich culture awaits!\n• Rajasthan - Palaces & forts\n• Varanasi - Spiritual capital\n• Tamil Nadu - Ancient temples\n• Delhi/Agra - Historical monuments\n• Kerala - Traditional art forms\nTell me which aspect of culture interests you!"
+    },
+    {
+        'name': 'adventure',
+        'priority': 50,
+        'phrases': ['adventure', 'adventures', 'adventurous', 'trek', 'trekking', 'rafting', 'bungee',
+                    'paragliding', 'scuba', 'diving', 'skiing', 'thrill'],
+        'response': "🚀 Adventure time!\n• Rishikesh - River rafting & bungee\n• Manali - Trekking & skiing\n• Ladakh - Motorcycle trips\n• Andaman - Scuba diving\n• Goa - Water sports\nWhat kind of adventure excites you?"
+    },
+    {
+        'name': 'wildlife',
+        'priority': 50,
+        'phrases': ['wildlife', 'safari', 'safaris', 'tiger', 'tigers', 'jungle', 'national park', 'animals'],
+        'response': "🦁 Wildlife adventures:\n• Ranthambore - Tiger safari\n• Jim Corbett - Oldest national park\n• Kaziranga - One-horned rhinos\n• Gir - Asiatic lions\n• Periyar - Elephant reserve\nWhich wildlife experience interests you?"
+    },
+    {
+        'name': 'spiritual',
+        'priority': 50,
+        'phrases': ['spiritual', 'pilgrimage', 'temple', 'temples', 'religious', 'yoga', 'meditation'],
+        'response': "🕉️ Spiritual journeys:\n• Varanasi - Ganga Aarti\n• Amritsar - Golden Temple\n• Bodh Gaya - Buddhist pilgrimage\n• Tirupati - Temple visit\n• Haridwar - Religious ceremonies\nLooking for any specific spiritual experience?"
+    },
+    {
+        'name': 'luxury',
+        'priority': 45,
+        'phrases': ['luxury', 'luxurious', 'premium', '5 star', 'five star'],
+        'response': "✨ Luxury experiences:\n• Udaipur - Palace hotels\n• Kerala - Luxury houseboats\n• Goa - 5-star beach resorts\n• Jaipur - Heritage palaces\n• Shimla - Luxury mountain resorts\nInterested in any specific luxury experience?"
+    },
+    {
+        'name': 'budget_low',
+        'priority': 42,
+        'phrases': ['cheap', 'cheapest', 'low budget', 'economy', 'under 10k', 'below 10k', 'shoestring'],
+        'price_range': (None, 10000),
+        'response': "For budget travel (under ₹10,000):\n• Rishikesh - Yoga & adventure\n• McLeod Ganj - Tibetan culture\n• Hampi - Ancient ruins\n• Pushkar - Desert culture\n• Varkala - Cliff beach\nWould you like package details?"
+    },
+    {
+        'name': 'budget_medium',
+        'priority': 42,
+        'phrases': ['medium', 'moderate', 'mid range', 'midrange', '15k', '20k', '25k'],
+        'price_range': (10000, 25000),
+        'response': "For moderate budget (₹15,000-25,000):\n• Goa - Beach vacation\n• Manali - Mountain escape\n• Rajasthan - Cultural tour\n• Kerala - Backwaters\n• Andaman - Island adventure\nShall I show you available packages?"
+    },
+    {
+        'name': 'budget_high',
+        'priority': 42,
+        'phrases': ['expensive', 'high budget', 'high end', 'splurge', '30k', '50k'],
+        'price_range': (25000, None),
+        'response': "For luxury experiences (₹30,000+):\n• Udaipur - Palace stay\n• Kerala - Luxury houseboat\n• Goa - 5-star resorts\n• Shimla - Luxury mountain retreat\n• Andaman - Private island experience\nInterested in luxury packages?"
+    },
+    {
+        'name': 'budget',
+        'priority': 40,
+        'phrases': ['budget', 'affordable', 'backpacking', 'backpacker'],
+        'response': "💰 Budget-friendly options:\n• Rishikesh - Spiritual & affordable\n• McLeod Ganj - Tibetan culture\n• Hampi - Ancient ruins\n• Pushkar - Cultural experience\n• Varkala - Cliff beach\nWhat's your budget range?"
+    },
+    {
+        'name': 'payment',
+        'priority': 35,
+        'phrases': ['payment', 'payments', 'pay', 'card', 'credit card', 'debit card', 'upi', 'bank', 'refund'],
+        'catalog': False,
+        'response': "Our payment process is secure and easy:\n1. Select your package\n2. Choose number of travelers\n3. Review booking summary\n4. Enter payment details\n5. Get instant confirmation\nAll major credit/debit cards and UPI are accepted! 💳"
+    },
+    {
+        'name': 'booking',
+        'priority': 30,
+        'phrases': ['book', 'booking', 'reserve', 'reservation', 'package', 'packages', 'tour', 'tours'],
+        'response': "Great! You can browse all available packages in the 'Packages' section. Once you find one you like, click 'Book Now' and I'll guide you through the payment process. Would you like me to show you some popular packages?"
+    },
+    {
+        'name': 'help',
+        'priority': 20,
+        'phrases': ['help', 'what can you do', 'how does this work', 'options'],
+        'catalog': False,
+        'response': "I can help you: 🌴 Suggest travel destinations in India 💰 Recommend packages based on your budget 🏔️ Tell you about different types of tourism 🎯 Help you choose based on your interests Just tell me what you're looking for!"
+    },
+    {
+        'name': 'greeting',
+        'priority': 10,
+        'phrases': ['hi', 'hello', 'hey', 'hola', 'namaste', 'good morning', 'good evening', 'good afternoon'],
+        'response': "Namaste! 👋 I'm your travel assistant. I can help you discover amazing places in India! Where would you like to go? You can ask about beaches, mountains, cultural sites, adventure, or budget travel."
+    },
+]
+
+_SPACES = re.compile(r"\s+")
+
+
+def _normalize(phrase):
+    return _SPACES.sub(' ', phrase.strip().lower())
+
+
+def _trie_pattern(node):
+    """Regex for a character trie, so the alternation branches on one
+    character at a time instead of trying every phrase at every position"""
+    branches = []
+    for char, child in sorted(node.items()):
+        if char:
+            branches.append((r'\s+' if char == ' ' else re.escape(char)) + _trie_pattern(child))
+    if not branches:
+        return ''
+    pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if '' in node:
+        # The phrase may also end here; greedy ? tries the longer ones first
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+
+class IntentEngine:
+    """Classifies messages against an intent table compiled into one regex"""
+
+    def __init__(self, intents):
+        self.intents = {intent['name']: intent for intent in intents}
+        self._phrase_intents = {}
+        for intent in intents:
+            for phrase in intent['phrases']:
+                self._phrase_intents.setdefault(_normalize(phrase), []).append(intent)
+
+        # The longest phrase that ends on a word boundary wins at each
+        # position; spaces inside a phrase match any run of whitespace
+        trie = {}
+        for phrase in self._phrase_intents:
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[''] = {}
+        body = _trie_pattern(trie)
+        self._pattern = re.compile(rf"(?<!\w)(?:{body})(?!\w)", re.IGNORECASE) if body else None
+
+    def matches(self, message):
+        """[(intent, phrase, position)] for every phrase found, in message order"""
+        if self._pattern is None:
+            return []
+        found = []
+        for match in self._pattern.finditer(message):
+            phrase = _normalize(match.group(0))
+            for intent in self._phrase_intents[phrase]:
+                found.append((intent, phrase, match.start()))
+        return found
+
+    def classify(self, message):
+        """The best intent for the message, or None"""
+        best = None
+        for intent, _, position in self.matches(message):
+            if best is None or intent['priority'] > best[0]['priority']:
+                best = (intent, position)
+        return best[0] if best else None
+
+
+engine = IntentEngine(INTENTS)
+
+
+def classify(message):
+    return engine.classify(message)
@@ -0,0 +1,211 @@
+import heapq
+import logging
+import math
+import threading
+import time
+
+import database as db
+import inventory
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # NumPy/SciPy are optional, the pure Python build gives the same result
+    np = sparse = None
+
+logger = logging.getLogger(__name__)
+
+# Neighbours kept per package
+TOP_K = 20
+# Bookings update the neighbour lists as they happen; the full rebuild also
+# picks up cancellations, rating edits and deleted users
+REBUILD_SECONDS = 60 * 60
+# A booking counts as a rating of NEUTRAL_RATING; feedback moves it up or down
+NEUTRAL_RATING = 3.0
+
+_lock = threading.Lock()
+_baskets = {}      # user_id -> {package_id: weight}
+_dot = {}          # package_id -> {package_id: sum of weight products over users}
+_norms = {}        # package_id -> sum of squared weights
+_neighbours = {}   # package_id -> [(package_id, similarity)], best first
+_built_at = 0.0
+_version = 0       # bumped whenever any neighbour list changes
+_worker = None
+_stop_event = threading.Event()
+
+
+def interaction_weight(rating=None):
+    if not rating:
+        return 1.0
+    return float(rating) / NEUTRAL_RATING
+
+
+def _load_interactions():
+    """(user_id, package_id, weight) for every package a user booked and did not
+    cancel. Raises on a database error, so a failed rebuild keeps the old lists."""
+    with db.transaction() as cursor:
+        cursor.execute("""
+        SELECT b.user_id, b.package_id, MAX(f.rating) AS rating
+        FROM bookings b
+        LEFT JOIN feedback f ON f.user_id = b.user_id AND f.package_id = b.package_id
+        WHERE b.status != 'cancelled'
+        GROUP BY b.user_id, b.package_id
+        """)
+        rows = cursor.fetchall()
+    return [(row['user_id'], row['package_id'], interaction_weight(row['rating'])) for row in rows]
+
+
+def _cooccurrence_numpy(interactions):
+    """Package x package dot products as X.T @ X over a sparse user x package matrix"""
+    user_index, package_ids = {}, {}
+    rows, cols, weights = [], [], []
+    for user_id, package_id, weight in interactions:
+        rows.append(user_index.setdefault(user_id, len(user_index)))
+        cols.append(package_ids.setdefault(package_id, len(package_ids)))
+        weights.append(weight)
+    ids = np.array(list(package_ids), dtype=np.int64)
+
+    matrix = sparse.csr_matrix((np.array(weights, dtype=np.float32), (rows, cols)),
+                               shape=(len(user_index), len(package_ids)))
+    products = (matrix.T @ matrix).tocsr()
+    norms = products.diagonal()
+    products.setdiag(0)
+    products.eliminate_zeros()
+
+    dot = {}
+    for i in range(products.shape[0]):
+        start, end = products.indptr[i], products.indptr[i + 1]
+        dot[int(ids[i])] = dict(zip(ids[products.indices[start:end]].tolist(),
+                                    products.data[start:end].tolist()))
+    return dot, {int(package_id): float(norm) for package_id, norm in zip(ids, norms)}
+
+
+def _cooccurrence_python(baskets):
+    dot, norms = {}, {}
+    for basket in baskets.values():
+        items = list(basket.items())
+        for i, (package_id, weight) in enumerate(items):
+            norms[package_id] = norms.get(package_id, 0.0) + weight * weight
+            row = dot.setdefault(package_id, {})
+            for other_id, other_weight in items[:i] + items[i + 1:]:
+                row[other_id] = row.get(other_id, 0.0) + weight * other_weight
+    return dot, norms
+
+
+def _top_neighbours(package_id, dot, norms, k=TOP_K):
+    """Cosine similarity to every co-booked package, best k"""
+    norm = norms.get(package_id)
+    if not norm:
+        return []
+    scored = (
+        (other_id, product / math.sqrt(norm * norms[other_id]))
+        for other_id, product in dot.get(package_id, {}).items()
+        if product > 0 and norms.get(other_id)
+    )
+    return heapq.nlargest(k, scored, key=lambda item: item[1])
+
+
+def rebuild():
+    """Recompute every neighbour list from the booking history and swap them in"""
+    global _baskets, _dot, _norms, _neighbours, _built_at, _version
+    started = time.monotonic()
+    interactions = _load_interactions()
+
+    baskets = {}
+    for user_id, package_id, weight in interactions:
+        baskets.setdefault(user_id, {})[package_id] = weight
+    if np is not None and interactions:
+        dot, norms = _cooccurrence_numpy(interactions)
+    else:
+        dot, norms = _cooccurrence_python(baskets)
+    neighbours = {package_id: _top_neighbours(package_id, dot, norms) for package_id in norms}
+
+    with _lock:
+        _baskets, _dot, _norms, _neighbours = baskets, dot, norms, neighbours
+        _built_at = time.monotonic()
+        _version += 1
+    logger.info(f"Built co-booking neighbours for {len(neighbours)} packages from "
+                f"{len(interactions)} bookings in {time.monotonic() - started:.2f}s")
+
+
+def record_booking(user_id, package_id, rating=None):
+    """Fold one booking (or a rating of it) into the matrix and refresh the
+    neighbour lists of the packages it touches. Lists of other packages that
+    point at package_id keep a slightly stale score until the next rebuild."""
+    global _version
+    with _lock:
+        basket = _baskets.setdefault(user_id, {})
+        old = basket.get(package_id, 0.0)
+        new = interaction_weight(rating) if rating else (old or interaction_weight())
+        delta = new - old
+        if not delta:
+            return
+
+        row = _dot.setdefault(package_id, {})
+        for other_id, other_weight in basket.items():
+            if other_id == package_id:
+                continue
+            row[other_id] = row.get(other_id, 0.0) + delta * other_weight
+            other_row = _dot.setdefault(other_id, {})
+            other_row[package_id] = other_row.get(package_id, 0.0) + delta * other_weight
+        _norms[package_id] = _norms.get(package_id, 0.0) + new * new - old * old
+        basket[package_id] = new
+
+        for touched_id in basket:
+            _neighbours[touched_id] = _top_neighbours(touched_id, _dot, _norms)
+        _version += 1
+
+
+def _on_booking_created(user_id, package_id):
+    record_booking(user_id, package_id)
+
+
+def version():
+    """Changes whenever the neighbour lists do, for cache keys"""
+    return _version
+
+
+def also_booked(package_id, k=6):
+    """[(package_id, similarity)] for "users who booked this also booked", from memory"""
+    return _neighbours.get(package_id, [])[:k]
+
+
+def recommend_for_user(user_id, k=6, exclude=()):
+    """Packages most similar to what the user booked, scored by the sum of
+    similarities weighted by how much the user liked each booked package.
+    Returns [(package_id, score)], empty for users without bookings."""
+    basket = _baskets.get(user_id)
+    if not basket:
+        return []
+    exclude = set(exclude) | set(basket)
+    scores = {}
+    for package_id, weight in list(basket.items()):
+        for other_id, similarity in _neighbours.get(package_id, []):
+            if other_id not in exclude:
+                scores[other_id] = scores.get(other_id, 0.0) + weight * similarity
+    return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def _run_worker():
+    while not _stop_event.is_set():
+        try:
+            rebuild()
+        except Exception as e:
+            logger.error(f"Error building co-booking neighbours: {e}")
+        _stop_event.wait(REBUILD_SECONDS)
+
+
+def start_worker():
+    """Build the neighbour lists in the background and keep them fresh"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    _stop_event.clear()
+    inventory.on_booking_created(_on_booking_created)
+    _worker = threading.Thread(target=_run_worker, name='cobooking', daemon=True)
+    _worker.start()
+    return _worker
+
+
+def stop_worker():
+    _stop_event.set()
@@ -0,0 +1,189 @@
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter
+
+import database as db
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, package pages then show no similar packages
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Neighbours kept per package
+TOP_K = 8
+# Terms kept in the vocabulary, the ones found in most packages first
+MAX_TERMS = 5000
+# Share of the similarity given to price and duration; the rest is text
+NUMERIC_WEIGHT = 0.3
+# Rows of the similarity matrix computed at once, to bound memory on big catalogs
+BLOCK_ROWS = 1024
+# Safety net for changes made outside the admin routes
+REBUILD_SECONDS = 60 * 60
+
+# Fields kept per package so the detail page needs no query for its neighbours
+DISPLAY_FIELDS = ('id', 'name', 'destination', 'category', 'price', 'duration_days', 'image_url')
+
+STOP_WORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or our the this that to with you your
+will can all into over per plus up we us day days tour tours package packages trip
+""".split())
+TOKEN_RE = re.compile(r"[a-z]{2,}")
+
+_lock = threading.Lock()
+_index = {'version': 0, 'neighbours': {}, 'packages': {}}
+_worker = None
+_wakeup = threading.Event()
+_stop_event = threading.Event()
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall((text or '').lower()) if token not in STOP_WORDS]
+
+
+def _package_text(package):
+    # Destination and category count as words of the description, so two
+    # packages to the same place share terms even with unrelated copy
+    return ' '.join(str(package.get(field) or '') for field in ('name', 'destination', 'category', 'description'))
+
+
+def _tfidf(documents):
+    """L2 normalized TF-IDF rows (float32) with sublinear term frequency"""
+    counts = [Counter(tokenize(document)) for document in documents]
+    document_frequency = Counter(term for count in counts for term in count)
+    vocabulary = {term: i for i, (term, _) in enumerate(document_frequency.most_common(MAX_TERMS))}
+
+    matrix = np.zeros((len(documents), len(vocabulary)), dtype=np.float32)
+    for row, count in enumerate(counts):
+        for term, frequency in count.items():
+            column = vocabulary.get(term)
+            if column is not None:
+                matrix[row, column] = 1.0 + math.log(frequency)
+    idf = np.array([math.log((1 + len(documents)) / (1 + document_frequency[term])) + 1.0
+                    for term in vocabulary], dtype=np.float32)
+    matrix *= idf
+    return _normalize_rows(matrix)
+
+
+def _numeric_features(packages):
+    """Standardized log price and duration, so "similar" also means similar
+    budget and length"""
+    raw = np.array([[math.log1p(float(package['price'] or 0)), float(package['duration_days'] or 0)]
+                    for package in packages], dtype=np.float32)
+    spread = raw.std(axis=0)
+    spread[spread == 0] = 1.0
+    return (raw - raw.mean(axis=0)) / spread
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def build_matrix(packages):
+    """Dense float32 feature matrix, one unit row per package, so a matrix
+    product gives cosine similarities"""
+    text = _tfidf([_package_text(package) for package in packages])
+    numeric = _normalize_rows(_numeric_features(packages))
+    features = np.hstack([text * math.sqrt(1 - NUMERIC_WEIGHT), numeric * math.sqrt(NUMERIC_WEIGHT)])
+    return _normalize_rows(features).astype(np.float32)
+
+
+def top_neighbours(matrix, k=TOP_K):
+    """(indices, scores) of the k most similar other rows, best first"""
+    count = matrix.shape[0]
+    k = min(k, count - 1)
+    indices = np.zeros((count, max(k, 0)), dtype=np.int64)
+    scores = np.zeros((count, max(k, 0)), dtype=np.float32)
+    if k <= 0:
+        return indices, scores
+    for start in range(0, count, BLOCK_ROWS):
+        block = matrix[start:start + BLOCK_ROWS] @ matrix.T
+        block[np.arange(block.shape[0]), np.arange(start, start + block.shape[0])] = -np.inf
+        best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(block, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        indices[start:start + block.shape[0]] = np.take_along_axis(best, order, axis=1)
+        scores[start:start + block.shape[0]] = np.take_along_axis(best_scores, order, axis=1)
+    return indices, scores
+
+
+def rebuild():
+    """Index every active package and swap in the new neighbour lists"""
+    global _index
+    if np is None:
+        return
+    started = time.monotonic()
+    # Errors raise here, so a failed load keeps the previous index
+    with db.transaction() as cursor:
+        cursor.execute(
+            "SELECT id, name, description, destination, category, price, duration_days, image_url "
+            "FROM packages WHERE is_active = TRUE ORDER BY id"
+        )
+        packages = cursor.fetchall()
+
+    neighbours = {}
+    if packages:
+        indices, scores = top_neighbours(build_matrix(packages))
+        for row, package in enumerate(packages):
+            neighbours[package['id']] = [
+                (packages[column]['id'], float(score))
+                for column, score in zip(indices[row].tolist(), scores[row].tolist())
+                if score > 0
+            ]
+    display = {package['id']: {field: package[field] for field in DISPLAY_FIELDS} for package in packages}
+
+    with _lock:
+        _index = {'version': _index['version'] + 1, 'neighbours': neighbours, 'packages': display}
+    logger.info(f"Built content index over {len(packages)} packages in {time.monotonic() - started:.2f}s")
+
+
+def version():
+    """Changes whenever the neighbour lists do, for cache keys"""
+    return _index['version']
+
+
+def similar(package_id, k=4):
+    """Display fields of the k packages most like package_id, from memory"""
+    index = _index
+    return [dict(index['packages'][other_id], similarity=score)
+            for other_id, score in index['neighbours'].get(package_id, [])[:k]]
+
+
+def refresh():
+    """Ask the worker to rebuild, e.g. after a package was added or edited"""
+    _wakeup.set()
+
+
+def _run_worker():
+    while not _stop_event.is_set():
+        try:
+            rebuild()
+        except Exception as e:
+            logger.error(f"Error building content index: {e}")
+        _wakeup.wait(REBUILD_SECONDS)
+        _wakeup.clear()
+
+
+def start_worker():
+    """Build the index in the background once per process"""
+    global _worker
+    if np is None:
+        logger.info('NumPy is not installed, similar packages are disabled')
+        return None
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    _stop_event.clear()
+    _worker = threading.Thread(target=_run_worker, name='content-index', daemon=True)
+    _worker.start()
+    return _worker
+
+
+def stop_worker():
+    _stop_event.set()
+    _wakeup.set()
@@ -1,12 +1,16 @@
 import mysql.connector
 from mysql.connector import Error
 import logging
+from contextlib import contextmanager
 from datetime import datetime
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Upper bound on how long a transaction waits for a row lock before giving up
+LOCK_WAIT_TIMEOUT = 3
+
 def create_connection():
     try:
         connection = mysql.connector.connect(
@@ -24,7 +28,7 @@ def create_connection():
         logger.error(f"Error connecting to MySQL: {e}")
         return None
 
-def execute_query(query, params=None, fetch=False, fetch_one=False):
+def execute_query(query, params=None, fetch=False, fetch_one=False, rowcount=False):
     connection = create_connection()
     if connection is None:
         logger.error("No database connection")
@@ -47,8 +51,11 @@ def execute_query(query, params=None, fetch=False, fetch_one=False):
             return result
         else:
             connection.commit()
+            # Callers that need to know how many rows changed ask for rowcount
+            if rowcount:
+                result = cursor.rowcount
             # For INSERT queries, return lastrowid if available
-            if query.strip().upper().startswith('INSERT'):
+            elif query.strip().upper().startswith('INSERT'):
                 result = cursor.lastrowid or True
             else:
                 # For UPDATE/DELETE queries, return True if rows were affected
@@ -64,12 +71,56 @@ def execute_query(query, params=None, fetch=False, fetch_one=False):
             return None
         elif fetch:
             return []
+        elif rowcount:
+            return 0
         else:
             return False
     finally:
         cursor.close()
         connection.close()
 
+@contextmanager
+def transaction(isolation_level=None):
+    """Run several statements on one connection as a single transaction.
+    Yields a dictionary cursor; commits on success and rolls back on error."""
+    connection = create_connection()
+    if connection is None:
+        raise Error("No database connection")
+    
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("SET SESSION innodb_lock_wait_timeout = %s", (LOCK_WAIT_TIMEOUT,))
+        connection.start_transaction(isolation_level=isolation_level)
+        yield cursor
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+def add_missing_columns(table_name, columns):
+    """Add each (column_name, column_def) to table_name unless it already exists.
+    Returns the names of the columns that were added."""
+    added = []
+    for column_name, column_def in columns:
+        check_column_query = """
+        SELECT COUNT(*) as exists_flag 
+        FROM information_schema.columns 
+        WHERE table_schema = 'tourbook' 
+        AND table_name = %s 
+        AND column_name = %s
+        """
+        result = execute_query(check_column_query, (table_name, column_name), fetch=True)
+        
+        if result and result[0]['exists_flag'] == 0:
+            alter_query = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_def}"
+            execute_query(alter_query)
+            added.append(column_name)
+            logger.info(f"Added column {column_name} to {table_name} table")
+    return added
+
 # Database initialization function
 def initialize_database():
     """Initialize database with required tables and columns"""
@@ -79,21 +130,7 @@ def initialize_database():
             ('is_active', 'BOOLEAN DEFAULT TRUE'),
             ('max_slots', 'INT DEFAULT 0')
         ]
-        
-        for column_name, column_def in package_columns:
-            check_column_query = """
-            SELECT COUNT(*) as exists_flag 
-            FROM information_schema.columns 
-            WHERE table_schema = 'tourbook' 
-            AND table_name = 'packages' 
-            AND column_name = %s
-            """
-            result = execute_query(check_column_query, (column_name,), fetch=True)
-            
-            if result and result[0]['exists_flag'] == 0:
-                alter_query = f"ALTER TABLE packages ADD COLUMN {column_name} {column_def}"
-                execute_query(alter_query)
-                logger.info(f"Added column {column_name} to packages table")
+        add_missing_columns('packages', package_columns)
         
         # Only create essential tables (remove all the new feature tables)
         essential_tables = {
@@ -106,6 +143,121 @@ def initialize_database():
                     display_order INT DEFAULT 0,
                     FOREIGN KEY (package_id) REFERENCES packages(id) ON DELETE CASCADE
                 )
+            """,
+            'idempotency_keys': """
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    user_id INT NOT NULL,
+                    idempotency_key VARCHAR(64) NOT NULL,
+                    status VARCHAR(16) NOT NULL DEFAULT 'in_progress',
+                    response TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, idempotency_key),
+                    INDEX idx_idempotency_keys_created_at (created_at)
+                )
+            """,
+            'payment_jobs': """
+                CREATE TABLE IF NOT EXISTS payment_jobs (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    booking_id INT NOT NULL,
+                    user_id INT NOT NULL,
+                    amount DECIMAL(10, 2) NOT NULL,
+                    card_last_four VARCHAR(4),
+                    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+                    attempts INT NOT NULL DEFAULT 0,
+                    claim_token VARCHAR(32) DEFAULT NULL,
+                    transaction_id VARCHAR(64) DEFAULT NULL,
+                    message VARCHAR(255) DEFAULT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_payment_jobs_status (status, id),
+                    INDEX idx_payment_jobs_claim (claim_token),
+                    INDEX idx_payment_jobs_booking (booking_id)
+                )
+            """,
+            'user_purge_jobs': """
+                CREATE TABLE IF NOT EXISTS user_purge_jobs (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    requested_by INT,
+                    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+                    step VARCHAR(32) DEFAULT NULL,
+                    total_rows INT NOT NULL DEFAULT 0,
+                    deleted_rows INT NOT NULL DEFAULT 0,
+                    released_slots INT NOT NULL DEFAULT 0,
+                    claim_token VARCHAR(32) DEFAULT NULL,
+                    message VARCHAR(255) DEFAULT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_user_purge_jobs_status (status, id),
+                    INDEX idx_user_purge_jobs_user (user_id),
+                    INDEX idx_user_purge_jobs_claim (claim_token)
+                )
+            """,
+            'package_waitlist': """
+                CREATE TABLE IF NOT EXISTS package_waitlist (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    package_id INT NOT NULL,
+                    user_id INT NOT NULL,
+                    travelers_count INT NOT NULL DEFAULT 1,
+                    status VARCHAR(16) NOT NULL DEFAULT 'waiting',
+                    booking_id INT DEFAULT NULL,
+                    offered_at DATETIME DEFAULT NULL,
+                    offer_expires_at DATETIME DEFAULT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_package_waitlist_queue (package_id, status, id),
+                    INDEX idx_package_waitlist_user (user_id, package_id, status),
+                    INDEX idx_package_waitlist_status (status, package_id)
+                )
+            """,
+            'notifications': """
+                CREATE TABLE IF NOT EXISTS notifications (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    type VARCHAR(20) NOT NULL DEFAULT 'booking',
+                    title VARCHAR(150) NOT NULL,
+                    message TEXT,
+                    related_entity_type VARCHAR(20) DEFAULT NULL,
+                    related_entity_id INT DEFAULT NULL,
+                    is_read BOOLEAN NOT NULL DEFAULT FALSE,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_notifications_user (user_id, id),
+                    INDEX idx_notifications_unread (user_id, is_read)
+                )
+            """,
+            'chatbot_conversations': """
+                CREATE TABLE IF NOT EXISTS chatbot_conversations (
+                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    user_id INT NOT NULL,
+                    session_id VARCHAR(64) DEFAULT NULL,
+                    user_message TEXT,
+                    bot_response TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    INDEX idx_chatbot_conversations_user (user_id, id),
+                    INDEX idx_chatbot_conversations_session (session_id, id)
+                )
+            """,
+            'user_preferred_destinations': """
+                CREATE TABLE IF NOT EXISTS user_preferred_destinations (
+                    user_id INT NOT NULL,
+                    destination VARCHAR(100) NOT NULL,
+                    position INT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, destination),
+                    INDEX idx_user_preferred_destinations_destination (destination)
+                )
+            """,
+            'package_inventory_stripes': """
+                CREATE TABLE IF NOT EXISTS package_inventory_stripes (
+                    package_id INT NOT NULL,
+                    stripe_no INT NOT NULL,
+                    available_slots INT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (package_id, stripe_no)
+                )
+            """,
+            'data_versions': """
+                CREATE TABLE IF NOT EXISTS data_versions (
+                    name VARCHAR(64) PRIMARY KEY,
+                    version BIGINT NOT NULL DEFAULT 0
+                )
             """
         }
         
@@ -113,14 +265,64 @@ def initialize_database():
             execute_query(create_query)
             logger.info(f"Created/verified table: {table_name}")
         
+        # Resized derivatives generated by images.py
+        package_image_columns = [
+            ('width', 'INT DEFAULT NULL'),
+            ('format', 'VARCHAR(10) DEFAULT NULL'),
+            ('source_url', 'VARCHAR(255) DEFAULT NULL')
+        ]
+        add_missing_columns('package_images', package_image_columns)
+        
+        # Slots a booking currently takes out of packages.available_slots
+        booking_columns = [
+            ('slots_held', 'INT NOT NULL DEFAULT 0'),
+            ('hold_expires_at', 'DATETIME DEFAULT NULL')
+        ]
+        added_booking_columns = add_missing_columns('bookings', booking_columns)
+        if 'slots_held' in added_booking_columns:
+            # Before reservations only payment took slots; bookings an admin
+            # confirmed without payment never did, so they hold none
+            execute_query("UPDATE bookings SET slots_held = travelers_count "
+                          "WHERE status = 'confirmed' AND payment_status = 'completed'")
+        if 'hold_expires_at' in added_booking_columns:
+            # Let the sweeper pick up pending bookings abandoned before holds expired
+            execute_query("UPDATE bookings SET hold_expires_at = booking_date + INTERVAL 15 MINUTE WHERE status = 'pending'")
+        
+        # Normalized budget bounds next to the free text budget_range; rows
+        # saved before are migrated by preferences.migrate_legacy_rows()
+        add_missing_columns('user_preferences', [
+            ('budget_min', 'DECIMAL(10,2) DEFAULT NULL'),
+            ('budget_max', 'DECIMAL(10,2) DEFAULT NULL'),
+            ('normalized', 'BOOLEAN NOT NULL DEFAULT FALSE')
+        ])
+        
+        # Hot packages can split their slots across package_inventory_stripes;
+        # 0 keeps them in packages.available_slots
+        add_missing_columns('packages', [('inventory_stripes', 'INT NOT NULL DEFAULT 0')])
+        
+        # Live slot counts for striped and unstriped packages alike
+        execute_query("""
+        CREATE OR REPLACE VIEW package_inventory AS
+        SELECT p.id AS package_id,
+               CASE WHEN p.inventory_stripes > 0
+                    THEN (SELECT COALESCE(SUM(s.available_slots), 0)
+                          FROM package_inventory_stripes s WHERE s.package_id = p.id)
+                    ELSE p.available_slots
+               END AS available_slots
+        FROM packages p
+        """)
+        
         # Create basic indexes for performance
         indexes = [
             "CREATE INDEX idx_bookings_user_id ON bookings(user_id)",
             "CREATE INDEX idx_bookings_package_id ON bookings(package_id)",
+            "CREATE INDEX idx_bookings_status_hold ON bookings(status, hold_expires_at)",
             "CREATE INDEX idx_feedback_user_id ON feedback(user_id)",
             "CREATE INDEX idx_feedback_package_id ON feedback(package_id)",
             "CREATE INDEX idx_packages_destination ON packages(destination)",
-            "CREATE INDEX idx_packages_category ON packages(category)"
+            "CREATE INDEX idx_packages_category ON packages(category)",
+            "CREATE INDEX idx_user_preferences_user_id ON user_preferences(user_id)",
+            "CREATE INDEX idx_user_preferences_normalized ON user_preferences(normalized, id)"
         ]
 
         # Single loop for index creation with proper error handling
@@ -0,0 +1,96 @@
+import json
+import logging
+
+import database as db
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Stored responses are replayed for this long, then evicted by the sweeper
+KEY_TTL_SECONDS = 24 * 60 * 60
+EVICT_BATCH_SIZE = 1000
+# A claim this old without a response belongs to a request that died midway
+IN_PROGRESS_TIMEOUT_SECONDS = 60
+MAX_KEY_LENGTH = 64
+
+# Completed responses are kept in memory too, so retries never hit MySQL
+_responses = TTLCache(ttl=KEY_TTL_SECONDS, max_entries=10000)
+
+NEW = 'new'
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+
+
+def _decode(text):
+    """(response, status_code) from a stored row; rows written before the
+    status code was stored were all 200s"""
+    stored = json.loads(text)
+    if isinstance(stored, dict) and set(stored) == {'status_code', 'body'}:
+        return stored['body'], stored['status_code']
+    return stored, 200
+
+
+def begin(user_id, key):
+    """Claim an idempotency key. Returns (state, stored), where stored is
+    (response, status_code) for a completed key and None otherwise."""
+    cached = _responses.get((user_id, key))
+    if cached is not None:
+        return COMPLETED, cached
+
+    claimed = db.execute_query("""
+    INSERT IGNORE INTO idempotency_keys (user_id, idempotency_key, status)
+    VALUES (%s, %s, 'in_progress')
+    """, (user_id, key), rowcount=True)
+    if claimed:
+        return NEW, None
+
+    existing = db.execute_query("""
+    SELECT status, response FROM idempotency_keys
+    WHERE user_id = %s AND idempotency_key = %s
+    """, (user_id, key), fetch=True)
+    if not existing:
+        # Evicted between the two statements, let the caller retry
+        return IN_PROGRESS, None
+    if existing[0]['status'] == COMPLETED:
+        stored = _decode(existing[0]['response'])
+        _responses.set((user_id, key), stored)
+        return COMPLETED, stored
+
+    taken_over = db.execute_query("""
+    UPDATE idempotency_keys SET created_at = NOW()
+    WHERE user_id = %s AND idempotency_key = %s AND status = 'in_progress'
+    AND created_at < NOW() - INTERVAL %s SECOND
+    """, (user_id, key, IN_PROGRESS_TIMEOUT_SECONDS), rowcount=True)
+    return (NEW if taken_over else IN_PROGRESS), None
+
+
+def complete(user_id, key, response, status_code=200):
+    """Store the final response and its status for a key so retries get
+    both back unchanged"""
+    db.execute_query("""
+    UPDATE idempotency_keys SET status = 'completed', response = %s
+    WHERE user_id = %s AND idempotency_key = %s
+    """, (json.dumps({'status_code': status_code, 'body': response}), user_id, key))
+    _responses.set((user_id, key), (response, status_code))
+
+
+def release(user_id, key):
+    """Forget a key whose request failed, so the client can try again"""
+    db.execute_query(
+        "DELETE FROM idempotency_keys WHERE user_id = %s AND idempotency_key = %s",
+        (user_id, key)
+    )
+
+
+def evict_expired(ttl=KEY_TTL_SECONDS, batch_size=EVICT_BATCH_SIZE):
+    """Delete keys older than ttl through the created_at index, one batch at a time"""
+    evicted = 0
+    while True:
+        deleted = db.execute_query("""
+        DELETE FROM idempotency_keys
+        WHERE created_at < NOW() - INTERVAL %s SECOND
+        LIMIT %s
+        """, (ttl, batch_size), rowcount=True)
+        evicted += deleted or 0
+        if not deleted or deleted < batch_size:
+            return evicted
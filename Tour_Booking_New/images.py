@@ -0,0 +1,270 @@
+import hashlib
+import io
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import database as db
+import versions
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, templates fall back to the original image
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Fixed widths and formats generated for every package image
+DERIVATIVE_WIDTHS = (320, 640, 1024)
+DERIVATIVE_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}
+}
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+DOWNLOAD_TIMEOUT = 10
+# Remote originals are only fetched over these schemes from these hosts, and
+# never from an address inside our own network
+REMOTE_SCHEMES = ('http', 'https')
+REMOTE_HOSTS = ('images.unsplash.com', 'via.placeholder.com')
+WORKER_COUNT = 2
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DERIVED_DIR = os.path.join(STATIC_DIR, 'images', 'derived')
+
+_executor = ThreadPoolExecutor(max_workers=WORKER_COUNT, thread_name_prefix='image-worker')
+_lock = threading.Lock()
+# package_id -> (source url, {(format, width): static url}), loaded lazily from
+# package_images and again whenever any process registers new derivatives
+_derivatives = None
+_loaded_version = None
+
+
+def _allowed_remote(url):
+    """Whether a remote original may be fetched: an allowed scheme and host
+    that resolves to public addresses only"""
+    parts = urllib.parse.urlsplit(url)
+    host = (parts.hostname or '').lower()
+    if parts.scheme not in REMOTE_SCHEMES or host not in REMOTE_HOSTS:
+        return False
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or None)}
+    except (OSError, UnicodeError):
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split('%', 1)[0]).is_global for address in addresses)
+
+
+class _CheckedRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Follow a redirect only to a URL that passes the same checks"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        if not _allowed_remote(newurl):
+            raise ValueError(f"Refusing image redirect to {newurl}")
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_opener = urllib.request.build_opener(_CheckedRedirectHandler)
+
+
+def _read_source(image_url):
+    """Return the original image bytes for a local static path or a remote
+    URL on an allowed host; None for anything else"""
+    if not image_url:
+        return None
+
+    if '://' in image_url or image_url.startswith('//'):
+        if not _allowed_remote(image_url):
+            logger.warning(f"Not fetching image from disallowed URL: {image_url}")
+            return None
+        with _opener.open(image_url, timeout=DOWNLOAD_TIMEOUT) as response:
+            return response.read(MAX_SOURCE_BYTES + 1)
+
+    # Local files are referenced as /static/images/x.png or images/x.png
+    relative = image_url.split('/static/', 1)[-1].lstrip('/')
+    static_dir = os.path.realpath(STATIC_DIR)
+    path = os.path.realpath(os.path.join(static_dir, relative))
+    if os.path.commonpath([static_dir, path]) != static_dir or not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read(MAX_SOURCE_BYTES + 1)
+
+
+def _render_derivatives(source_bytes):
+    """Resize the source to every configured width and format"""
+    original = Image.open(io.BytesIO(source_bytes))
+    original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'A' in original.getbands() else 'RGB')
+
+    # Never upscale, a small source just gets re-encoded once at its own size
+    widths = [width for width in DERIVATIVE_WIDTHS if width <= original.width] or DERIVATIVE_WIDTHS[:1]
+
+    results = []
+    for width in widths:
+        target_width = min(width, original.width)
+        target_height = max(1, round(original.height * target_width / original.width))
+        resized = original.resize((target_width, target_height), Image.LANCZOS)
+
+        for extension, options in DERIVATIVE_FORMATS.items():
+            image = resized.convert('RGB') if options['format'] == 'JPEG' else resized
+            buffer = io.BytesIO()
+            image.save(buffer, **options)
+            # Registered at the width actually encoded, so srcset descriptors are true
+            results.append((extension, target_width, buffer.getvalue()))
+
+    return results
+
+
+def _write_derivative(package_id, extension, width, data):
+    # Content-hashed names let the files be cached forever by browsers
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    filename = f"{package_id}-{width}-{digest}.{extension}"
+    path = os.path.join(DERIVED_DIR, filename)
+    if not os.path.exists(path):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    return f"/static/images/derived/{filename}"
+
+
+def process_package_image(package_id, image_url):
+    """Generate, store and register all derivatives for one package image"""
+    if Image is None:
+        logger.warning("Pillow is not installed, skipping image derivatives")
+        return False
+
+    try:
+        source_bytes = _read_source(image_url)
+        if not source_bytes or len(source_bytes) > MAX_SOURCE_BYTES:
+            logger.warning(f"No usable source image for package {package_id}: {image_url}")
+            return False
+
+        os.makedirs(DERIVED_DIR, exist_ok=True)
+        rendered = _render_derivatives(source_bytes)
+        derivatives = {}
+        for extension, width, data in rendered:
+            derivatives[(extension, width)] = _write_derivative(package_id, extension, width, data)
+    except Exception as e:
+        logger.error(f"Error generating derivatives for package {package_id}: {e}")
+        return False
+
+    placeholders = ', '.join(['(%s, %s, %s, %s, %s, FALSE, %s)'] * len(derivatives))
+    params = []
+    for order, ((extension, width), url) in enumerate(sorted(derivatives.items(), key=lambda item: item[0][1])):
+        params.extend([package_id, url, width, extension, image_url, order])
+    try:
+        with db.transaction() as cursor:
+            # A job for an older image_url that finishes late must not
+            # replace the rows of the newer one
+            cursor.execute("SELECT image_url FROM packages WHERE id = %s FOR UPDATE", (package_id,))
+            package = cursor.fetchone()
+            if not package or package['image_url'] != image_url:
+                logger.info(f"Image of package {package_id} changed, dropping derivatives of {image_url}")
+                return False
+            # Replace the previous derivative rows with one multi-row insert
+            cursor.execute("DELETE FROM package_images WHERE package_id = %s AND width IS NOT NULL", (package_id,))
+            cursor.execute(f"""
+            INSERT INTO package_images (package_id, image_url, width, format, source_url, is_primary, display_order)
+            VALUES {placeholders}
+            """, params)
+    except db.Error as e:
+        logger.error(f"Error registering derivatives for package {package_id}: {e}")
+        return False
+
+    # Every process reloads its derivative map; rendered pages embed the
+    # image URLs, so they have to be revalidated too
+    versions.package_images_changed()
+    versions.package_changed(package_id)
+
+    logger.info(f"Generated {len(derivatives)} image derivatives for package {package_id}")
+    return True
+
+
+def schedule_derivatives(package_id, image_url):
+    """Queue derivative generation on the background worker pool"""
+    if Image is None or not package_id:
+        return None
+    # Until the new derivatives are registered their source_url does not
+    # match the package's image_url, so pages show the new original
+    return _executor.submit(process_package_image, package_id, image_url)
+
+
+def _load_derivatives():
+    global _derivatives, _loaded_version
+    version = versions.package_images_version()
+    with _lock:
+        if _derivatives is None or version != _loaded_version:
+            try:
+                with db.transaction() as cursor:
+                    cursor.execute("""
+                    SELECT pi.package_id, pi.image_url, pi.width, pi.format, pi.source_url
+                    FROM package_images pi
+                    JOIN packages p ON p.id = pi.package_id
+                    WHERE pi.width IS NOT NULL AND pi.source_url = p.image_url
+                    """)
+                    rows = cursor.fetchall()
+            except db.Error as e:
+                # Keep what we have; the originals are served meanwhile
+                logger.error(f"Error loading image derivatives: {e}")
+                return _derivatives or {}
+            derivatives = {}
+            for row in rows:
+                source_url, by_size = derivatives.setdefault(row['package_id'], (row['source_url'], {}))
+                by_size[(row['format'], row['width'])] = row['image_url']
+            _derivatives, _loaded_version = derivatives, version
+        return _derivatives
+
+
+def _package_derivatives(package):
+    """Derivatives of the package's current image_url, empty for any other"""
+    source_url, derivatives = _load_derivatives().get(package['id'], (None, {}))
+    return derivatives if source_url == package.get('image_url') else {}
+
+
+def _widths(derivatives, extension):
+    return sorted(width for derivative_extension, width in derivatives if derivative_extension == extension)
+
+
+def image_src(package, width, extension='jpg'):
+    """URL of the smallest derivative at least `width` wide, else the largest one
+    or the original image when the package has no derivatives"""
+    derivatives = _package_derivatives(package)
+    available = _widths(derivatives, extension)
+    if not available:
+        return package.get('image_url')
+    for candidate in available:
+        if candidate >= width:
+            return derivatives[(extension, candidate)]
+    return derivatives[(extension, available[-1])]
+
+
+def image_srcset(package, extension='webp'):
+    """srcset attribute value for a package, empty when no derivatives exist.
+    Templates list the webp set in a <picture> source and the jpg set on the
+    <img> as the fallback."""
+    derivatives = _package_derivatives(package)
+    return ', '.join(
+        f"{derivatives[(extension, width)]} {width}w"
+        for width in _widths(derivatives, extension)
+    )
+
+
+def backfill():
+    """Generate derivatives for every package that does not have them yet"""
+    rows = db.execute_query("SELECT id, image_url FROM packages", fetch=True) or []
+    existing = _load_derivatives()
+    futures = [
+        schedule_derivatives(row['id'], row['image_url'])
+        for row in rows
+        if existing.get(row['id'], (None,))[0] != row['image_url']
+    ]
+    return sum(1 for future in futures if future is not None and future.result())
+
+
+if __name__ == '__main__':
+    print(f"Generated derivatives for {backfill()} packages")
@@ -0,0 +1,611 @@
+import logging
+import random
+from collections import Counter, defaultdict
+
+import database as db
+import notifications
+import versions
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Availability changes on every booking, so entries only live for a couple of
+# seconds. Entries are also tagged with the package version, so this process
+# never serves a stale count after its own writes.
+AVAILABILITY_TTL = 2
+MAX_BATCH_SIZE = 100
+# Upper bound on the bookings one bulk status change may lock
+MAX_BULK_BOOKINGS = 1000
+
+# Pending bookings hold their slots this long before the sweeper releases them
+HOLD_TTL_SECONDS = 15 * 60
+
+# Striped packages spread their slots over this many rows at most
+MAX_STRIPES = 64
+# How long a process trusts its cached striping mode. A stale mode is only
+# ever slower, never wrong: the statements below notice and re-read it.
+STRIPE_MODE_TTL = 5
+# Stripe rows are locked by these transactions; READ COMMITTED releases the
+# lock on a stripe whose conditional UPDATE did not match straight away
+ISOLATION_LEVEL = 'READ COMMITTED'
+
+# Live slot count: the sum of the stripes for striped packages. The same
+# expression backs the package_inventory view.
+AVAILABLE_SLOTS_SQL = """
+CASE WHEN packages.inventory_stripes > 0
+     THEN (SELECT COALESCE(SUM(s.available_slots), 0)
+           FROM package_inventory_stripes s WHERE s.package_id = packages.id)
+     ELSE packages.available_slots
+END
+"""
+
+_availability_cache = TTLCache(ttl=AVAILABILITY_TTL, max_entries=4096)
+_stripe_mode_cache = TTLCache(ttl=STRIPE_MODE_TTL, max_entries=4096)
+_release_listeners = []
+_booking_listeners = []
+_update_listeners = []
+
+
+def on_slots_released(callback):
+    """Register callback(package_ids), called after a commit that gave slots back"""
+    if callback not in _release_listeners:
+        _release_listeners.append(callback)
+
+
+def on_booking_created(callback):
+    """Register callback(user_id, package_id), called after a booking is committed"""
+    if callback not in _booking_listeners:
+        _booking_listeners.append(callback)
+
+
+def on_bookings_updated(callback):
+    """Register callback(package_ids), called after a commit that changed the
+    status or payment of existing bookings"""
+    if callback not in _update_listeners:
+        _update_listeners.append(callback)
+
+
+def bookings_updated(package_ids):
+    package_ids = sorted({package_id for package_id in package_ids if package_id})
+    if not package_ids:
+        return
+    for callback in _update_listeners:
+        try:
+            callback(package_ids)
+        except Exception as e:
+            logger.error(f"Error in bookings updated listener: {e}")
+
+
+def booking_created(user_id, package_id):
+    for callback in _booking_listeners:
+        try:
+            callback(user_id, package_id)
+        except Exception as e:
+            logger.error(f"Error in booking created listener: {e}")
+
+
+def slots_released(package_ids):
+    package_ids = [package_id for package_id in package_ids if package_id]
+    if not package_ids:
+        return
+    for callback in _release_listeners:
+        try:
+            callback(package_ids)
+        except Exception as e:
+            logger.error(f"Error in slots released listener: {e}")
+
+
+def _to_availability(row):
+    # The striped SUM() comes back as a Decimal, which jsonify sends as a string
+    available_slots = int(row['available_slots'])
+    return {
+        'package_id': row['id'],
+        'available_slots': available_slots,
+        'max_slots': row['max_slots'],
+        'is_active': bool(row['is_active']),
+        'sold_out': available_slots <= 0
+    }
+
+
+def get_availability(package_ids):
+    """Return {package_id: availability} for the given ids using one narrow query"""
+    result = {}
+    missing = []
+
+    for package_id in package_ids:
+        cached = _availability_cache.get(package_id)
+        if cached is not None and cached[0] == versions.package_version(package_id):
+            result[package_id] = cached[1]
+        else:
+            missing.append(package_id)
+
+    if missing:
+        placeholders = ','.join(['%s'] * len(missing))
+        query = f"""
+        SELECT id, {AVAILABLE_SLOTS_SQL} AS available_slots, max_slots, is_active
+        FROM packages
+        WHERE id IN ({placeholders})
+        """
+        # Read the versions before the query so a concurrent write can only
+        # make the cached entry look older than it is, never newer
+        versions_before = {package_id: versions.package_version(package_id) for package_id in missing}
+        rows = db.execute_query(query, missing, fetch=True) or []
+        for row in rows:
+            availability = _to_availability(row)
+            _availability_cache.set(row['id'], (versions_before[row['id']], availability))
+            result[row['id']] = availability
+
+    return result
+
+
+def get_package_availability(package_id):
+    return get_availability([package_id]).get(package_id)
+
+
+def live_slots(package_id):
+    """Uncached slot count, for code that is about to reserve"""
+    row = db.execute_query(
+        f"SELECT {AVAILABLE_SLOTS_SQL} AS available_slots FROM packages WHERE id = %s AND is_active = TRUE",
+        (package_id,), fetch=True
+    )
+    return int(row[0]['available_slots']) if row else 0
+
+
+# Slot reservation. Every change to available_slots goes through a single
+# conditional UPDATE, so the row lock is held only for one statement and the
+# count can never go below zero no matter how many requests race for it.
+#
+# A hot package can be striped: its slots are split over N rows of
+# package_inventory_stripes, and each booking only locks the stripe it takes
+# slots from, so N bookings for the same package can commit in parallel.
+# packages.available_slots of a striped package is a copy of the stripe sum
+# refreshed by sync_striped_totals(); it is never decremented directly.
+def _stripe_mode(cursor, package_id, refresh=False):
+    """Return (stripe_count, is_active) without locking the package row"""
+    if not refresh:
+        cached = _stripe_mode_cache.get(package_id)
+        if cached is not None:
+            return cached
+    cursor.execute("SELECT inventory_stripes, is_active FROM packages WHERE id = %s", (package_id,))
+    row = cursor.fetchone()
+    mode = (row['inventory_stripes'], bool(row['is_active'])) if row else (0, False)
+    _stripe_mode_cache.set(package_id, mode)
+    return mode
+
+
+def _reserve_striped(cursor, package_id, count):
+    cursor.execute(
+        "SELECT stripe_no, available_slots FROM package_inventory_stripes WHERE package_id = %s",
+        (package_id,)
+    )
+    stripes = cursor.fetchall()
+    if sum(stripe['available_slots'] for stripe in stripes) < count:
+        # Sold out; no need to lock anything to find that out
+        return False
+    
+    # Spread concurrent bookings over the stripes that can serve them alone
+    candidates = [stripe['stripe_no'] for stripe in stripes if stripe['available_slots'] >= count]
+    if candidates:
+        cursor.execute("""
+        UPDATE package_inventory_stripes
+        SET available_slots = available_slots - %s
+        WHERE package_id = %s AND stripe_no = %s AND available_slots >= %s
+        """, (count, package_id, random.choice(candidates), count))
+        if cursor.rowcount > 0:
+            return True
+    
+    return _rebalance_and_reserve(cursor, package_id, count)
+
+
+def _rebalance_and_reserve(cursor, package_id, count):
+    """Slow path when no single stripe has enough: lock every stripe in order,
+    take the slots from the total and spread what is left evenly again"""
+    cursor.execute("""
+    SELECT stripe_no, available_slots FROM package_inventory_stripes
+    WHERE package_id = %s
+    ORDER BY stripe_no
+    FOR UPDATE
+    """, (package_id,))
+    stripes = cursor.fetchall()
+    total = sum(stripe['available_slots'] for stripe in stripes)
+    if not stripes or total < count:
+        return False
+    
+    _write_stripes(cursor, package_id, [stripe['stripe_no'] for stripe in stripes], total - count)
+    return True
+
+
+def _write_stripes(cursor, package_id, stripe_numbers, total):
+    share, extra = divmod(total, len(stripe_numbers))
+    cases = ' '.join(['WHEN %s THEN %s'] * len(stripe_numbers))
+    params = []
+    for i, stripe_no in enumerate(stripe_numbers):
+        params.extend([stripe_no, share + (1 if i < extra else 0)])
+    cursor.execute(f"""
+    UPDATE package_inventory_stripes
+    SET available_slots = CASE stripe_no {cases} END
+    WHERE package_id = %s
+    """, params + [package_id])
+
+
+def _reserve(cursor, package_id, count):
+    mode = _stripe_mode(cursor, package_id)
+    for _ in range(2):
+        stripes, is_active = mode
+        if stripes:
+            if is_active and _reserve_striped(cursor, package_id, count):
+                return True
+        else:
+            cursor.execute("""
+            UPDATE packages
+            SET available_slots = available_slots - %s
+            WHERE id = %s AND is_active = TRUE AND inventory_stripes = 0 AND available_slots >= %s
+            """, (count, package_id, count))
+            if cursor.rowcount > 0:
+                return True
+        # Only try again if striping was switched on or off meanwhile
+        fresh = _stripe_mode(cursor, package_id, refresh=True)
+        if fresh == mode:
+            return False
+        mode = fresh
+    return False
+
+
+def _release(cursor, package_id, count):
+    stripes, _ = _stripe_mode(cursor, package_id)
+    for _ in range(2):
+        if stripes:
+            cursor.execute("""
+            UPDATE package_inventory_stripes
+            SET available_slots = available_slots + %s
+            WHERE package_id = %s AND stripe_no = %s
+            """, (count, package_id, random.randrange(stripes)))
+        else:
+            cursor.execute(
+                "UPDATE packages SET available_slots = available_slots + %s WHERE id = %s AND inventory_stripes = 0",
+                (count, package_id)
+            )
+        if cursor.rowcount > 0:
+            return
+        stripes, _ = _stripe_mode(cursor, package_id, refresh=True)
+    logger.warning(f"Could not release {count} slots of package {package_id}")
+
+
+def configure_stripes(package_id, stripe_count=None, total=None):
+    """Switch a package between striped (stripe_count > 0) and plain inventory,
+    moving its current slots over. stripe_count=None keeps the current mode;
+    total replaces the slot count (used when an admin edits it).
+    Returns the new stripe count, or None when the package does not exist."""
+    if stripe_count is not None:
+        stripe_count = max(0, min(int(stripe_count), MAX_STRIPES))
+    try:
+        with db.transaction(isolation_level=ISOLATION_LEVEL) as cursor:
+            # Locking the package row first stops plain reservations, locking
+            # the stripes in order stops striped ones
+            cursor.execute(
+                "SELECT available_slots, inventory_stripes FROM packages WHERE id = %s FOR UPDATE",
+                (package_id,)
+            )
+            package = cursor.fetchone()
+            if not package:
+                return None
+            cursor.execute("""
+            SELECT COALESCE(SUM(available_slots), 0) AS total FROM package_inventory_stripes
+            WHERE package_id = %s
+            FOR UPDATE
+            """, (package_id,))
+            striped_total = int(cursor.fetchone()['total'])
+            
+            if total is None:
+                total = striped_total if package['inventory_stripes'] else package['available_slots']
+            if stripe_count is None:
+                stripe_count = package['inventory_stripes']
+            
+            cursor.execute("DELETE FROM package_inventory_stripes WHERE package_id = %s", (package_id,))
+            if stripe_count:
+                cursor.executemany(
+                    "INSERT INTO package_inventory_stripes (package_id, stripe_no, available_slots) VALUES (%s, %s, 0)",
+                    [(package_id, stripe_no) for stripe_no in range(stripe_count)]
+                )
+                _write_stripes(cursor, package_id, list(range(stripe_count)), total)
+            cursor.execute(
+                "UPDATE packages SET inventory_stripes = %s, available_slots = %s WHERE id = %s",
+                (stripe_count, total, package_id)
+            )
+    except db.Error as e:
+        logger.error(f"Error configuring inventory stripes for package {package_id}: {e}")
+        return None
+    
+    _stripe_mode_cache.invalidate(package_id)
+    versions.package_changed(package_id)
+    slots_released([package_id])
+    return stripe_count
+
+
+def sync_striped_totals():
+    """Copy the stripe sums into packages.available_slots, so every page that
+    reads packages directly stays close to the live count. Returns the ids
+    of the packages that changed."""
+    with db.transaction(isolation_level=ISOLATION_LEVEL) as cursor:
+        cursor.execute(f"""
+        SELECT id, available_slots, {AVAILABLE_SLOTS_SQL} AS live_slots
+        FROM packages
+        WHERE inventory_stripes > 0
+        """)
+        changed = [package for package in cursor.fetchall() if package['available_slots'] != package['live_slots']]
+        for package in changed:
+            cursor.execute(
+                "UPDATE packages SET available_slots = %s WHERE id = %s AND inventory_stripes > 0",
+                (package['live_slots'], package['id'])
+            )
+    
+    for package in changed:
+        versions.package_changed(package['id'])
+    return [package['id'] for package in changed]
+
+
+def hold_booking(user_id, package_id, travelers_count, total_amount, hold_ttl=None):
+    """Reserve slots and create a pending booking holding them in one transaction.
+    The hold expires after hold_ttl seconds unless the booking is paid.
+    Returns (booking_id, message); booking_id is None when nothing was reserved."""
+    hold_ttl = HOLD_TTL_SECONDS if hold_ttl is None else hold_ttl
+    try:
+        with db.transaction(isolation_level=ISOLATION_LEVEL) as cursor:
+            if not _reserve(cursor, package_id, travelers_count):
+                return None, 'Not enough slots left for this package.'
+            
+            cursor.execute("""
+            INSERT INTO bookings (user_id, package_id, travelers_count, total_amount, status, payment_status,
+                                  slots_held, hold_expires_at)
+            VALUES (%s, %s, %s, %s, 'pending', 'pending', %s, NOW() + INTERVAL %s SECOND)
+            """, (user_id, package_id, travelers_count, total_amount, travelers_count, hold_ttl))
+            booking_id = cursor.lastrowid
+    except db.Error as e:
+        logger.error(f"Error reserving slots for package {package_id}: {e}")
+        return None, 'Booking failed. Please try again.'
+    
+    versions.package_changed(package_id)
+    versions.bookings_changed()
+    versions.user_changed(user_id)
+    booking_created(user_id, package_id)
+    return booking_id, ''
+
+
+def transition_booking(booking_id, status, user_id=None, from_statuses=None, fields=None, unpaid_only=False):
+    """Move a booking to `status`, reserving or releasing its slots as needed.
+
+    Cancelling releases whatever the booking holds; any other status makes
+    sure the booking holds its travelers_count. Extra columns to set (payment
+    details) can be passed in `fields`; unpaid_only refuses bookings whose
+    payment already completed. Returns (booking, message); booking is None
+    when the transition was refused.
+    """
+    query = """
+    SELECT id, user_id, package_id, travelers_count, status, payment_status, transaction_id, slots_held
+    FROM bookings
+    WHERE id = %s
+    """
+    params = [booking_id]
+    if user_id is not None:
+        query += " AND user_id = %s"
+        params.append(user_id)
+    query += " FOR UPDATE"
+    
+    slots_changed = False
+    try:
+        with db.transaction(isolation_level=ISOLATION_LEVEL) as cursor:
+            cursor.execute(query, params)
+            booking = cursor.fetchone()
+            if not booking:
+                return None, 'Booking not found.'
+            if from_statuses is not None and booking['status'] not in from_statuses:
+                return None, f"Booking is already {booking['status']}."
+            if unpaid_only and booking['payment_status'] == 'completed':
+                return None, 'Booking is already paid.'
+            
+            if status == 'cancelled':
+                if booking['status'] == 'cancelled':
+                    return None, 'Booking is already cancelled.'
+                if booking['slots_held']:
+                    _release(cursor, booking['package_id'], booking['slots_held'])
+                    slots_changed = True
+                slots_held = 0
+            else:
+                if not booking['slots_held']:
+                    if not _reserve(cursor, booking['package_id'], booking['travelers_count']):
+                        return None, 'Not enough slots left for this package.'
+                    slots_changed = True
+                slots_held = booking['travelers_count']
+            
+            updates = dict(fields or {}, status=status, slots_held=slots_held)
+            if status != 'pending':
+                updates['hold_expires_at'] = None
+            set_clause = ', '.join(f"{column} = %s" for column in updates)
+            params = list(updates.values())
+            if status == 'pending' and booking['status'] != 'pending':
+                # A fresh hold; confirmed and cancelled bookings have none, and
+                # a NULL expiry would keep the slots held forever
+                set_clause += ", hold_expires_at = NOW() + INTERVAL %s SECOND"
+                params.append(HOLD_TTL_SECONDS)
+            cursor.execute(
+                f"UPDATE bookings SET {set_clause} WHERE id = %s",
+                params + [booking_id]
+            )
+            booking.update(updates)
+    except db.Error as e:
+        logger.error(f"Error updating booking {booking_id} to {status}: {e}")
+        return None, 'Database error. Please try again.'
+    
+    versions.bookings_changed()
+    if slots_changed:
+        versions.package_changed(booking['package_id'])
+        if status == 'cancelled':
+            slots_released([booking['package_id']])
+    bookings_updated([booking['package_id']])
+    return booking, ''
+
+
+# A hold with a payment queued or being charged is kept until the payment
+# worker has confirmed or failed it
+_NO_ACTIVE_PAYMENT = """NOT EXISTS (
+        SELECT 1 FROM payment_jobs j
+        WHERE j.booking_id = b.id AND j.status IN ('queued', 'processing')
+    )"""
+
+
+def expire_stale_holds(batch_size):
+    """Cancel up to batch_size pending bookings whose hold has expired and
+    give their slots back with one UPDATE per package.
+    Returns (expired_bookings, released_slots)."""
+    candidates = db.execute_query(f"""
+    SELECT id FROM bookings b
+    WHERE status = 'pending' AND hold_expires_at < NOW() AND {_NO_ACTIVE_PAYMENT}
+    ORDER BY hold_expires_at
+    LIMIT %s
+    """, (batch_size,), fetch=True)
+    if not candidates:
+        return 0, 0
+    
+    booking_ids = [row['id'] for row in candidates]
+    placeholders = ','.join(['%s'] * len(booking_ids))
+    with db.transaction(isolation_level=ISOLATION_LEVEL) as cursor:
+        # Re-check under the row locks, a payment may have confirmed some of them
+        cursor.execute(f"""
+        SELECT id, user_id, package_id, slots_held FROM bookings b
+        WHERE id IN ({placeholders}) AND status = 'pending' AND hold_expires_at < NOW() AND {_NO_ACTIVE_PAYMENT}
+        FOR UPDATE
+        """, booking_ids)
+        expired = cursor.fetchall()
+        if not expired:
+            return 0, 0
+        
+        released = Counter()
+        for booking in expired:
+            released[booking['package_id']] += booking['slots_held']
+        for package_id in sorted(released):
+            if released[package_id]:
+                _release(cursor, package_id, released[package_id])
+        
+        expired_ids = [booking['id'] for booking in expired]
+        cursor.execute(f"""
+        UPDATE bookings
+        SET status = 'cancelled', payment_status = 'expired', slots_held = 0, hold_expires_at = NULL
+        WHERE id IN ({','.join(['%s'] * len(expired_ids))})
+        """, expired_ids)
+    
+    versions.bookings_changed()
+    for package_id in released:
+        versions.package_changed(package_id)
+    slots_released([package_id for package_id in released if released[package_id]])
+    bookings_updated(list(released))
+    for booking in expired:
+        notifications.notify_booking(
+            booking['user_id'], booking['id'], 'Booking expired',
+            f"Booking TB{booking['id']:04d} was not paid in time and its slots were released."
+        )
+    return len(expired), sum(released.values())
+
+
+def bulk_transition(status, booking_ids=None, filters=None, limit=MAX_BULK_BOOKINGS):
+    """Move many bookings to `status` in one transaction.
+
+    Targets are either explicit booking_ids or a filters dict (status,
+    package_id, user_id, booked_before), at most `limit` bookings. Slots are
+    released or reserved with one statement per package, and all bookings
+    that changed are updated with one statement. Returns a list of
+    {'booking_id', 'result', 'message'} with result one of 'updated',
+    'unchanged', 'failed' or 'not_found'.
+    """
+    if booking_ids is not None:
+        booking_ids = sorted(set(booking_ids))[:limit]
+        if not booking_ids:
+            return []
+        where = f"id IN ({','.join(['%s'] * len(booking_ids))})"
+        params = list(booking_ids)
+    else:
+        conditions, params = [], []
+        for column in ('status', 'package_id', 'user_id'):
+            if (filters or {}).get(column) is not None:
+                conditions.append(f"{column} = %s")
+                params.append(filters[column])
+        if (filters or {}).get('booked_before') is not None:
+            conditions.append("booking_date < %s")
+            params.append(filters['booked_before'])
+        if not conditions:
+            raise ValueError('A filter needs at least one condition')
+        where = ' AND '.join(conditions)
+    
+    results = {}
+    released, needed = Counter(), defaultdict(list)
+    try:
+        with db.transaction(isolation_level=ISOLATION_LEVEL) as cursor:
+            # Lock in primary key order, the same order every bulk call uses
+            cursor.execute(f"""
+            SELECT id, user_id, package_id, travelers_count, status, slots_held
+            FROM bookings
+            WHERE {where}
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE
+            """, params + [limit])
+            bookings = cursor.fetchall()
+            
+            owners = {booking['id']: booking['user_id'] for booking in bookings}
+            for booking in bookings:
+                if booking['status'] == status:
+                    results[booking['id']] = ('unchanged', f"Booking is already {status}.")
+                elif status == 'cancelled':
+                    released[booking['package_id']] += booking['slots_held']
+                    results[booking['id']] = ('updated', '')
+                elif booking['slots_held']:
+                    results[booking['id']] = ('updated', '')
+                else:
+                    needed[booking['package_id']].append(booking)
+            
+            for package_id in sorted(released):
+                if released[package_id]:
+                    _release(cursor, package_id, released[package_id])
+            
+            for package_id in sorted(needed):
+                waiting = needed[package_id]
+                if _reserve(cursor, package_id, sum(booking['travelers_count'] for booking in waiting)):
+                    for booking in waiting:
+                        results[booking['id']] = ('updated', '')
+                    continue
+                # Not enough for all of them: serve the oldest bookings first
+                for booking in waiting:
+                    if _reserve(cursor, package_id, booking['travelers_count']):
+                        results[booking['id']] = ('updated', '')
+                    else:
+                        results[booking['id']] = ('failed', 'Not enough slots left for this package.')
+            
+            updated_ids = [booking_id for booking_id, (result, _) in results.items() if result == 'updated']
+            if updated_ids:
+                slots_held = '0' if status == 'cancelled' else 'travelers_count'
+                # Bookings already pending are 'unchanged', so every updated one
+                # starts a fresh hold; a NULL expiry would never be swept
+                hold_expires_at = 'NOW() + INTERVAL %s SECOND' if status == 'pending' else 'NULL'
+                hold_params = [HOLD_TTL_SECONDS] if status == 'pending' else []
+                cursor.execute(f"""
+                UPDATE bookings
+                SET status = %s, slots_held = {slots_held}, hold_expires_at = {hold_expires_at}
+                WHERE id IN ({','.join(['%s'] * len(updated_ids))})
+                """, [status] + hold_params + updated_ids)
+    except db.Error as e:
+        logger.error(f"Error updating bookings to {status} in bulk: {e}")
+        return [{'booking_id': booking_id, 'result': 'failed', 'message': 'Database error. Please try again.'}
+                for booking_id in (booking_ids or [])]
+    
+    if any(result == 'updated' for result, _ in results.values()):
+        versions.bookings_changed()
+        for package_id in set(released) | set(needed):
+            versions.package_changed(package_id)
+        slots_released([package_id for package_id in released if released[package_id]])
+        bookings_updated([booking['package_id'] for booking in bookings if results[booking['id']][0] == 'updated'])
+    
+    summary = [{'booking_id': booking_id, 'user_id': owners[booking_id], 'result': result, 'message': message}
+               for booking_id, (result, message) in sorted(results.items())]
+    for booking_id in booking_ids or []:
+        if booking_id not in results:
+            summary.append({'booking_id': booking_id, 'result': 'not_found', 'message': 'Booking not found.'})
+    return summary
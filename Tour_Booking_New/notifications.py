@@ -0,0 +1,174 @@
+import logging
+import queue
+import threading
+
+import database as db
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# The writer inserts everything that queued up while it wrote the previous
+# batch, up to BATCH_SIZE rows per transaction
+BATCH_SIZE = 200
+POLL_INTERVAL_SECONDS = 0.5
+MAX_QUEUE_SIZE = 10000
+# Unread counts are kept up to date by this process's writes; the TTL bounds
+# how long a count changed by another process can be off
+UNREAD_COUNT_TTL = 60
+PER_PAGE = 20
+
+BOOKING = 'booking'
+PROMOTION = 'promotion'
+SYSTEM = 'system'
+
+_queue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
+_unread_counts = TTLCache(ttl=UNREAD_COUNT_TTL, max_entries=10000)
+_counts_lock = threading.Lock()
+_writer = None
+_stop_event = threading.Event()
+
+
+def notify(user_id, title, message, type=BOOKING, entity_type=None, entity_id=None):
+    """Queue a notification for the background writer; never blocks the caller
+    on the database unless the queue is full"""
+    row = (user_id, type, title, message, entity_type, entity_id)
+    try:
+        _queue.put_nowait(row)
+    except queue.Full:
+        # Write it ourselves rather than lose it
+        _write_batch([row])
+
+
+def notify_booking(user_id, booking_id, title, message):
+    notify(user_id, title, message, type=BOOKING, entity_type='booking', entity_id=booking_id)
+
+
+def _adjust_unread(user_id, delta=None, value=None):
+    """Keep a cached count in step with a write; uncached users are left alone
+    and counted on their next page view"""
+    with _counts_lock:
+        if value is not None:
+            _unread_counts.set(user_id, value)
+            return
+        count = _unread_counts.get(user_id)
+        if count is not None:
+            _unread_counts.set(user_id, max(0, count + delta))
+
+
+def _write_batch(rows):
+    try:
+        with db.transaction() as cursor:
+            cursor.executemany("""
+            INSERT INTO notifications (user_id, type, title, message, related_entity_type, related_entity_id)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """, rows)
+    except db.Error as e:
+        logger.error(f"Error writing {len(rows)} notifications: {e}")
+        return 0
+
+    added = {}
+    for row in rows:
+        added[row[0]] = added.get(row[0], 0) + 1
+    for user_id, count in added.items():
+        _adjust_unread(user_id, delta=count)
+    return len(rows)
+
+
+def flush():
+    """Write everything queued so far. Returns the number of rows written."""
+    written = 0
+    while True:
+        rows = []
+        try:
+            while len(rows) < BATCH_SIZE:
+                rows.append(_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if not rows:
+            return written
+        written += _write_batch(rows)
+
+
+def _run_writer():
+    while not _stop_event.is_set():
+        try:
+            first = _queue.get(timeout=POLL_INTERVAL_SECONDS)
+        except queue.Empty:
+            continue
+        # Whatever queued up while the last batch was written goes in this one
+        rows = [first]
+        try:
+            while len(rows) < BATCH_SIZE:
+                rows.append(_queue.get_nowait())
+        except queue.Empty:
+            pass
+        _write_batch(rows)
+    flush()
+
+
+def start_writer():
+    """Start the background writer once per process"""
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return _writer
+    _stop_event.clear()
+    _writer = threading.Thread(target=_run_writer, name='notification-writer', daemon=True)
+    _writer.start()
+    return _writer
+
+
+def stop_writer():
+    _stop_event.set()
+
+
+def unread_count(user_id):
+    """Unread notifications for the header badge, from the cache when possible"""
+    count = _unread_counts.get(user_id)
+    if count is not None:
+        return count
+    result = db.execute_query(
+        "SELECT COUNT(*) AS unread FROM notifications WHERE user_id = %s AND is_read = FALSE",
+        (user_id,), fetch=True
+    )
+    count = result[0]['unread'] if result else 0
+    _adjust_unread(user_id, value=count)
+    return count
+
+
+def get_page(user_id, page=1, per_page=PER_PAGE):
+    """Returns (notifications, total_pages) for one page, newest first"""
+    total = db.execute_query(
+        "SELECT COUNT(*) AS total FROM notifications WHERE user_id = %s", (user_id,), fetch=True
+    )
+    total = total[0]['total'] if total else 0
+    rows = db.execute_query("""
+    SELECT id, type, title, message, related_entity_type, related_entity_id, is_read, created_at
+    FROM notifications
+    WHERE user_id = %s
+    ORDER BY id DESC
+    LIMIT %s OFFSET %s
+    """, (user_id, per_page, (page - 1) * per_page), fetch=True) or []
+    return rows, max(1, (total + per_page - 1) // per_page)
+
+
+def mark_read(user_id, notification_ids):
+    """Mark the given notifications read with a single UPDATE. Returns how many changed."""
+    notification_ids = list(notification_ids)
+    if not notification_ids:
+        return 0
+    changed = db.execute_query(f"""
+    UPDATE notifications SET is_read = TRUE
+    WHERE user_id = %s AND is_read = FALSE AND id IN ({','.join(['%s'] * len(notification_ids))})
+    """, [user_id] + notification_ids, rowcount=True) or 0
+    if changed:
+        _adjust_unread(user_id, delta=-changed)
+    return changed
+
+
+def mark_all_read(user_id):
+    changed = db.execute_query(
+        "UPDATE notifications SET is_read = TRUE WHERE user_id = %s AND is_read = FALSE",
+        (user_id,), rowcount=True
+    ) or 0
+    _adjust_unread(user_id, value=0)
+    return changed
@@ -0,0 +1,295 @@
+import logging
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import database as db
+import inventory
+import notifications
+
+logger = logging.getLogger(__name__)
+
+WORKER_COUNT = 2
+# Workers also poll, so jobs queued by other processes are picked up
+POLL_INTERVAL_SECONDS = 1
+# A job left in 'processing' this long belongs to a worker that died; live
+# workers renew their lease every HEARTBEAT_SECONDS while the gateway runs
+STALE_JOB_SECONDS = 5 * 60
+HEARTBEAT_SECONDS = 30
+
+QUEUED = 'queued'
+PROCESSING = 'processing'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class GatewayResult:
+    def __init__(self, success, transaction_id=None, message=''):
+        self.success = success
+        self.transaction_id = transaction_id
+        self.message = message
+
+
+class PaymentGateway:
+    """Interface for payment providers. charge() may block for as long as the
+    provider takes; it only ever runs on the payment worker threads."""
+
+    def charge(self, amount, card_last_four, reference):
+        raise NotImplementedError
+
+    def refund(self, transaction_id, amount, reference):
+        raise NotImplementedError
+
+
+class SimulatedGateway(PaymentGateway):
+    """Local stand-in for a real gateway that injects latency and failures"""
+
+    def __init__(self, min_latency=0.2, max_latency=1.5, failure_rate=0.05):
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+        self.failure_rate = failure_rate
+
+    def charge(self, amount, card_last_four, reference):
+        time.sleep(random.uniform(self.min_latency, self.max_latency))
+        if random.random() < self.failure_rate:
+            return GatewayResult(False, message='Card declined by issuer')
+        return GatewayResult(True, transaction_id=f"TXN{uuid.uuid4().hex[:12].upper()}")
+
+    def refund(self, transaction_id, amount, reference):
+        time.sleep(random.uniform(self.min_latency, self.max_latency))
+        return GatewayResult(True, transaction_id=f"RFD{uuid.uuid4().hex[:12].upper()}")
+
+
+_gateway = SimulatedGateway()
+_workers = []
+_wakeup = threading.Event()
+_stop_event = threading.Event()
+
+
+def set_gateway(gateway):
+    global _gateway
+    _gateway = gateway
+
+
+def enqueue_payment(booking_id, user_id, card_last_four):
+    """Queue a payment for a booking awaiting one. Returns (job_id, message);
+    job_id is None when the booking is not payable or already has a payment
+    in flight. Never waits on the gateway."""
+    with db.transaction() as cursor:
+        # The booking row lock serializes concurrent submits for one booking,
+        # so two requests can never both queue a charge
+        cursor.execute("""
+        SELECT total_amount FROM bookings
+        WHERE id = %s AND user_id = %s
+        AND status IN ('pending', 'confirmed') AND payment_status != 'completed'
+        AND (status != 'pending' OR hold_expires_at IS NULL OR hold_expires_at > NOW())
+        FOR UPDATE
+        """, (booking_id, user_id))
+        booking = cursor.fetchone()
+        if not booking:
+            return None, 'Booking is not awaiting payment.'
+        cursor.execute("""
+        SELECT id FROM payment_jobs
+        WHERE booking_id = %s AND status IN ('queued', 'processing')
+        LIMIT 1
+        """, (booking_id,))
+        if cursor.fetchone():
+            return None, 'A payment for this booking is already being processed.'
+        cursor.execute("""
+        INSERT INTO payment_jobs (booking_id, user_id, amount, card_last_four, status)
+        VALUES (%s, %s, %s, %s, 'queued')
+        """, (booking_id, user_id, booking['total_amount'], card_last_four))
+        job_id = cursor.lastrowid
+    _wakeup.set()
+    return job_id, 'Payment submitted.'
+
+
+def get_job(job_id, user_id):
+    job = db.execute_query("""
+    SELECT id, booking_id, status, message, transaction_id, attempts, created_at, updated_at
+    FROM payment_jobs
+    WHERE id = %s AND user_id = %s
+    """, (job_id, user_id), fetch=True)
+    return job[0] if job else None
+
+
+def _claim_job():
+    """Atomically take the oldest queued job for this worker"""
+    claim_token = uuid.uuid4().hex
+    claimed = db.execute_query("""
+    UPDATE payment_jobs
+    SET status = 'processing', claim_token = %s, attempts = attempts + 1, updated_at = NOW()
+    WHERE status = 'queued'
+    ORDER BY id
+    LIMIT 1
+    """, (claim_token,), rowcount=True)
+    if not claimed:
+        return None
+    job = db.execute_query(
+        "SELECT * FROM payment_jobs WHERE claim_token = %s AND status = 'processing'",
+        (claim_token,), fetch=True
+    )
+    return job[0] if job else None
+
+
+def _finish_job(job, status, message, transaction_id=None):
+    """Record the outcome unless the job was requeued and claimed again
+    meanwhile; the newer claim owns the result then"""
+    finished = db.execute_query("""
+    UPDATE payment_jobs
+    SET status = %s, message = %s, transaction_id = %s, updated_at = NOW()
+    WHERE id = %s AND claim_token = %s AND status = 'processing'
+    """, (status, message, transaction_id, job['id'], job['claim_token']), rowcount=True)
+    if not finished:
+        logger.warning(f"Payment job {job['id']} was claimed by another worker, dropping result {status}")
+    return bool(finished)
+
+
+def _renew_lease(job, done):
+    """Keep updated_at fresh while the gateway call runs, so a slow charge
+    is never taken for a dead worker and charged again"""
+    while not done.wait(HEARTBEAT_SECONDS):
+        db.execute_query("""
+        UPDATE payment_jobs SET updated_at = NOW()
+        WHERE id = %s AND claim_token = %s AND status = 'processing'
+        """, (job['id'], job['claim_token']))
+
+
+def _charge(job):
+    done = threading.Event()
+    threading.Thread(target=_renew_lease, args=(job, done), name=f"payment-lease-{job['id']}", daemon=True).start()
+    try:
+        return _gateway.charge(job['amount'], job['card_last_four'], reference=f"job-{job['id']}")
+    finally:
+        done.set()
+
+
+def _refund(job, transaction_id):
+    """Give back a charge the booking could not take. Returns the message
+    for the customer."""
+    try:
+        result = _gateway.refund(transaction_id, job['amount'], reference=f"refund-job-{job['id']}")
+    except Exception as e:
+        logger.error(f"Gateway error refunding payment job {job['id']} ({transaction_id}): {e}")
+        result = None
+    if result is not None and result.success:
+        return f"The charge was refunded (refund {result.transaction_id})."
+    logger.error(f"Refund failed for payment job {job['id']} ({transaction_id}), needs manual refund")
+    return "The charge could not be refunded automatically; our team will refund it."
+
+
+def _payable(job):
+    """The booking still takes this payment: not cancelled and not paid"""
+    booking = db.execute_query("""
+    SELECT id FROM bookings
+    WHERE id = %s AND user_id = %s AND status IN ('pending', 'confirmed') AND payment_status != 'completed'
+    """, (job['booking_id'], job['user_id']), fetch=True)
+    return bool(booking)
+
+
+def process_job(job):
+    """Charge the gateway, then confirm the booking that holds the slots"""
+    if not _payable(job):
+        _finish_job(job, FAILED, 'Booking is no longer awaiting payment. You were not charged.')
+        return False
+
+    try:
+        result = _charge(job)
+    except Exception as e:
+        logger.error(f"Gateway error for payment job {job['id']}: {e}")
+        _finish_job(job, FAILED, 'Payment gateway error. Please try again.')
+        return False
+
+    if not result.success:
+        _finish_job(job, FAILED, result.message or 'Payment declined')
+        notifications.notify_booking(
+            job['user_id'], job['booking_id'], 'Payment failed',
+            f"The payment for booking TB{job['booking_id']:04d} was declined: {result.message or 'Payment declined'}"
+        )
+        return False
+
+    booking, message = inventory.transition_booking(
+        job['booking_id'], 'confirmed',
+        user_id=job['user_id'],
+        from_statuses=('pending', 'confirmed'),
+        unpaid_only=True,
+        fields={
+            'payment_status': 'completed',
+            'payment_method': 'Credit Card',
+            'transaction_id': result.transaction_id,
+            'card_last_four': job['card_last_four'],
+            'payment_date': datetime.now()
+        }
+    )
+    if not booking:
+        # Cancelled (or paid some other way) while we were charging
+        logger.warning(f"Payment job {job['id']} charged but booking refused: {message}")
+        refund_message = _refund(job, result.transaction_id)
+        _finish_job(job, FAILED, f"{message} {refund_message}", result.transaction_id)
+        notifications.notify_booking(
+            job['user_id'], job['booking_id'], 'Payment refunded',
+            f"Booking TB{job['booking_id']:04d} could not be confirmed: {message} {refund_message}"
+        )
+        return False
+
+    _finish_job(job, SUCCEEDED, 'Payment successful!', result.transaction_id)
+    notifications.notify_booking(
+        job['user_id'], job['booking_id'], 'Booking confirmed',
+        f"Payment received for booking TB{job['booking_id']:04d}. Transaction {result.transaction_id}."
+    )
+    return True
+
+
+def requeue_stale_jobs():
+    return db.execute_query("""
+    UPDATE payment_jobs SET status = 'queued', claim_token = NULL
+    WHERE status = 'processing' AND updated_at < NOW() - INTERVAL %s SECOND
+    """, (STALE_JOB_SECONDS,), rowcount=True)
+
+
+def _run_worker():
+    last_requeue = time.monotonic()
+    while not _stop_event.is_set():
+        if time.monotonic() - last_requeue > STALE_JOB_SECONDS:
+            last_requeue = time.monotonic()
+            try:
+                requeue_stale_jobs()
+            except Exception as e:
+                logger.error(f"Error requeueing stale payment jobs: {e}")
+
+        try:
+            job = _claim_job()
+        except Exception as e:
+            logger.error(f"Error claiming payment job: {e}")
+            job = None
+
+        if job is None:
+            _wakeup.wait(POLL_INTERVAL_SECONDS)
+            _wakeup.clear()
+            continue
+
+        try:
+            process_job(job)
+        except Exception as e:
+            logger.error(f"Error processing payment job {job['id']}: {e}")
+            _finish_job(job, FAILED, 'Payment processing failed. Please try again.')
+
+
+def start_workers(count=WORKER_COUNT):
+    """Start the payment worker pool once per process"""
+    if any(worker.is_alive() for worker in _workers):
+        return _workers
+    _stop_event.clear()
+    requeue_stale_jobs()
+    for i in range(count):
+        worker = threading.Thread(target=_run_worker, name=f'payment-worker-{i}', daemon=True)
+        worker.start()
+        _workers.append(worker)
+    return _workers
+
+
+def stop_workers():
+    _stop_event.set()
+    _wakeup.set()
@@ -0,0 +1,175 @@
+import logging
+import re
+from collections import namedtuple
+
+import database as db
+import versions
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+MAX_DESTINATIONS = 20
+MAX_DESTINATION_LENGTH = 100
+# Compiled filters are keyed on the user's shared version, so a save in any
+# process drops them everywhere; the TTL only bounds memory
+FILTER_TTL = 30 * 60
+MIGRATION_CHUNK_SIZE = 500
+
+# Inclusive price bounds for the budget_range values the forms send. The
+# named bands keep the old meaning: low < 10000, medium 10000-25000, high > 25000.
+BUDGET_BANDS = {
+    'low': (None, 9999.99),
+    'medium': (10000.0, 25000.0),
+    'high': (25000.01, None)
+}
+_RANGE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)")
+_OPEN_RANGE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*\+")
+
+_filters = TTLCache(ttl=FILTER_TTL, max_entries=20000)
+
+
+class PreferenceFilter(namedtuple('PreferenceFilter', 'destinations budget_min budget_max travel_style')):
+    """A user's preferences compiled into a predicate over package rows.
+    Hashable, so results computed for one filter can be cached and shared
+    by every user with the same preferences."""
+
+    __slots__ = ()
+
+    @property
+    def is_empty(self):
+        return not self.destinations and self.budget_min is None and self.budget_max is None and not self.travel_style
+
+    def matches(self, package):
+        if self.destinations and (package['destination'] or '').strip().lower() not in self.destinations:
+            return False
+        if self.travel_style and (package['category'] or '').strip().lower() != self.travel_style:
+            return False
+        price = float(package['price'] or 0)
+        if self.budget_min is not None and price < self.budget_min:
+            return False
+        if self.budget_max is not None and price > self.budget_max:
+            return False
+        return True
+
+
+def parse_destinations(text):
+    """Normalized destination names from the comma separated form field"""
+    destinations = []
+    for destination in (text or '').split(','):
+        destination = ' '.join(destination.split()).lower()[:MAX_DESTINATION_LENGTH]
+        if destination and destination not in destinations:
+            destinations.append(destination)
+    return destinations[:MAX_DESTINATIONS]
+
+
+def parse_budget(budget_range):
+    """(budget_min, budget_max) for a band name, "5000-10000" or "50000+"; either may be None"""
+    value = (budget_range or '').strip().lower()
+    if value in BUDGET_BANDS:
+        return BUDGET_BANDS[value]
+    match = _RANGE_RE.fullmatch(value)
+    if match:
+        low, high = sorted((float(match.group(1)), float(match.group(2))))
+        return low, high
+    match = _OPEN_RANGE_RE.fullmatch(value)
+    if match:
+        return float(match.group(1)), None
+    return None, None
+
+
+def compile_filter(destinations, budget_min, budget_max, travel_style):
+    return PreferenceFilter(
+        frozenset(destinations),
+        None if budget_min is None else float(budget_min),
+        None if budget_max is None else float(budget_max),
+        (travel_style or '').strip().lower() or None
+    )
+
+
+def _write_normalized(cursor, user_id, destinations, budget_range):
+    budget_min, budget_max = parse_budget(budget_range)
+    cursor.execute("DELETE FROM user_preferred_destinations WHERE user_id = %s", (user_id,))
+    if destinations:
+        cursor.executemany(
+            "INSERT INTO user_preferred_destinations (user_id, destination, position) VALUES (%s, %s, %s)",
+            [(user_id, destination, position) for position, destination in enumerate(destinations)]
+        )
+    cursor.execute("""
+    UPDATE user_preferences SET budget_min = %s, budget_max = %s, normalized = TRUE
+    WHERE user_id = %s
+    """, (budget_min, budget_max, user_id))
+
+
+def save(user_id, destinations_text, budget_range, travel_style, interests):
+    """Store the form as typed (shown back on the pages) together with the
+    normalized destinations and budget bounds, in one transaction"""
+    destinations = parse_destinations(destinations_text)
+    with db.transaction() as cursor:
+        cursor.execute("SELECT id FROM user_preferences WHERE user_id = %s FOR UPDATE", (user_id,))
+        if cursor.fetchone():
+            cursor.execute("""
+            UPDATE user_preferences
+            SET preferred_destinations = %s, budget_range = %s, travel_style = %s, interests = %s
+            WHERE user_id = %s
+            """, (destinations_text, budget_range, travel_style, interests, user_id))
+        else:
+            cursor.execute("""
+            INSERT INTO user_preferences (user_id, preferred_destinations, budget_range, travel_style, interests)
+            VALUES (%s, %s, %s, %s, %s)
+            """, (user_id, destinations_text, budget_range, travel_style, interests))
+        _write_normalized(cursor, user_id, destinations, budget_range)
+    _filters.invalidate(user_id)
+    versions.user_changed(user_id)
+
+
+def load(user_id):
+    """(row, PreferenceFilter) for the user, compiled once and cached; row is
+    None for users who never saved preferences"""
+    version = versions.user_version(user_id)
+    cached = _filters.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    row = db.execute_query("SELECT * FROM user_preferences WHERE user_id = %s", (user_id,), fetch=True)
+    row = row[0] if row else None
+    if row is None:
+        compiled = None
+    elif row.get('normalized'):
+        destinations = db.execute_query("""
+        SELECT destination FROM user_preferred_destinations WHERE user_id = %s ORDER BY position
+        """, (user_id,), fetch=True) or []
+        compiled = compile_filter([d['destination'] for d in destinations], row['budget_min'], row['budget_max'],
+                                  row['travel_style'])
+    else:
+        # Not migrated yet, read the free text the same way the migration will
+        compiled = compile_filter(parse_destinations(row['preferred_destinations']),
+                                  *parse_budget(row['budget_range']), row['travel_style'])
+
+    _filters.set(user_id, (version, (row, compiled)))
+    return row, compiled
+
+
+def migrate_legacy_rows(chunk_size=MIGRATION_CHUNK_SIZE):
+    """Fill the destination link table and budget bounds for rows saved as
+    free text only. Safe to run repeatedly; returns the rows migrated."""
+    migrated = 0
+    while True:
+        rows = db.execute_query("""
+        SELECT user_id, preferred_destinations, budget_range FROM user_preferences
+        WHERE normalized = FALSE
+        ORDER BY id
+        LIMIT %s
+        """, (chunk_size,), fetch=True)
+        if not rows:
+            break
+        with db.transaction() as cursor:
+            for row in rows:
+                _write_normalized(cursor, row['user_id'], parse_destinations(row['preferred_destinations']),
+                                  row['budget_range'])
+        migrated += len(rows)
+        if len(rows) < chunk_size:
+            break
+    if migrated:
+        _filters.invalidate()
+        logger.info(f"Normalized {migrated} user_preferences rows")
+    return migrated
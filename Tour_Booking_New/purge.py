@@ -0,0 +1,243 @@
+import logging
+import threading
+import time
+import uuid
+
+import database as db
+import inventory
+import versions
+
+logger = logging.getLogger(__name__)
+
+# Rows deleted per statement, and the pause between statements that lets
+# other transactions get at the tables in between
+CHUNK_SIZE = 500
+CHUNK_PAUSE_SECONDS = 0.05
+POLL_INTERVAL_SECONDS = 2
+# Running jobs report progress after every chunk; one that has been silent
+# this long belongs to a worker that died
+STALE_JOB_SECONDS = 2 * 60
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+# (table, primary key) in the order they are emptied; the users row goes last
+USER_TABLES = (
+    ('feedback', 'id'),
+    ('user_preferred_destinations', 'destination'),
+    ('user_preferences', 'id'),
+    ('chatbot_conversations', 'id'),
+    ('notifications', 'id'),
+    ('idempotency_keys', 'idempotency_key'),
+    ('payment_jobs', 'id'),
+    ('package_waitlist', 'id'),
+    ('bookings', 'id')
+)
+
+_worker = None
+_wakeup = threading.Event()
+_stop_event = threading.Event()
+
+
+def enqueue_purge(user_id, requested_by):
+    """Queue deletion of a user and everything they own. Returns the job id;
+    an unfinished job for the same user is returned instead of a new one."""
+    existing = db.execute_query("""
+    SELECT id FROM user_purge_jobs
+    WHERE user_id = %s AND status IN ('queued', 'running')
+    """, (user_id,), fetch=True)
+    if existing:
+        return existing[0]['id']
+
+    job_id = db.execute_query("""
+    INSERT INTO user_purge_jobs (user_id, requested_by, status) VALUES (%s, %s, 'queued')
+    """, (user_id, requested_by))
+    if job_id:
+        _wakeup.set()
+    return job_id
+
+
+def get_job(job_id):
+    job = db.execute_query("SELECT * FROM user_purge_jobs WHERE id = %s", (job_id,), fetch=True)
+    if not job:
+        return None
+    job = job[0]
+    if job['status'] == COMPLETED:
+        job['percent'] = 100.0
+    elif job['total_rows']:
+        # Rows added while the job runs can push deleted_rows past the count
+        job['percent'] = min(99.9, round(100 * job['deleted_rows'] / job['total_rows'], 1))
+    else:
+        job['percent'] = 0.0
+    return job
+
+
+def _update_job(job_id, **fields):
+    set_clause = ', '.join(f"{column} = %s" for column in fields)
+    db.execute_query(
+        f"UPDATE user_purge_jobs SET {set_clause}, updated_at = NOW() WHERE id = %s",
+        list(fields.values()) + [job_id]
+    )
+
+
+def _count_rows(user_id):
+    total = 0
+    for table, _ in USER_TABLES:
+        count = db.execute_query(f"SELECT COUNT(*) AS rows_left FROM {table} WHERE user_id = %s",
+                                 (user_id,), fetch=True)
+        total += count[0]['rows_left'] if count else 0
+    return total + 1
+
+
+def release_user_slots(user_id):
+    """Cancel every booking of the user that still holds slots and give the
+    slots back with one UPDATE per package. Returns the released slot count."""
+    with db.transaction(isolation_level=inventory.ISOLATION_LEVEL) as cursor:
+        cursor.execute("""
+        SELECT id, package_id, slots_held FROM bookings
+        WHERE user_id = %s AND slots_held > 0
+        ORDER BY id
+        FOR UPDATE
+        """, (user_id,))
+        holding = cursor.fetchall()
+        if not holding:
+            return 0
+
+        released = {}
+        for booking in holding:
+            released[booking['package_id']] = released.get(booking['package_id'], 0) + booking['slots_held']
+        for package_id in sorted(released):
+            inventory._release(cursor, package_id, released[package_id])
+
+        booking_ids = [booking['id'] for booking in holding]
+        cursor.execute(f"""
+        UPDATE bookings SET status = 'cancelled', slots_held = 0, hold_expires_at = NULL
+        WHERE id IN ({','.join(['%s'] * len(booking_ids))})
+        """, booking_ids)
+
+    versions.bookings_changed()
+    for package_id in released:
+        versions.package_changed(package_id)
+    inventory.slots_released(list(released))
+    inventory.bookings_updated(list(released))
+    return sum(released.values())
+
+
+def _delete_chunks(job_id, user_id, table, key, deleted_rows, chunk_size, pause):
+    """Delete the user's rows from one table in primary key order"""
+    condition = "user_id = %s"
+    if table == 'bookings':
+        # Bookings that hold slots are released first, never deleted directly
+        condition += " AND slots_held = 0"
+    while not _stop_event.is_set():
+        deleted = db.execute_query(f"""
+        DELETE FROM {table} WHERE {condition} ORDER BY {key} LIMIT %s
+        """, (user_id, chunk_size), rowcount=True) or 0
+        deleted_rows += deleted
+        _update_job(job_id, deleted_rows=deleted_rows)
+        if deleted < chunk_size:
+            return deleted_rows
+        time.sleep(pause)
+    raise RuntimeError('Purge worker stopped')
+
+
+def run_purge(job, chunk_size=CHUNK_SIZE, pause=CHUNK_PAUSE_SECONDS):
+    job_id, user_id = job['id'], job['user_id']
+    _update_job(job_id, step='counting', total_rows=_count_rows(user_id))
+
+    _update_job(job_id, step='releasing_slots')
+    released_slots = release_user_slots(user_id)
+    _update_job(job_id, released_slots=released_slots)
+
+    # Deleting waitlist entries moves everyone behind them up the queue
+    waitlisted = db.execute_query(
+        "SELECT DISTINCT package_id FROM package_waitlist WHERE user_id = %s", (user_id,), fetch=True
+    ) or []
+
+    deleted_rows = 0
+    for table, key in USER_TABLES:
+        _update_job(job_id, step=table)
+        deleted_rows = _delete_chunks(job_id, user_id, table, key, deleted_rows, chunk_size, pause)
+
+    # A booking made while we were deleting still holds slots; release and
+    # delete it too before the user row goes
+    released_slots += release_user_slots(user_id)
+    deleted_rows = _delete_chunks(job_id, user_id, 'bookings', 'id', deleted_rows, chunk_size, pause)
+
+    _update_job(job_id, step='users')
+    deleted_rows += db.execute_query("DELETE FROM users WHERE id = %s", (user_id,), rowcount=True) or 0
+    if db.execute_query("SELECT id FROM users WHERE id = %s", (user_id,), fetch=True):
+        raise db.Error('The user row could not be deleted')
+
+    _update_job(job_id, status=COMPLETED, step='done', deleted_rows=deleted_rows, released_slots=released_slots)
+    versions.feedback_changed()
+    versions.bookings_changed()
+    versions.users_changed()
+    for row in waitlisted:
+        versions.waitlist_changed(row['package_id'])
+    logger.info(f"Purged user {user_id}: {deleted_rows} rows, {released_slots} slots released")
+
+
+def _claim_job():
+    claim_token = uuid.uuid4().hex
+    claimed = db.execute_query("""
+    UPDATE user_purge_jobs SET status = 'running', claim_token = %s, updated_at = NOW()
+    WHERE status = 'queued'
+    ORDER BY id
+    LIMIT 1
+    """, (claim_token,), rowcount=True)
+    if not claimed:
+        return None
+    job = db.execute_query(
+        "SELECT * FROM user_purge_jobs WHERE claim_token = %s AND status = 'running'",
+        (claim_token,), fetch=True
+    )
+    return job[0] if job else None
+
+
+def requeue_stale_jobs():
+    """Hand jobs of dead workers to a live one; every step can safely repeat"""
+    return db.execute_query("""
+    UPDATE user_purge_jobs SET status = 'queued', claim_token = NULL
+    WHERE status = 'running' AND updated_at < NOW() - INTERVAL %s SECOND
+    """, (STALE_JOB_SECONDS,), rowcount=True)
+
+
+def _run_worker():
+    while not _stop_event.is_set():
+        try:
+            job = _claim_job()
+        except Exception as e:
+            logger.error(f"Error claiming purge job: {e}")
+            job = None
+
+        if job is None:
+            _wakeup.wait(POLL_INTERVAL_SECONDS)
+            _wakeup.clear()
+            continue
+
+        try:
+            run_purge(job)
+        except Exception as e:
+            logger.error(f"Error purging user {job['user_id']}: {e}")
+            # Everything deleted so far stays deleted; queueing the user again resumes
+            _update_job(job['id'], status=FAILED, message=str(e)[:255])
+
+
+def start_worker():
+    """Start the purge worker once per process"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    _stop_event.clear()
+    requeue_stale_jobs()
+    _worker = threading.Thread(target=_run_worker, name='user-purge', daemon=True)
+    _worker.start()
+    return _worker
+
+
+def stop_worker():
+    _stop_event.set()
+    _wakeup.set()
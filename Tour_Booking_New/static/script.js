@@ -151,11 +151,36 @@ document.addEventListener('DOMContentLoaded', function() {
             .catch(error => console.error('Error loading content:', error));
     }
 
+    // Refresh slot badges for every visible package card with one batch request
+    function refreshListingAvailability() {
+        const cards = document.querySelectorAll('[data-package-id]');
+        if (cards.length === 0) {
+            return;
+        }
+
+        const ids = Array.from(cards).map(card => card.getAttribute('data-package-id'));
+        TourBookAPI.checkAvailabilityBatch(ids).then(data => {
+            (data.packages || []).forEach(availability => {
+                const card = document.querySelector(`[data-package-id="${availability.package_id}"]`);
+                const badge = card ? card.querySelector('.slots-badge') : null;
+                if (badge) {
+                    const slots = availability.available_slots;
+                    badge.textContent = `${slots} slots`;
+                    badge.classList.remove('bg-success', 'bg-warning', 'bg-danger');
+                    badge.classList.add(slots > 5 ? 'bg-success' : slots > 0 ? 'bg-warning' : 'bg-danger');
+                }
+            });
+        });
+    }
+
     // Initialize any package availability checks
     const packageId = document.getElementById('package_id');
     if (packageId) {
         checkPackageAvailability(packageId.value);
     }
+
+    refreshListingAvailability();
+    setInterval(refreshListingAvailability, 30000);
 });
 
 // Password strength calculator
@@ -196,6 +221,17 @@ const TourBookAPI = {
         }
     },
 
+    // Check availability for many packages in a single request
+    checkAvailabilityBatch: async function(packageIds) {
+        try {
+            const response = await fetch(`/api/packages/availability?ids=${packageIds.join(',')}`);
+            return await response.json();
+        } catch (error) {
+            console.error('API Error:', error);
+            return { packages: [], missing: packageIds };
+        }
+    },
+
     // Get user recommendations
     getRecommendations: async function(userId) {
         try {
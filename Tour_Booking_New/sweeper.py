@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+
+import idempotency
+import inventory
+import payments
+import purge
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL_SECONDS = 30
+SWEEP_BATCH_SIZE = 200
+
+_thread = None
+_stop_event = threading.Event()
+_metrics_lock = threading.Lock()
+metrics = {
+    'runs': 0,
+    'batches': 0,
+    'expired_bookings': 0,
+    'released_slots': 0,
+    'evicted_idempotency_keys': 0,
+    'synced_striped_packages': 0,
+    'errors': 0,
+    'last_run_at': None,
+    'last_run_ms': 0.0,
+    'last_error': None
+}
+
+
+def sweep_once(batch_size=SWEEP_BATCH_SIZE):
+    """Expire stale holds in batches until a batch comes back short, then
+    evict old idempotency keys, requeue payment and purge jobs of dead
+    workers and refresh packages.available_slots of striped packages"""
+    started = time.perf_counter()
+    expired_total = released_total = batches = evicted = synced = 0
+    try:
+        while True:
+            expired, released = inventory.expire_stale_holds(batch_size)
+            if expired:
+                batches += 1
+            expired_total += expired
+            released_total += released
+            if expired < batch_size:
+                break
+        evicted = idempotency.evict_expired()
+        payments.requeue_stale_jobs()
+        purge.requeue_stale_jobs()
+        synced = len(inventory.sync_striped_totals())
+    except Exception as e:
+        logger.error(f"Error sweeping expired holds: {e}")
+        with _metrics_lock:
+            metrics['errors'] += 1
+            metrics['last_error'] = str(e)
+
+    with _metrics_lock:
+        metrics['runs'] += 1
+        metrics['batches'] += batches
+        metrics['expired_bookings'] += expired_total
+        metrics['released_slots'] += released_total
+        metrics['evicted_idempotency_keys'] += evicted
+        metrics['synced_striped_packages'] += synced
+        metrics['last_run_at'] = time.time()
+        metrics['last_run_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+    if expired_total:
+        logger.info(f"Expired {expired_total} pending bookings, released {released_total} slots")
+    return expired_total
+
+
+def _run(interval, batch_size):
+    while not _stop_event.wait(interval):
+        sweep_once(batch_size)
+
+
+def start(interval=SWEEP_INTERVAL_SECONDS, batch_size=SWEEP_BATCH_SIZE):
+    """Start the background sweeper thread once per process"""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return _thread
+    _stop_event.clear()
+    _thread = threading.Thread(target=_run, args=(interval, batch_size), name='hold-sweeper', daemon=True)
+    _thread.start()
+    return _thread
+
+
+def stop():
+    _stop_event.set()
+
+
+def get_metrics():
+    with _metrics_lock:
+        return dict(metrics)
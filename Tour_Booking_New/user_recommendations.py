@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+import candidate_pools
+import cobooking
+import database as db
+import inventory
+import preferences
+import versions
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Packages kept per user; pages show the first few
+MAX_RESULTS = 12
+RESULT_TTL = 10 * 60
+MAX_CACHED_USERS = 20000
+# Users seen this recently get their results recomputed before they expire
+ACTIVE_WINDOW_SECONDS = 30 * 60
+PRECOMPUTE_INTERVAL_SECONDS = 60
+
+ALSO_BOOKED = 'also_booked'
+PREFERENCES = 'preferences'
+POPULAR = 'popular'
+
+_results = TTLCache(ttl=RESULT_TTL, max_entries=MAX_CACHED_USERS)
+_lock = threading.Lock()
+_generations = {}    # user_id -> bumped on every invalidation
+_last_seen = {}      # user_id -> monotonic time of the last read
+_pending_users = set()
+_worker = None
+_wakeup = threading.Event()
+_stop_event = threading.Event()
+
+
+def load_packages(package_ids):
+    """Active packages with the given ids, in the order given"""
+    if not package_ids:
+        return []
+    query = f"SELECT * FROM packages WHERE is_active = TRUE AND id IN ({','.join(['%s'] * len(package_ids))})"
+    rows = {row['id']: row for row in db.execute_query(query, list(package_ids), fetch=True) or []}
+    return [rows[package_id] for package_id in package_ids if package_id in rows]
+
+
+def booked_package_ids(user_id):
+    """Packages the user already booked, never recommended again"""
+    rows = db.execute_query(
+        "SELECT DISTINCT package_id FROM bookings WHERE user_id = %s", (user_id,), fetch=True
+    ) or []
+    return {row['package_id'] for row in rows}
+
+
+def compute(user_id):
+    """Co-booked packages first, then a draw from the user's preference
+    segment, then the most booked packages to fill up; none the user booked"""
+    # Read first: a write while we compute leaves the result already stale
+    version = versions.user_version(user_id)
+    preference_row, preference_filter = preferences.load(user_id)
+    booked = booked_package_ids(user_id)
+
+    picks = []
+    seen = set(booked)
+
+    def add(package_id, reason):
+        if package_id not in seen:
+            seen.add(package_id)
+            picks.append({'package_id': package_id, 'reason': reason})
+
+    for package_id, _ in cobooking.recommend_for_user(user_id, k=MAX_RESULTS, exclude=booked):
+        add(package_id, ALSO_BOOKED)
+    if preference_filter is not None:
+        for package in candidate_pools.sample(preference_filter, k=MAX_RESULTS, exclude=seen):
+            add(package['id'], PREFERENCES)
+    if len(picks) < MAX_RESULTS:
+        for package in candidate_pools.popular(MAX_RESULTS - len(picks), exclude=seen):
+            add(package['id'], POPULAR)
+
+    return {
+        'version': version,
+        'picks': picks[:MAX_RESULTS],
+        'preferences': preference_row,
+        'generated_at': datetime.now(),
+        'computed_at': time.monotonic()
+    }
+
+
+def _refresh(user_id):
+    with _lock:
+        generation = _generations.get(user_id, 0)
+    result = compute(user_id)
+    with _lock:
+        # An invalidation that arrived while we computed wins
+        if _generations.get(user_id, 0) == generation:
+            _results.set(user_id, result)
+    return result
+
+
+def get(user_id):
+    """The user's cached result, computed on a miss. The dict has 'picks'
+    ([{'package_id', 'reason'}], best first), 'preferences' and 'generated_at'."""
+    with _lock:
+        _last_seen[user_id] = time.monotonic()
+    result = _results.get(user_id)
+    if _is_stale(user_id, result):
+        result = _refresh(user_id)
+    return result
+
+
+def _is_stale(user_id, result):
+    # Preferences saved or a booking made in another process move the shared version
+    return result is None or result['version'] != versions.user_version(user_id)
+
+
+def get_packages(user_id, limit=6):
+    """(packages, result) for pages: the first `limit` picks as package rows,
+    each with the reason it was picked"""
+    result = get(user_id)
+    picks = result['picks'][:limit]
+    reasons = {pick['package_id']: pick['reason'] for pick in picks}
+    packages = load_packages([pick['package_id'] for pick in picks])
+    for package in packages:
+        package['recommendation_reason'] = reasons[package['id']]
+    return packages, result
+
+
+def invalidate(user_id):
+    """Drop the user's result, e.g. after new preferences or a booking, and
+    have the worker warm it again"""
+    with _lock:
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+        _results.invalidate(user_id)
+        _pending_users.add(user_id)
+    _wakeup.set()
+
+
+def _on_booking_created(user_id, package_id):
+    invalidate(user_id)
+
+
+def _users_to_refresh():
+    """Pending users plus active users whose result expires before the next pass"""
+    now = time.monotonic()
+    with _lock:
+        users = set(_pending_users)
+        _pending_users.clear()
+        for user_id, seen_at in list(_last_seen.items()):
+            if now - seen_at > ACTIVE_WINDOW_SECONDS:
+                del _last_seen[user_id]
+                continue
+            result = _results.get(user_id)
+            if _is_stale(user_id, result) or now - result['computed_at'] > RESULT_TTL - 2 * PRECOMPUTE_INTERVAL_SECONDS:
+                users.add(user_id)
+    return users
+
+
+def _run_worker():
+    while not _stop_event.is_set():
+        _wakeup.wait(PRECOMPUTE_INTERVAL_SECONDS)
+        _wakeup.clear()
+        for user_id in sorted(_users_to_refresh()):
+            try:
+                _refresh(user_id)
+            except Exception as e:
+                logger.error(f"Error precomputing recommendations for user {user_id}: {e}")
+
+
+def start_worker():
+    """Start the precompute worker once per process"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    _stop_event.clear()
+    inventory.on_booking_created(_on_booking_created)
+    _worker = threading.Thread(target=_run_worker, name='recommendation-precompute', daemon=True)
+    _worker.start()
+    return _worker
+
+
+def stop_worker():
+    _stop_event.set()
+    _wakeup.set()
@@ -0,0 +1,225 @@
+import atexit
+import hashlib
+import logging
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+import database as db
+
+logger = logging.getLogger(__name__)
+
+# Data version counters. Every code path that writes to a table bumps the
+# matching counter, so readers can tell whether anything changed without
+# querying the data itself. A version is (shared, local, unsynced): the local
+# counter moves the moment this process writes and keys in-process caches,
+# the shared one comes from the data_versions table and is the same in every
+# process. Bumps are added up in memory and written in one statement every
+# FLUSH_SECONDS, so bookings do not queue on the version rows; unsynced
+# counts the local bumps the shared value does not include yet.
+FLUSH_SECONDS = 0.5
+SYNC_SECONDS = 1.0
+# Per-user data is versioned in buckets, so data_versions stays small however
+# many users there are; a write also moves the other users of its bucket
+USER_BUCKETS = 256
+
+Version = namedtuple('Version', 'shared local unsynced')
+
+_counters = defaultdict(int)
+_pending = defaultdict(int)   # key -> bumps not written to data_versions yet
+_flushed = {}                 # key -> local counter included in the last flush
+_synced = {}                  # key -> local counter included in _shared
+_shared = {}
+_synced_at = 0.0
+_lock = threading.Lock()
+_sync_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flusher = None
+_wakeup = threading.Event()
+
+
+def _name(key):
+    return key if isinstance(key, str) else ':'.join(str(part) for part in key)
+
+
+def bump(*keys):
+    with _lock:
+        for key in keys:
+            _counters[key] += 1
+            _pending[key] += 1
+    _start_flusher()
+
+
+def flush():
+    """Write the pending bumps to data_versions in one statement. On error
+    they stay pending for the next try."""
+    with _flush_lock:
+        with _lock:
+            pending = dict(_pending)
+            _pending.clear()
+            counters = {key: _counters[key] for key in pending}
+        if not pending:
+            return
+        rows = sorted((_name(key), count) for key, count in pending.items())
+        try:
+            with db.transaction() as cursor:
+                cursor.execute(f"""
+                INSERT INTO data_versions (name, version) VALUES {','.join(['(%s, %s)'] * len(rows))}
+                ON DUPLICATE KEY UPDATE version = version + VALUES(version)
+                """, [value for row in rows for value in row])
+        except Exception as e:
+            logger.warning(f"Could not write data versions, retrying: {e}")
+            with _lock:
+                for key, count in pending.items():
+                    _pending[key] += count
+            return
+        with _lock:
+            _flushed.update(counters)
+
+
+def _run_flusher():
+    while True:
+        _wakeup.wait(FLUSH_SECONDS)
+        _wakeup.clear()
+        flush()
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    with _flush_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_run_flusher, name='data-versions', daemon=True)
+            _flusher.start()
+
+
+atexit.register(flush)
+
+
+def _sync():
+    """Reload the shared counters, at most once per SYNC_SECONDS; one query
+    no matter how many versions a request reads"""
+    global _shared, _synced, _synced_at
+    if time.monotonic() - _synced_at < SYNC_SECONDS:
+        return
+    with _sync_lock:
+        if time.monotonic() - _synced_at < SYNC_SECONDS:
+            return
+        with _lock:
+            flushed = dict(_flushed)
+        try:
+            with db.transaction() as cursor:
+                cursor.execute("SELECT name, version FROM data_versions")
+                rows = cursor.fetchall()
+        except Exception as e:
+            # Dropping to zero could make old ETags and cached bodies valid again
+            logger.warning(f"Could not load data versions, using the last ones seen: {e}")
+        else:
+            _shared = {row['name']: row['version'] for row in rows}
+            _synced = flushed
+        _synced_at = time.monotonic()
+
+
+def get(key):
+    _sync()
+    local = _counters[key]
+    return Version(_shared.get(_name(key), 0), local, local - _synced.get(key, 0))
+
+def package_changed(package_id=None):
+    """Call after writing to packages; omit package_id for bulk or new rows"""
+    if package_id is None:
+        bump('packages', 'packages_bulk')
+    else:
+        bump('packages', ('package', int(package_id)))
+
+
+def feedback_changed(package_id=None):
+    if package_id is None:
+        bump('feedback', 'feedback_bulk')
+    else:
+        bump('feedback', ('feedback', int(package_id)))
+
+
+def bookings_changed():
+    bump('bookings')
+
+
+def listing_changed():
+    """Call when what a package is changes (added, edited, shown or hidden),
+    as opposed to slot counts moving with bookings"""
+    bump('listings')
+
+
+def users_changed():
+    bump('users')
+
+
+def waitlist_changed(package_id):
+    bump(('waitlist', int(package_id)))
+
+
+def user_changed(user_id):
+    """Call after writing a user's preferences or bookings"""
+    bump(('user', int(user_id) % USER_BUCKETS))
+
+
+def package_images_changed():
+    bump('package_images')
+
+
+def package_version(package_id):
+    return (get('packages_bulk'), get(('package', package_id)))
+
+
+def feedback_version(package_id):
+    return (get('feedback_bulk'), get(('feedback', package_id)))
+
+
+def waitlist_version(package_id):
+    return get(('waitlist', package_id))
+
+
+def user_version(user_id):
+    return get(('user', int(user_id) % USER_BUCKETS))
+
+
+def package_images_version():
+    return get('package_images')
+
+
+def catalog_version():
+    return get('packages')
+
+
+def listing_version():
+    return get('listings')
+
+
+def stats_version():
+    return (get('bookings'), get('users'), get('packages'))
+
+
+class _Unsynced(Exception):
+    pass
+
+
+def _shared_only(part):
+    if isinstance(part, Version):
+        if part.unsynced:
+            raise _Unsynced
+        return part.shared
+    if isinstance(part, (tuple, list)):
+        return tuple(_shared_only(item) for item in part)
+    return part
+
+
+def make_etag(*parts):
+    """Build a strong ETag value from version numbers and other request parts.
+    Only shared versions go in, so every process gives the same ETag; None
+    while this process has writes the shared versions do not show yet."""
+    try:
+        parts = _shared_only(parts)
+    except _Unsynced:
+        return None
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
@@ -0,0 +1,239 @@
+import logging
+import threading
+
+import database as db
+import inventory
+import notifications
+import versions
+
+logger = logging.getLogger(__name__)
+
+# An offer is a pending booking holding the slots for this long; if it is
+# not paid in time the sweeper releases the slots and the next waiter gets them
+CLAIM_WINDOW_SECONDS = 10 * 60
+# Waiters looked at per package on each promotion pass
+MAX_OFFERS_PER_PASS = 50
+# Releases in this process wake the promoter at once; this periodic pass
+# catches releases made by other processes
+POLL_INTERVAL_SECONDS = 30
+
+WAITING = 'waiting'
+OFFERED = 'offered'
+CLAIMED = 'claimed'
+EXPIRED = 'expired'
+LEFT = 'left'
+
+_worker = None
+_wakeup = threading.Event()
+_stop_event = threading.Event()
+_pending_lock = threading.Lock()
+_pending_packages = set()
+
+
+def join(user_id, package_id, travelers_count):
+    """Add the user to the end of the package's queue with one insert.
+    Returns (joined, message); joined is False when the user is already
+    waiting or holds an offer."""
+    joined = db.execute_query("""
+    INSERT INTO package_waitlist (package_id, user_id, travelers_count, status)
+    SELECT %s, %s, %s, 'waiting' FROM DUAL
+    WHERE NOT EXISTS (
+        SELECT 1 FROM package_waitlist
+        WHERE user_id = %s AND package_id = %s AND status IN ('waiting', 'offered')
+    )
+    """, (package_id, user_id, travelers_count, user_id, package_id), rowcount=True)
+    if not joined:
+        return False, 'You are already on the waitlist for this package.'
+
+    versions.waitlist_changed(package_id)
+    # Slots may have come back between the sold out page and this request
+    notify([package_id])
+    return True, ''
+
+
+def leave(user_id, package_id):
+    left = db.execute_query("""
+    UPDATE package_waitlist SET status = 'left'
+    WHERE user_id = %s AND package_id = %s AND status = 'waiting'
+    """, (user_id, package_id), rowcount=True)
+    if left:
+        versions.waitlist_changed(package_id)
+    return bool(left)
+
+
+def get_entry(user_id, package_id):
+    """The user's open entry for a package with its queue position, or None"""
+    entry = db.execute_query("""
+    SELECT w.id, w.travelers_count, w.status, w.booking_id, w.offer_expires_at, w.created_at,
+           b.payment_status AS offer_payment_status, b.status AS offer_booking_status
+    FROM package_waitlist w
+    LEFT JOIN bookings b ON b.id = w.booking_id
+    WHERE w.user_id = %s AND w.package_id = %s AND w.status IN ('waiting', 'offered')
+    ORDER BY w.id DESC
+    LIMIT 1
+    """, (user_id, package_id), fetch=True)
+    if not entry:
+        return None
+
+    entry = entry[0]
+    if entry['status'] == OFFERED and (entry['offer_booking_status'] == 'cancelled' or
+                                       entry['offer_payment_status'] == 'completed'):
+        # Settled offer the promoter has not closed yet
+        return None
+    if entry['status'] == WAITING:
+        ahead = db.execute_query("""
+        SELECT COUNT(*) AS ahead FROM package_waitlist
+        WHERE package_id = %s AND status = 'waiting' AND id < %s
+        """, (package_id, entry['id']), fetch=True)
+        entry['position'] = (ahead[0]['ahead'] if ahead else 0) + 1
+    return entry
+
+
+def notify(package_ids):
+    """Wake the promoter for packages that just got slots back"""
+    with _pending_lock:
+        _pending_packages.update(package_ids)
+    _wakeup.set()
+
+
+def _close_settled_offers(package_id):
+    """Offers that were paid become claimed, offers whose hold was cancelled
+    or expired become expired"""
+    closed = db.execute_query("""
+    UPDATE package_waitlist w
+    JOIN bookings b ON b.id = w.booking_id
+    SET w.status = CASE WHEN b.payment_status = 'completed' THEN 'claimed' ELSE 'expired' END
+    WHERE w.package_id = %s AND w.status = 'offered'
+    AND (b.status = 'cancelled' OR b.payment_status = 'completed')
+    """, (package_id,), rowcount=True)
+    if closed:
+        versions.waitlist_changed(package_id)
+
+
+def _on_bookings_updated(package_ids):
+    """An offered booking may have been paid, confirmed or cancelled; the
+    entry package_detail renders changes with it"""
+    offered = db.execute_query(f"""
+    SELECT DISTINCT package_id FROM package_waitlist
+    WHERE status = 'offered' AND package_id IN ({','.join(['%s'] * len(package_ids))})
+    """, list(package_ids), fetch=True) or []
+    for row in offered:
+        _close_settled_offers(row['package_id'])
+        versions.waitlist_changed(row['package_id'])
+
+
+def promote(package_id):
+    """Offer free slots to the package's waiters in FIFO order. A party too big
+    for what is left is skipped, not dropped. Returns the number of offers made."""
+    _close_settled_offers(package_id)
+
+    free = inventory.live_slots(package_id)
+    if free <= 0:
+        return 0
+    package = db.execute_query("SELECT price FROM packages WHERE id = %s", (package_id,), fetch=True)
+    if not package:
+        return 0
+
+    # Waiters of deleted users are skipped even before the purge reaches them
+    waiters = db.execute_query("""
+    SELECT w.id, w.user_id, w.travelers_count FROM package_waitlist w
+    JOIN users u ON u.id = w.user_id
+    WHERE w.package_id = %s AND w.status = 'waiting'
+    ORDER BY w.id
+    LIMIT %s
+    """, (package_id, MAX_OFFERS_PER_PASS), fetch=True) or []
+
+    offers = 0
+    for waiter in waiters:
+        if waiter['travelers_count'] > free:
+            continue
+        booking_id, _ = inventory.hold_booking(
+            waiter['user_id'], package_id, waiter['travelers_count'],
+            package[0]['price'] * waiter['travelers_count'], hold_ttl=CLAIM_WINDOW_SECONDS
+        )
+        if not booking_id:
+            free = inventory.live_slots(package_id)
+            if free <= 0:
+                # Someone booked the slots directly in the meantime
+                break
+            if waiter['travelers_count'] <= free:
+                # The hold failed for this waiter, not for lack of slots; drop
+                # them so they cannot block everyone behind them
+                logger.warning(f"Could not hold package {package_id} for waitlist entry {waiter['id']}, expiring it")
+                db.execute_query(
+                    "UPDATE package_waitlist SET status = 'expired' WHERE id = %s AND status = 'waiting'",
+                    (waiter['id'],)
+                )
+            continue
+
+        offered = db.execute_query("""
+        UPDATE package_waitlist
+        SET status = 'offered', booking_id = %s, offered_at = NOW(),
+            offer_expires_at = NOW() + INTERVAL %s SECOND
+        WHERE id = %s AND status = 'waiting'
+        """, (booking_id, CLAIM_WINDOW_SECONDS, waiter['id']), rowcount=True)
+        if not offered:
+            # The waiter left while we were reserving, hand the slots back
+            inventory.transition_booking(booking_id, 'cancelled')
+            continue
+
+        notifications.notify_booking(
+            waiter['user_id'], booking_id, 'Slots available',
+            f"Slots opened up on a package you are waiting for. They are reserved for you as booking "
+            f"TB{booking_id:04d} for {CLAIM_WINDOW_SECONDS // 60} minutes; pay to claim them."
+        )
+        offers += 1
+        free -= waiter['travelers_count']
+        if free <= 0:
+            break
+
+    if offers:
+        versions.waitlist_changed(package_id)
+        logger.info(f"Offered slots of package {package_id} to {offers} waitlisted users")
+    return offers
+
+
+def _waiting_packages():
+    rows = db.execute_query(
+        "SELECT DISTINCT package_id FROM package_waitlist WHERE status IN ('waiting', 'offered')",
+        fetch=True
+    ) or []
+    return {row['package_id'] for row in rows}
+
+
+def _run_worker():
+    while not _stop_event.is_set():
+        woken = _wakeup.wait(POLL_INTERVAL_SECONDS)
+        _wakeup.clear()
+        with _pending_lock:
+            package_ids = set(_pending_packages)
+            _pending_packages.clear()
+        if not woken:
+            try:
+                package_ids |= _waiting_packages()
+            except Exception as e:
+                logger.error(f"Error listing waitlisted packages: {e}")
+
+        for package_id in sorted(package_ids):
+            try:
+                promote(package_id)
+            except Exception as e:
+                logger.error(f"Error promoting waitlist of package {package_id}: {e}")
+
+
+def start_worker():
+    """Start the promoter once per process and subscribe it to slot releases"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    _stop_event.clear()
+    inventory.on_slots_released(notify)
+    inventory.on_bookings_updated(_on_bookings_updated)
+    _worker = threading.Thread(target=_run_worker, name='waitlist-promoter', daemon=True)
+    _worker.start()
+    return _worker
+
+
+def stop_worker():
+    _stop_event.set()
+    _wakeup.set()